@@ -1,4 +1,8 @@
-from flask import Flask, jsonify, request
+from services.startup import import_timer, start_subsystems, startup_status, is_main_process
+# Time the imports below for /api/status; torch, TensorFlow, matplotlib, pandas and
+# google.generativeai are only imported where they are used or by background loaders
+import_timer.start()
+from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 import requests
 import base64
@@ -6,29 +10,31 @@ import tempfile
 import os
 import traceback
 import json
-import google.generativeai as genai
+from functools import lru_cache
 from dotenv import load_dotenv
 import io
 from io import BytesIO
-from datetime import datetime
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend
-import seaborn as sns
-import pandas as pd
+from datetime import datetime, timedelta
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import re
 import time
 from urllib.parse import quote
 import random
+import uuid
 
 from road_backend import road_bp
 from services.flight_data import start_flight_tracker, get_flights_data
 # Import the big roads extraction blueprint
 from road_extract import road_extract_bp
+from land_indices import land_indices_bp
 # Import the change detection service
-from change_detection import detect_building_changes
+from change_detection import (detect_building_changes, change_service, change_cache, change_jobs,
+                              change_janitor, CHANGE_SAVE_DIR, BATCH_MAX_PAIRS)
+from services.road_jobs import QueueFullError
+from services.model_registry import model_registry
+from werkzeug.utils import secure_filename
+import_timer.stop()
 
 # Load environment variables
 load_dotenv()
@@ -45,8 +51,12 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GEMINI_API_KEY or not GOOGLE_API_KEY or not GOOGLE_CX:
     raise ValueError("Required API keys (GEMINI_API_KEY, GOOGLE_API_KEY, GOOGLE_CX) must be set in environment variables")
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
+@lru_cache(maxsize=None)
+def _genai():
+    """google.generativeai, imported and configured on first use (it takes about a second to import)"""
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai
 
 
 app = Flask(__name__)
@@ -60,6 +70,12 @@ from flask import send_file
 
 app.register_blueprint(road_bp)
 app.register_blueprint(road_extract_bp)
+app.register_blueprint(land_indices_bp)
+# Not in spawned worker processes (road crop pool), which re-import this script as __mp_main__
+if is_main_process():
+    change_janitor.start()
+    # Road model, UNet: warmed up in background threads (or on first use, or right here; see STARTUP_MODE)
+    start_subsystems()
 
 class DisasterResponseAgent:
     def __init__(self):
@@ -497,7 +513,7 @@ class DisasterResponseAgent:
         # Try Gemini first
         if provider == "gemini" and GEMINI_API_KEY:
             try:
-                model = genai.GenerativeModel('gemini-2.5-flash')
+                model = _genai().GenerativeModel('gemini-2.5-flash')
                 response = model.generate_content(prompt)
                 if response and response.text:
                     return response.text
@@ -568,6 +584,9 @@ class DisasterResponseAgent:
         charts = {}
         
         try:
+            import matplotlib
+            matplotlib.use('Agg')  # Use non-GUI backend
+            import matplotlib.pyplot as plt
             # Set style
             plt.style.use('default')
             
@@ -835,7 +854,7 @@ class DisasterResponseAgent:
 
 **DISTRIBUTION:** Emergency Management Personnel Only  
 **CLASSIFICATION:** Official Use  
-**NEXT UPDATE:** {(datetime.now() + pd.Timedelta(hours=4)).strftime('%Y-%m-%d %H:%M UTC')}
+**NEXT UPDATE:** {(datetime.now() + timedelta(hours=4)).strftime('%Y-%m-%d %H:%M UTC')}
 """
         
         complete_report = report_content + technical_appendix
@@ -848,6 +867,14 @@ disaster_agent = DisasterResponseAgent()
 
 @app.route("/api/status")
 def status():
+    """Liveness plus per-subsystem readiness; answers as soon as the app is imported"""
+    startup = startup_status()
+    # Idle is fine: not loaded yet in lazy mode, or unloaded by the model registry
+    states = {name: subsystem["state"] for name, subsystem in startup["subsystems"].items()}
+    # A registry model whose last load failed keeps its error (last_error) while it is retried
+    failed = [name for name, subsystem in startup["subsystems"].items()
+              if subsystem["state"] == 'error' or (subsystem.get("last_error") and subsystem["state"] != 'ready')]
+    loading = [name for name, state in states.items() if state == 'loading' and name not in failed]
     return jsonify({
         "status": "✅ AI Disaster Response System ONLINE",
         "version": "3.0 - Production Ready",
@@ -869,9 +896,24 @@ def status():
             "🔗 Multi-Source Intelligence Fusion",
             "⚡ Emergency Priority Classification"
         ],
-        "system_health": "🟢 All Systems Operational"
+        "system_health": (f"🔴 Failed to load: {', '.join(failed)}" if failed else
+                          f"🟡 Loading: {', '.join(loading)}" if loading else "🟢 All Systems Operational"),
+        "startup": startup
     })
 
+@app.route("/api/models")
+def models_status():
+    """Model registry: memory budget, resident size and per-model load time, memory and inference count"""
+    return jsonify(model_registry.stats())
+
+@app.route("/api/models/<name>/unload", methods=["POST"])
+def unload_model(name):
+    if name not in model_registry.models:
+        return jsonify({"error": f"Unknown model {name}"}), 404
+    if not model_registry.evict(name):
+        return jsonify({"error": f"{name} is in use or not loaded"}), 409
+    return jsonify(model_registry.stats())
+
 @app.route("/api/test", methods=["GET"])
 def test_system():
     """Quick system test endpoint"""
@@ -879,7 +921,7 @@ def test_system():
     
     # Test Gemini
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        model = _genai().GenerativeModel('gemini-1.5-flash')
         response = model.generate_content("Test: Respond with 'Gemini OK'")
         test_results["gemini"] = "✅ Working" if response.text else "❌ Failed"
     except Exception as e:
@@ -1079,11 +1121,9 @@ def disaster_geojson():
     # Path to your small geojson file
     return send_file("disaster_national_sample.geojson", mimetype="application/json")
 
-import pandas as pd
-from flask import jsonify
-
 @app.route("/api/disaster-csv")
 def disaster_csv():
+    import pandas as pd
     df = pd.read_csv("disaster_points.csv")  # Use your actual CSV filename
     # Only keep necessary columns for frontend
     data = df[["id", "country", "location", "disastertype", "year", "latitude", "longitude"]].to_dict(orient="records")
@@ -1126,26 +1166,67 @@ def analyze_disasters():
         app.logger.error(f"Disaster analysis failed: {e}")
         return jsonify({'error': str(e)}), 500
 
+CHANGE_RESPONSE_MODES = ('json', 'urls', 'multipart')
+
+def _save_change_images(images, base_url):
+    """Write result PNGs next to the other change artifacts; returns {name}_url entries"""
+    prefix = f"input_{datetime.now().timestamp()}_change"
+    urls = {}
+    for name, data in images.items():
+        filename = f"{prefix}_{name}.png"
+        path = os.path.join(CHANGE_SAVE_DIR, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        change_janitor.add_file(path)
+        urls[f"{name}_url"] = f"{base_url}/api/change_file/{filename}"
+    return urls
+
+def _multipart_response(payload, images):
+    """multipart/mixed body: the JSON payload first, then one image/png part per result image"""
+    boundary = uuid.uuid4().hex
+    parts = [(b'Content-Type: application/json\r\nContent-Disposition: inline; name="result"',
+              json.dumps(payload).encode())]
+    parts += [(f'Content-Type: image/png\r\nContent-Disposition: inline; name="{name}"; '
+               f'filename="{name}.png"'.encode(), data) for name, data in images.items()]
+    body = b''.join(b'--' + boundary.encode() + b'\r\n' + headers + b'\r\n\r\n' + data + b'\r\n'
+                    for headers, data in parts)
+    body += b'--' + boundary.encode() + b'--\r\n'
+    return Response(body, content_type=f'multipart/mixed; boundary={boundary}')
+
 @app.route('/api/building-change-detection', methods=['POST'])
 def building_change_detection():
     """Built-up change detection endpoint"""
     try:
         app.logger.info("🏢 Building change detection request received")
         
-        data = request.json
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        
-        pre_image = data.get('pre_image')
-        post_image = data.get('post_image')
+        # multipart/form-data: the images are decoded straight from the upload streams;
+        # JSON: base64 data URIs (the original transport)
+        if request.files:
+            data = request.form
+            pre_image = request.files.get('pre_image')
+            post_image = request.files.get('post_image')
+        else:
+            data = request.get_json(silent=True)
+            if not data:
+                return jsonify({"error": "No data provided"}), 400
+            pre_image = data.get('pre_image')
+            post_image = data.get('post_image')
         
         if not pre_image or not post_image:
             return jsonify({"error": "Both pre and post images are required"}), 400
         
+        # Result images: "json" (base64 data URIs), "urls" (PNG files fetched by URL, the
+        # default for multipart uploads) or "multipart" (stats + PNGs in one multipart/mixed body)
+        response_mode = data.get('response') or ('urls' if request.files else 'json')
+        if response_mode not in CHANGE_RESPONSE_MODES:
+            return jsonify({"error": f"response must be one of {CHANGE_RESPONSE_MODES}"}), 400
+        stats_only = str(data.get('stats_only', False)).lower() in ('1', 'true', 'yes')
+        
         app.logger.info("Processing change detection...")
         
-        # Run change detection
-        result = detect_building_changes(pre_image, post_image)
+        # Run change detection (stats_only skips rendering the result images)
+        result = detect_building_changes(pre_image, post_image, visualize=not stats_only,
+                                         binary=response_mode != 'json')
         
         if result.get("error"):
             app.logger.error(f"Change detection failed: {result['error']}")
@@ -1153,12 +1234,18 @@ def building_change_detection():
         
         app.logger.info(f"✅ Change detection completed. Change percentage: {result.get('change_percentage', 0)}%")
         
-        return jsonify({
+        images = result.pop("images", {})
+        if response_mode == 'urls':
+            result.update(_save_change_images(images, request.host_url.rstrip('/')))
+        payload = {
             "status": "success",
             "message": "Built-up change detection completed successfully",
             "result": result,
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        if response_mode == 'multipart':
+            return _multipart_response(payload, images)
+        return jsonify(payload)
         
     except Exception as e:
         app.logger.error(f"Building change detection error: {e}")
@@ -1170,6 +1257,145 @@ def building_change_detection():
         }), 500
 
 
+@app.route('/api/building-change-detection/batch', methods=['POST'])
+def building_change_detection_batch():
+    """Change detection on N pre/post pairs: {"pairs": [{"id", "pre_image", "post_image"}, ...]}"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        pairs = data.get('pairs')
+        if not isinstance(pairs, list) or not pairs or not all(isinstance(p, dict) for p in pairs):
+            return jsonify({"error": "pairs must be a non-empty list of {pre_image, post_image} objects"}), 400
+        if len(pairs) > BATCH_MAX_PAIRS:
+            return jsonify({"error": f"At most {BATCH_MAX_PAIRS} pairs per request"}), 413
+        with change_service.lease() as service:
+            if not service.model:
+                return jsonify({"error": "Model not loaded. Please check MODEL_PATH in change_detection.py"}), 500
+            result = service.detect_changes_batch(pairs)
+        if result.get("error"):
+            return jsonify(result), 500
+        app.logger.info(f"✅ Batch change detection: {result['processed']}/{result['pairs']} pairs in "
+                        f"{result['forward_passes']} forward passes ({result['throughput_pairs_per_s']} pairs/s)")
+        return jsonify(dict(result, status="success", timestamp=datetime.now().isoformat()))
+    except Exception as e:
+        app.logger.error(f"Batch change detection error: {e}\n{traceback.format_exc()}")
+        return jsonify({"error": "Change detection processing failed", "details": str(e),
+                        "timestamp": datetime.now().isoformat()}), 500
+
+@app.route('/api/building-change-detection/benchmark', methods=['POST'])
+def building_change_detection_benchmark():
+    """Forward-pass latency at batch sizes 1, 8 and 32 (or {"batch_sizes": [...], "repeats": n})"""
+    try:
+        data = request.get_json(silent=True) or {}
+        batch_sizes = [min(64, max(1, int(b))) for b in data.get('batch_sizes', (1, 8, 32))]
+        repeats = min(20, max(1, int(data.get('repeats', 5))))
+        with change_service.lease() as service:
+            if not service.model:
+                return jsonify({"error": "Model not loaded. Please check MODEL_PATH in change_detection.py"}), 500
+            return jsonify(service.benchmark(batch_sizes, repeats))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Change detection benchmark error: {e}\n{traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/building-change-detection/parity', methods=['POST'])
+def building_change_detection_parity():
+    """IoU and output drift of the configured backend against eager PyTorch on {"pairs": [...]}"""
+    try:
+        pairs = (request.get_json(silent=True) or {}).get('pairs')
+        if not isinstance(pairs, list) or not pairs or not all(isinstance(p, dict) for p in pairs):
+            return jsonify({"error": "pairs must be a non-empty list of {pre_image, post_image} objects"}), 400
+        if len(pairs) > BATCH_MAX_PAIRS:
+            return jsonify({"error": f"At most {BATCH_MAX_PAIRS} pairs per request"}), 413
+        with change_service.lease() as service:
+            if not service.model:
+                return jsonify({"error": "Model not loaded. Please check MODEL_PATH in change_detection.py"}), 500
+            result = service.parity_pairs(pairs)
+        if result.get("error"):
+            return jsonify(result), 400
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Change detection parity error: {e}\n{traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/building-change-detection/cache', methods=['GET'])
+def building_change_detection_cache():
+    """Hit/miss counters and size of the change-result cache"""
+    return jsonify(change_cache.stats())
+
+# --- Tiled full-resolution change detection (GeoTIFF pairs, run as background jobs) ---
+def _run_tiled_change_job(job, pre_path, post_path, out_prefix):
+    try:
+        with change_service.lease() as service:
+            result = service.detect_changes_tiled(pre_path, post_path, out_prefix, progress=job)
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+        return {key: os.path.basename(value) if isinstance(value, str) else value for key, value in result.items()}
+    finally:
+        change_janitor.release(pre_path)
+
+def _change_result_urls(result, base_url):
+    urls = {f"{key}_url": f"{base_url}/api/change_file/{name}" for key, name in result.items() if key != "stats"}
+    return dict(urls, **result.get("stats", {}))
+
+@app.route('/api/building-change-detection/tiled', methods=['POST'])
+def building_change_detection_tiled():
+    """Queue full-resolution change detection on two GeoTIFFs (form files pre_image and post_image)"""
+    pre_path = post_path = None
+    submitted = False
+    try:
+        files = [request.files.get('pre_image'), request.files.get('post_image')]
+        if not all(files):
+            return jsonify({"error": "Both pre_image and post_image files are required"}), 400
+        if not all(f.filename.lower().endswith(('.tif', '.tiff')) for f in files):
+            return jsonify({"error": "Only GeoTIFF files supported"}), 400
+        prefix = os.path.join(CHANGE_SAVE_DIR, f"input_{datetime.now().timestamp()}")
+        pre_path, post_path = f"{prefix}_pre.tif", f"{prefix}_post.tif"
+        # Pinned (with the outputs, which share the prefix) until the job is done
+        change_janitor.pin(pre_path)
+        files[0].save(pre_path)
+        files[1].save(post_path)
+        job = change_jobs.submit(_run_tiled_change_job, pre_path, post_path, prefix)
+        submitted = True
+        base_url = request.host_url.rstrip('/')
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"{base_url}/api/building-change-detection/jobs/{job.id}",
+        }), 202
+    except QueueFullError as e:
+        return jsonify({"error": str(e), "queue": change_jobs.stats()}), 503
+    except Exception as e:
+        app.logger.error(f"Tiled change detection error: {e}\n{traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if pre_path and not submitted:
+            # Nothing will read the inputs: delete them now rather than on the janitor's TTL
+            for path in (pre_path, post_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            change_janitor.release(pre_path)
+
+@app.route('/api/building-change-detection/jobs/<job_id>')
+def building_change_detection_job(job_id):
+    job = change_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    status = job.to_dict()
+    if job.status == 'done':
+        status["result"] = _change_result_urls(job.result, request.host_url.rstrip('/'))
+    return jsonify(status)
+
+@app.route('/api/change_file/<filename>')
+def serve_change_file(filename):
+    fpath = os.path.join(CHANGE_SAVE_DIR, secure_filename(filename))
+    if not os.path.exists(fpath):
+        return 'Not found', 404
+    change_janitor.touch(filename)
+    return send_file(fpath)
+
 if __name__ == "__main__":
     print("🚀 STARTING AI DISASTER RESPONSE SYSTEM...")
     print("📡 APIs Configured: Google Search ✅, Gemini AI ✅, Hugging Face ✅, DeepSeek ✅, Groq ✅")
@@ -1179,4 +1405,5 @@ if __name__ == "__main__":
     print("=" * 60)
     flight_tracker = start_flight_tracker()
     
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # The reloader imports the whole app a second time in a child process; opt in with BACKEND_RELOAD=1
+    app.run(debug=True, host="0.0.0.0", port=5000, use_reloader=os.getenv("BACKEND_RELOAD") == "1")
\ No newline at end of file
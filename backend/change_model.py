@@ -0,0 +1,404 @@
+import torch
+import torch.nn as nn
+from torchvision import transforms
+from PIL import Image
+import os
+import numpy as np
+import io
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.inference_backends import TorchBackend, build_unet_backend, parity_check, sigmoid, benchmark
+from services.road_cache import file_sha256
+from services.change_cache import change_cache_key
+from services.change_tiled import detect_changes_tiled
+from services.road_jobs import NULL_PROGRESS
+from change_detection import (MODEL_CACHE_DIR, TILED_BATCH_SIZE, TILED_OVERLAP, BATCH_SIZE, VISUALIZATION,
+                              mask_stats, mask_png_data_uri, render_result_pngs, render_result_images)
+
+# --- UNet Model Definition ---
+class UNet(nn.Module):
+    def __init__(self, in_channels=6, out_channels=1):
+        super(UNet, self).__init__()
+        self.enc1 = self.conv_block(in_channels, 64)
+        self.enc2 = self.conv_block(64, 128)
+        self.enc3 = self.conv_block(128, 256)
+        self.enc4 = self.conv_block(256, 512)
+        self.pool = nn.MaxPool2d(2)
+        self.center = self.conv_block(512, 1024)
+        self.up4 = nn.ConvTranspose2d(1024, 512, kernel_size=2, stride=2)
+        self.dec4 = self.conv_block(1024, 512)
+        self.up3 = nn.ConvTranspose2d(512, 256, kernel_size=2, stride=2)
+        self.dec3 = self.conv_block(512, 256)
+        self.up2 = nn.ConvTranspose2d(256, 128, kernel_size=2, stride=2)
+        self.dec2 = self.conv_block(256, 128)
+        self.up1 = nn.ConvTranspose2d(128, 64, kernel_size=2, stride=2)
+        self.dec1 = self.conv_block(128, 64)
+        self.final = nn.Conv2d(64, out_channels, kernel_size=1)
+
+    def conv_block(self, in_channels, out_channels):
+        block = nn.Sequential(
+            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True)
+        )
+        return block
+
+    def forward(self, x):
+        enc1 = self.enc1(x)
+        enc2 = self.enc2(self.pool(enc1))
+        enc3 = self.enc3(self.pool(enc2))
+        enc4 = self.enc4(self.pool(enc3))
+        center = self.center(self.pool(enc4))
+        dec4 = self.up4(center)
+        dec4 = torch.cat([dec4, enc4], dim=1)
+        dec4 = self.dec4(dec4)
+        dec3 = self.up3(dec4)
+        dec3 = torch.cat([dec3, enc3], dim=1)
+        dec3 = self.dec3(dec3)
+        dec2 = self.up2(dec3)
+        dec2 = torch.cat([dec2, enc2], dim=1)
+        dec2 = self.dec2(dec2)
+        dec1 = self.up1(dec2)
+        dec1 = torch.cat([dec1, enc1], dim=1)
+        dec1 = self.dec1(dec1)
+        out = self.final(dec1)
+        return out
+
+class ChangeDetectionService:
+    def __init__(self, model_path=None, backend='torch', quantize=None, num_threads=None, compile_mode='trace',
+                 cache=None):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.image_size = (256, 256)
+        self.transform = transforms.Compose([
+            transforms.Resize(self.image_size),
+            transforms.ToTensor(),
+        ])
+        self.model = None
+        self.model_path = model_path
+        self.backend_kind = backend
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self.compile_mode = compile_mode
+        self.backend = None
+        self.fingerprint = None
+        self.cache = cache
+        if model_path:
+            self.load_model(model_path)
+
+    def load_model(self, model_path):
+        """Load the trained UNet model from the specified path"""
+        try:
+            self.model = UNet(in_channels=6, out_channels=1)
+            
+            if os.path.exists(model_path):
+                self.model.load_state_dict(torch.load(model_path, map_location=self.device))
+                self.model.to(self.device)
+                self.model.eval()
+                print(f"Model loaded successfully from {model_path}")
+                self.model_path = model_path
+                self.fingerprint = file_sha256(model_path)
+                tag = f"unet_{self.fingerprint[:12]}"
+                self.backend = build_unet_backend(self.backend_kind, self.model, self.quantize,
+                                                  MODEL_CACHE_DIR, tag=tag, num_threads=self.num_threads,
+                                                  compile_mode=self.compile_mode)
+                if self.backend_kind != 'torch':
+                    print(f"Change detection backend: {self.backend_kind} ({self.quantize or 'float32'})")
+            else:
+                print(f"Model file not found at {model_path}")
+                self.model = None
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            self.model = None
+
+    def forward(self, input_tensor):
+        """UNet logits for a (B, 6, H, W) tensor, run through the configured backend"""
+        if self.backend is None or self.backend.name == 'torch':
+            with torch.no_grad():
+                return self.model(input_tensor.to(self.device))
+        return torch.from_numpy(self.backend.predict(input_tensor.cpu().numpy()))
+
+    def _cache_key(self, model_input):
+        """Cache key of one (6, H, W) input tensor, or None without a cache"""
+        if self.cache is None or self.fingerprint is None:
+            return None
+        return change_cache_key(model_input.numpy(), self.fingerprint,
+                                {'backend': self.backend_kind, 'quantize': self.quantize, 'threshold': 0.5})
+
+    def predict_probs(self, batch):
+        """Change probabilities (B, H, W) for a (B, 6, H, W) float32 numpy batch"""
+        with torch.no_grad():
+            logits = self.forward(torch.from_numpy(batch))
+        return torch.sigmoid(logits).squeeze(1).cpu().numpy()
+
+    def parity(self, batches):
+        """Compare the configured backend with eager PyTorch on (B, 6, H, W) numpy batches"""
+        return parity_check(TorchBackend(self.model, self.device), self.backend, batches, to_prob=sigmoid)
+
+    def parity_pairs(self, pairs, batch_size=BATCH_SIZE):
+        """parity() on {'pre_image', 'post_image'} pairs; pairs that fail to decode are skipped"""
+        inputs = [tensor.numpy() for tensor in map(self._decode_pair, pairs) if tensor is not None]
+        if not inputs:
+            return {"error": "Failed to process images"}
+        batches = [np.stack(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)]
+        return dict(self.parity(batches), pairs=len(inputs))
+
+    def benchmark(self, batch_sizes=(1, 8, 32), repeats=5):
+        """Latency of the configured backend at each batch size, next to eager PyTorch"""
+        input_shape = (6,) + tuple(self.image_size)
+        configured = self.backend or TorchBackend(self.model, self.device)
+        result = {'configured': benchmark(configured, batch_sizes, input_shape, repeats)}
+        if configured.name != 'torch':
+            result['reference'] = benchmark(TorchBackend(self.model, self.device), batch_sizes, input_shape, repeats)
+            result['speedup'] = {r['batch_size']: round(ref['median_ms'] / r['median_ms'], 2)
+                                 for r, ref in zip(result['configured']['results'], result['reference']['results'])
+                                 if r['median_ms']}
+        return result
+
+    def preprocess_image(self, image_data):
+        """Preprocess uploaded image data: a base64 data URI, bytes, or a file-like upload stream"""
+        try:
+            # If image_data is base64 string, decode it
+            if isinstance(image_data, str):
+                image_data = base64.b64decode(image_data.split(',')[1])
+            
+            # Open image from bytes, or decode straight from the (multipart) stream
+            source = io.BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+            original_image = Image.open(getattr(source, 'stream', source)).convert('RGB')
+            
+            # Keep original size for visualization
+            original_size = original_image.size
+            
+            # Transform for model (resizes to 256x256)
+            tensor = self.transform(original_image)
+            
+            # Also create a resized version for consistent visualization
+            resized_image = original_image.resize(self.image_size, Image.LANCZOS)
+            
+            return tensor, resized_image, original_size
+        except Exception as e:
+            print(f"Error preprocessing image: {str(e)}")
+            return None, None, None
+
+    def detect_changes(self, pre_image_data, post_image_data, visualize=True, binary=False):
+        """Run change detection on pre and post images; visualize=False returns the stats only
+
+        With binary=True the result images are returned as PNG bytes under
+        "images" instead of data URIs, for transports that don't need base64.
+        """
+        if not self.model:
+            return {"error": "Model not loaded"}
+
+        try:
+            # Preprocess images
+            pre_tensor, pre_image, pre_original_size = self.preprocess_image(pre_image_data)
+            post_tensor, post_image, post_original_size = self.preprocess_image(post_image_data)
+
+            if pre_tensor is None or post_tensor is None:
+                return {"error": "Failed to process images"}
+
+            # Concatenate pre and post images along the channel dimension
+            input_tensor = torch.cat([pre_tensor, post_tensor], dim=0).unsqueeze(0)
+
+            # Same decoded pair, model and settings: reuse the mask instead of running the UNet
+            key = self._cache_key(input_tensor[0])
+            cached = self.cache.get(key) if key else None
+            if cached:
+                pred_mask, stats = cached
+            else:
+                # Run inference
+                with torch.no_grad():
+                    output = self.forward(input_tensor)
+                    pred = torch.sigmoid(output)
+                    pred_mask = (pred > 0.5).float().squeeze().cpu().numpy()
+                stats = mask_stats(pred_mask)
+                if key:
+                    self.cache.put(key, pred_mask, stats)
+
+            result = dict(stats, success=True, cached=bool(cached))
+            if not visualize:
+                return result
+
+            # Create visualization
+            if VISUALIZATION == 'matplotlib':
+                result_images = self.create_visualization(pre_image, post_image, pred_mask)
+                if binary:
+                    result["images"] = {name: base64.b64decode(uri.split(',', 1)[1])
+                                        for name, uri in result_images.items() if uri}
+                    return result
+            elif binary:
+                result["images"] = render_result_pngs(pre_image, post_image, pred_mask)
+                return result
+            else:
+                result_images = render_result_images(pre_image, post_image, pred_mask)
+            return dict(result, **{
+                "mask_image": result_images["mask"],
+                "comparison_image": result_images["comparison"],
+                "overlay_image": result_images["overlay"]
+            })
+
+        except Exception as e:
+            print(f"Error in change detection: {str(e)}")
+            return {"error": f"Change detection failed: {str(e)}"}
+
+    def _decode_pair(self, pair):
+        """(6, 256, 256) input tensor of one {'pre_image', 'post_image'} pair, or None"""
+        pre_tensor, _, _ = self.preprocess_image(pair.get('pre_image'))
+        post_tensor, _, _ = self.preprocess_image(pair.get('post_image'))
+        if pre_tensor is None or post_tensor is None:
+            return None
+        return torch.cat([pre_tensor, post_tensor], dim=0)
+
+    def detect_changes_batch(self, pairs, batch_size=BATCH_SIZE, decode_workers=None):
+        """Change detection on many pre/post pairs with as few forward passes as possible
+
+        Pairs are decoded in parallel threads (PIL releases the GIL while
+        decoding), stacked into (B, 6, 256, 256) tensors of up to batch_size
+        pairs and run through the UNet together. Returns per-pair stats and mask
+        PNGs in input order, plus timings and the throughput reached.
+        """
+        if not self.model:
+            return {"error": "Model not loaded"}
+        t0 = time.perf_counter()
+        workers = decode_workers or min(len(pairs), os.cpu_count() or 1) or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            tensors = list(pool.map(self._decode_pair, pairs))
+            t1 = time.perf_counter()
+            valid = [i for i, tensor in enumerate(tensors) if tensor is not None]
+            results = [{"index": i, "id": pair.get('id'), "error": "Failed to process images"}
+                       for i, pair in enumerate(pairs)]
+            masks, cached = {}, set()
+            keys = {i: self._cache_key(tensors[i]) for i in valid}
+            for i, key in keys.items():
+                hit = self.cache.get(key) if key else None
+                if hit:
+                    masks[i] = hit[0]
+                    cached.add(i)
+            todo = [i for i in valid if i not in cached]
+            forward_passes = 0
+            for start in range(0, len(todo), batch_size):
+                chunk = todo[start:start + batch_size]
+                with torch.no_grad():
+                    logits = self.forward(torch.stack([tensors[i] for i in chunk]))
+                    pred = (torch.sigmoid(logits) > 0.5).squeeze(1).cpu().numpy()
+                forward_passes += 1
+                for i, pred_mask in zip(chunk, pred):
+                    masks[i] = pred_mask
+                    if keys[i]:
+                        self.cache.put(keys[i], pred_mask, mask_stats(pred_mask))
+            t2 = time.perf_counter()
+            images = dict(zip(masks, pool.map(mask_png_data_uri, masks.values())))
+        for i, pred_mask in masks.items():
+            results[i] = dict(mask_stats(pred_mask), index=i, id=pairs[i].get('id'), success=True,
+                              cached=i in cached, mask_image=images[i])
+        t3 = time.perf_counter()
+        return {
+            "success": True,
+            "results": results,
+            "pairs": len(pairs),
+            "processed": len(valid),
+            "cached": len(cached),
+            "forward_passes": forward_passes,
+            "batch_size": batch_size,
+            "timings_ms": {"decode": round((t1 - t0) * 1000, 1), "inference": round((t2 - t1) * 1000, 1),
+                           "encode": round((t3 - t2) * 1000, 1), "total": round((t3 - t0) * 1000, 1)},
+            "throughput_pairs_per_s": round(len(valid) / (t3 - t0), 2) if t3 > t0 else None,
+        }
+
+    def detect_changes_tiled(self, pre_path, post_path, out_prefix, batch_size=TILED_BATCH_SIZE,
+                             overlap=TILED_OVERLAP, progress=NULL_PROGRESS):
+        """Full-resolution change detection on two GeoTIFFs (see services.change_tiled)
+
+        Unlike detect_changes nothing is resized: the pair is co-registered and
+        the UNet runs on overlapping 256x256 windows, batch_size pairs at a time.
+        """
+        if not self.model:
+            return {"error": "Model not loaded"}
+        return detect_changes_tiled(pre_path, post_path, out_prefix, self.predict_probs, batch_size=batch_size,
+                                    window_size=self.image_size[0], overlap=overlap, progress=progress)
+
+    def create_visualization(self, pre_image, post_image, pred_mask):
+        """Create visualization images as matplotlib figures (CHANGE_VISUALIZATION=matplotlib)"""
+        import matplotlib
+        matplotlib.use('Agg')  # Use non-GUI backend: this runs in request and job threads
+        import matplotlib.pyplot as plt
+        try:
+            # Create figure with subplots
+            fig, axes = plt.subplots(1, 4, figsize=(20, 5))
+            
+            # Pre-image
+            axes[0].imshow(pre_image)
+            axes[0].set_title("Pre-Image", fontsize=12)
+            axes[0].axis("off")
+            
+            # Post-image
+            axes[1].imshow(post_image)
+            axes[1].set_title("Post-Image", fontsize=12)
+            axes[1].axis("off")
+            
+            # Change mask
+            axes[2].imshow(pred_mask, cmap='Reds')
+            axes[2].set_title("Change Detection Mask", fontsize=12)
+            axes[2].axis("off")
+            
+            # Overlay - create red overlay for changes
+            overlay = np.array(post_image.copy())
+            
+            # Ensure pred_mask is the right shape (should be 256x256 same as resized images)
+            if len(pred_mask.shape) == 2:  # 2D mask
+                # Create red overlay for changes
+                red_overlay = np.zeros_like(overlay)
+                red_overlay[:, :, 0] = pred_mask * 255  # Red channel for changes
+                overlay = np.clip(overlay + red_overlay * 0.5, 0, 255).astype(np.uint8)
+            else:
+                print(f"Warning: Unexpected pred_mask shape: {pred_mask.shape}")
+                overlay = np.array(post_image.copy())  # Fallback to original image
+            axes[3].imshow(overlay)
+            axes[3].set_title("Change Overlay", fontsize=12)
+            axes[3].axis("off")
+            
+            plt.tight_layout()
+            
+            # Save to base64
+            buffer = io.BytesIO()
+            plt.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+            buffer.seek(0)
+            comparison_b64 = base64.b64encode(buffer.getvalue()).decode()
+            plt.close()
+            
+            # Create individual mask image
+            mask_fig, mask_ax = plt.subplots(figsize=(6, 6))
+            mask_ax.imshow(pred_mask, cmap='Reds')
+            mask_ax.set_title("Built-up Change Detection")
+            mask_ax.axis("off")
+            
+            mask_buffer = io.BytesIO()
+            mask_fig.savefig(mask_buffer, format='png', dpi=100, bbox_inches='tight')
+            mask_buffer.seek(0)
+            mask_b64 = base64.b64encode(mask_buffer.getvalue()).decode()
+            plt.close()
+            
+            # Create overlay image
+            overlay_fig, overlay_ax = plt.subplots(figsize=(6, 6))
+            overlay_ax.imshow(overlay)
+            overlay_ax.set_title("Changes Highlighted in Red")
+            overlay_ax.axis("off")
+            
+            overlay_buffer = io.BytesIO()
+            overlay_fig.savefig(overlay_buffer, format='png', dpi=100, bbox_inches='tight')
+            overlay_buffer.seek(0)
+            overlay_b64 = base64.b64encode(overlay_buffer.getvalue()).decode()
+            plt.close()
+            
+            return {
+                "mask": f"data:image/png;base64,{mask_b64}",
+                "comparison": f"data:image/png;base64,{comparison_b64}",
+                "overlay": f"data:image/png;base64,{overlay_b64}"
+            }
+            
+        except Exception as e:
+            print(f"Error creating visualization: {str(e)}")
+            return {"mask": "", "comparison": "", "overlay": ""}
@@ -0,0 +1,165 @@
+import json
+import os
+from datetime import datetime
+from flask import Blueprint, request, jsonify, send_file, current_app as app
+from werkzeug.utils import secure_filename
+from services.spectral_index import (compute_indices, parse_expressions, INDEX_EXPRESSIONS, SENTINEL2_LAYOUTS,
+                                     WINDOW_SIZE, HISTOGRAM_BINS, HISTOGRAM_RANGE)
+from services.road_jobs import RoadJobQueue, QueueFullError
+from services.startup import is_main_process
+from services.workspace import SAVE_DIR, InvalidUploadError, artifact_janitor, upload_manager
+
+land_indices_bp = Blueprint('land_indices', __name__)
+
+# Threads evaluating windows in parallel (None = all cores) and the window size in pixels
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", 0)) or None
+INDEX_WINDOW_SIZE = int(os.getenv("INDEX_WINDOW_SIZE", WINDOW_SIZE))
+# Index jobs have a queue of their own, so they don't hold up (or wait behind) road extractions
+INDEX_JOB_WORKERS = int(os.getenv("INDEX_JOB_WORKERS", 1))
+INDEX_JOB_MAX_QUEUED = int(os.getenv("INDEX_JOB_MAX_QUEUED", 8))
+
+index_jobs = RoadJobQueue(workers=INDEX_JOB_WORKERS, max_queued=INDEX_JOB_MAX_QUEUED)
+
+@land_indices_bp.record_once
+def _start_background_services(state):
+    # Shared with road extraction; start() is idempotent
+    if is_main_process():
+        artifact_janitor.start()
+
+def parse_index_options(form):
+    """Index request from the form; raises InvalidUploadError on bad values
+
+    - indices: comma-separated built-in names (default ndvi,ndwi,ndbi)
+    - expressions: JSON {"name": "band expression"}, e.g. {"evi2": "2.5 * (B8 - B4) / (B8 + 2.4 * B4 + 1)"}
+    - bands: JSON {"B4": 3, ...} mapping band names to 1-based raster bands
+    - range / bins: histogram range "min,max" and bin count
+    """
+    try:
+        custom = json.loads(form.get('expressions') or '{}')
+        band_map = json.loads(form.get('bands') or '{}')
+        value_range = tuple(float(v) for v in form.get('range', '%s,%s' % HISTOGRAM_RANGE).split(','))
+    except ValueError:
+        raise InvalidUploadError('expressions and bands must be JSON objects, range must be min,max')
+    if not isinstance(custom, dict) or not isinstance(band_map, dict):
+        raise InvalidUploadError('expressions and bands must be JSON objects')
+    if not all(isinstance(index, int) and not isinstance(index, bool) and index >= 1
+               for index in band_map.values()):
+        raise InvalidUploadError('bands must map band names to 1-based raster band numbers')
+    if len(value_range) != 2 or value_range[0] >= value_range[1]:
+        raise InvalidUploadError('range must be min,max with min < max')
+    default = '' if custom else ','.join(INDEX_EXPRESSIONS)
+    indices = [name.strip().lower() for name in form.get('indices', default).split(',') if name.strip()]
+    try:
+        expressions = parse_expressions(indices, custom)
+    except ValueError as e:
+        raise InvalidUploadError(str(e))
+    return {
+        'expressions': expressions,
+        'band_map': band_map,
+        'range': value_range,
+        'bins': min(1024, max(2, form.get('bins', HISTOGRAM_BINS, type=int))),
+    }
+
+def _input_path():
+    """Path of the raster to process: a finished chunked upload (upload_id) or a file in the form"""
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        session = upload_manager.get(upload_id)
+        if session is None:
+            raise InvalidUploadError('Unknown upload')
+        if not session.complete:
+            raise InvalidUploadError(f'Upload is {session.status}')
+        return session.path
+    if 'file' not in request.files:
+        raise InvalidUploadError('No file uploaded')
+    file = request.files['file']
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(('.tif', '.tiff')):
+        raise InvalidUploadError('Only TIFF files supported')
+    path = os.path.join(SAVE_DIR, f"input_{datetime.now().timestamp()}_{filename}")
+    file.save(path)
+    return path
+
+def _run_index_job(job, input_path, options):
+    try:
+        base = os.path.splitext(os.path.basename(input_path))[0]
+        results, info = compute_indices(input_path, os.path.join(SAVE_DIR, f"{base}_{job.id[:8]}"),
+                                        options['expressions'], band_map=options['band_map'],
+                                        window_size=INDEX_WINDOW_SIZE, workers=INDEX_WORKERS,
+                                        value_range=options['range'], bins=options['bins'], progress=job)
+        outputs = {}
+        for name, result in results.items():
+            outputs[name] = os.path.basename(result['raster'])
+            outputs[f'{name}_histograms'] = os.path.basename(result['histograms'])
+        outputs['stats'] = dict(info, indices={name: result['stats'] for name, result in results.items()})
+        return outputs
+    finally:
+        artifact_janitor.release(input_path)
+
+@land_indices_bp.route('/api/indices')
+def list_indices():
+    return jsonify({'indices': INDEX_EXPRESSIONS,
+                    'band_layouts': {str(count): names for count, names in SENTINEL2_LAYOUTS.items()}})
+
+@land_indices_bp.route('/api/indices/jobs', methods=['POST'])
+def submit_index_job():
+    """Queue NDVI/NDWI/NDBI (or custom expressions) over a multiband GeoTIFF; poll like a road job"""
+    input_path = None
+    submitted = False
+    try:
+        options = parse_index_options(request.form)
+        input_path = _input_path()
+        artifact_janitor.pin(input_path)
+        job = index_jobs.submit(_run_index_job, input_path, options)
+        submitted = True
+        base_url = request.host_url.rstrip('/')
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'indices': sorted(options['expressions']),
+            'status_url': f'{base_url}/api/indices/jobs/{job.id}',
+            'result_url': f'{base_url}/api/indices/jobs/{job.id}/result'
+        }), 202
+    except QueueFullError as e:
+        return jsonify({'error': str(e), 'queue': index_jobs.stats()}), 503
+    except InvalidUploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        app.logger.error(f"Error in /api/indices/jobs: {e}\n{traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if input_path and not submitted:
+            artifact_janitor.release(input_path)
+
+def index_result_urls(result, base_url):
+    """Map _run_index_job file names to /api/indices/files URLs ({name}_url, {name}_histograms_url)"""
+    urls = {f'{key}_url': f'{base_url}/api/indices/files/{name}' for key, name in result.items() if key != 'stats'}
+    urls['stats'] = result.get('stats', {})
+    return urls
+
+@land_indices_bp.route('/api/indices/jobs/<job_id>')
+def index_job_status(job_id):
+    job = index_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@land_indices_bp.route('/api/indices/jobs/<job_id>/result')
+def index_job_result(job_id):
+    job = index_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'error':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': 'Job not finished', 'status': job.status}), 409
+    return jsonify(index_result_urls(job.result, request.host_url.rstrip('/')))
+
+@land_indices_bp.route('/api/indices/files/<filename>')
+def serve_index_file(filename):
+    fpath = os.path.join(SAVE_DIR, secure_filename(filename))
+    if not os.path.exists(fpath):
+        return 'Not found', 404
+    artifact_janitor.touch(filename)
+    return send_file(fpath)
@@ -13,13 +13,12 @@ import tweepy                 # Twitter API v2
 import praw                   # Reddit API
 import exifread               # EXIF extraction
 import requests
-import spacy
 from tqdm import tqdm
 from PIL import Image
 from io import BytesIO
-from transformers import pipeline
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from services.model_registry import model_registry
 
 # --------------------------- Configuration --------------------------- #
 
@@ -94,12 +93,25 @@ def query_overpass(feature_name: str) -> Optional[tuple]:
 
 # --------------------------- NLP & Geocoder -------------------------- #
 
-nlp = spacy.load("en_core_web_sm")
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-zero_shot = pipeline("zero-shot-classification",
-                     model="typeform/distilbert-base-uncased-mnli", framework="pt")
-sentiment = pipeline("sentiment-analysis",
-                     model="cardiffnlp/twitter-roberta-base-sentiment-latest", framework="pt")
+
+def _load_spacy():
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+def _load_zero_shot():
+    from transformers import pipeline
+    return pipeline("zero-shot-classification", model="typeform/distilbert-base-uncased-mnli", framework="pt")
+
+def _load_sentiment():
+    from transformers import pipeline
+    return pipeline("sentiment-analysis", model="cardiffnlp/twitter-roberta-base-sentiment-latest", framework="pt")
+
+# Loaded on first use and unloaded when idle and over the registry's memory budget;
+# use them through .lease()
+nlp_model = model_registry.register("spacy_en", _load_spacy, imports=("spacy",))
+zero_shot_model = model_registry.register("zero_shot", _load_zero_shot, imports=("transformers",))
+sentiment_model = model_registry.register("sentiment", _load_sentiment, imports=("transformers",))
 
 geolocator = Nominatim(user_agent="disaster_monitor")
 rate_geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
@@ -211,7 +223,8 @@ def classify_disaster(text:str)->Dict:
     if conf_kw>=MIN_DISASTER_CONFIDENCE:
         return {"type":best_kw,"conf":conf_kw}
     try:
-        res=zero_shot(text,list(disaster_keywords.keys()))
+        with zero_shot_model.lease() as zero_shot:
+            res=zero_shot(text,list(disaster_keywords.keys()))
         return {"type":res["labels"][0],"conf":float(res["scores"][0])}
     except:
         return {"type":best_kw,"conf":conf_kw}
@@ -223,7 +236,8 @@ def process_posts(posts:List[dict])->None:
         lat, lon = p["lat"], p["lon"]
         # If still none, attempt NER + Overpass landmark geocoding
         if lat is None:
-            doc=nlp(p["content"])
+            with nlp_model.lease() as nlp:
+                doc=nlp(p["content"])
             for ent in doc.ents:
                 if ent.label_ in ("GPE","LOC"):
                     coords=query_overpass(ent.text)
@@ -233,7 +247,8 @@ def process_posts(posts:List[dict])->None:
         sev="unknown"
         for lvl, kws in {"high":["severe","major"],"medium":["moderate"],"low":["minor"]}.items():
             if any(w in p["content"].lower() for w in kws): sev=lvl; break
-        sent=sentiment(p["content"][:512])[0]["label"]
+        with sentiment_model.lease() as sentiment:
+            sent=sentiment(p["content"][:512])[0]["label"]
         # save
         evt_id=f"{p['platform']}_{p['post_id']}"
         conn.execute("""
@@ -3,15 +3,10 @@ import base64
 import tempfile
 import os
 import traceback
-from gradio_client import Client, handle_file
 
 # Create a blueprint instead of a Flask app
 road_bp = Blueprint("road_backend", __name__)
 
-@road_bp.route("/api/status")
-def status():
-    return jsonify({"status": "OMNIVU road backend module loaded"})
-
 @road_bp.route("/api/area", methods=["POST"])
 def area():
     data = request.json
@@ -56,6 +51,8 @@ def road_detection():
             tmp_file.write(image_data)
             tmp_file_path = tmp_file.name
 
+        from gradio_client import Client, handle_file  # slow to import; only this route needs it
+
         print("[Backend] Connecting to Hugging Face Space...")
         client = Client("Vinit710/road_omniview")  
 
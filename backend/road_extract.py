@@ -1,12 +1,34 @@
 import os
+import time
 import tempfile
 import shutil
+from contextlib import ExitStack
 import cv2
 import numpy as np
-import tensorflow as tf
 from flask import Blueprint, request, jsonify, send_file, current_app as app
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from datetime import datetime
+from services.road_model import RoadModelHolder
+from services.road_inference import (iter_patch_boxes, predict_patches, count_by_crop, group_by_crop,
+                                     screen_patches, SCREEN_DEFAULTS)
+from services.road_pool import CropProcessPool
+from services.road_stream import extract_roads_streaming, raster_size, row_bands
+from services.road_postprocess import (row_chunks, prob_to_uint8, iter_filled_rows, overlay_rows,
+                                      postprocess_mask, overlay_image)
+from services.road_tiles import (write_tile_pyramid, write_raster_pyramid, array_reader, read_manifest,
+                                 tile_path, TILE_FORMATS)
+from services.road_masks import (write_bilevel_png, write_prob_webp, write_rle, derive_artifact,
+                                 OUTPUT_PROFILES, MASK_ENCODINGS)
+from services.road_vector import (trace_roads, segment_lines, node_lonlat, to_geojson, write_geojson,
+                                  read_georef, read_mask_raster)
+from services.road_graph import RoadGraph, RoadGraphCache
+from services.road_jobs import RoadJobQueue, QueueFullError, NULL_PROGRESS
+from services.road_cache import save_and_hash, cache_key
+from services.upload_sessions import InvalidUploadData, bytes_for_rows
+from services.workspace import (SAVE_DIR, UPLOAD_MAX_BYTES, InvalidUploadError, artifact_janitor, result_cache,
+                                upload_manager)
+from services.model_registry import model_registry
+from services.startup import is_main_process
 
 road_extract_bp = Blueprint('road_extract', __name__)
 
@@ -14,140 +36,796 @@ MODEL_PATH = "C:\\Users\\Lenovo\\Downloads\\Road_model-20250928T160753Z-1-001\\R
 TARGET_SIZE = (256, 256)
 PATCH_SIZE = (500, 500)
 NUM_CROPS = 8
-SAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "big_masks")
+CROP_GRID = (2, 4)
+BATCH_SIZE = int(os.getenv("ROAD_BATCH_SIZE", 32))
+# Inference backend: keras (reference), tflite or onnx; optional float16/int8 weights
+ROAD_BACKEND = os.getenv("ROAD_BACKEND", "keras")
+ROAD_QUANTIZE = os.getenv("ROAD_QUANTIZE") or None
+# Skip inference on patches that are clearly nodata, cloud-saturated or featureless
+PRESCREEN = os.getenv("ROAD_PRESCREEN", "1").lower() in ('1', 'true', 'yes')
+SCREEN_PARAMS = dict(SCREEN_DEFAULTS)
+# Worker processes for crop-parallel inference (0 = predict in-process); each gets
+# cpu_count // workers intra-op threads unless ROAD_THREADS_PER_WORKER is set.
+# Memmap runs (ROAD_USE_MEMMAP / memmap=1) and streamed runs always predict in-process
+ROAD_PROCESS_WORKERS = int(os.getenv("ROAD_PROCESS_WORKERS", 0))
+ROAD_THREADS_PER_WORKER = int(os.getenv("ROAD_THREADS_PER_WORKER", 0)) or None
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_cache")
+PARITY_MAX_PATCHES = 64
+# Scenes with at least this many pixels are processed in streaming (windowed) mode
+STREAM_MIN_PIXELS = int(os.getenv("ROAD_STREAM_MIN_PIXELS", 50_000_000))
+# Back the full-size masks with np.memmap files in SAVE_DIR (prob quantized to PROB_DTYPE)
+USE_MEMMAP = os.getenv("ROAD_USE_MEMMAP", "0").lower() in ('1', 'true', 'yes')
+PROB_DTYPE = os.getenv("ROAD_PROB_DTYPE", "float16")
+POSTPROCESS_CHUNK_ROWS = 1024
+# Tile size and thread count for the in-memory post-processing engine (None = all cores)
+POSTPROCESS_TILE_SIZE = int(os.getenv("ROAD_POSTPROCESS_TILE_SIZE", 1024))
+POSTPROCESS_WORKERS = int(os.getenv("ROAD_POSTPROCESS_WORKERS", 0)) or None
+# z/x/y tile pyramid of the original, mask and overlay for the zoomable viewer
+TILES = os.getenv("ROAD_TILES", "1").lower() in ('1', 'true', 'yes')
+TILE_FORMAT = os.getenv("ROAD_TILE_FORMAT", "webp")
+# Output profile: 'full' writes every mask as 8-bit PNG plus the overlay; 'compact'
+# writes a WebP prob mask and a 1-bit PNG (or RLE) processed mask, drops the binary
+# mask and builds the overlay only when it is first requested (streamed scenes skip the
+# binary and overlay GeoTIFFs, compositing the overlay preview and tiles instead)
+OUTPUT_PROFILE = os.getenv("ROAD_OUTPUT_PROFILE", "full")
+MASK_ENCODING = os.getenv("ROAD_MASK_ENCODING", "bilevel")
+if MASK_ENCODING not in MASK_ENCODINGS:
+    raise ValueError(f"ROAD_MASK_ENCODING must be one of {MASK_ENCODINGS}, not {MASK_ENCODING!r}")
+# Road centerlines as GeoJSON: Douglas-Peucker tolerance and shortest dangling spur kept (pixels)
+VECTORIZE = os.getenv("ROAD_VECTORIZE", "1").lower() in ('1', 'true', 'yes')
+VECTOR_EPSILON = float(os.getenv("ROAD_VECTOR_EPSILON", 1.5))
+VECTOR_MIN_LENGTH = int(os.getenv("ROAD_VECTOR_MIN_LENGTH", 10))
+POSTPROCESS_PARAMS = {
+    'threshold': 127,
+    'min_road_area': 500,
+    'kernel_size_close': 7,
+    'kernel_size_open': 3,
+    'alpha': 0.6,
+}
+JOB_WORKERS = int(os.getenv("ROAD_JOB_WORKERS", 2))
+JOB_MAX_QUEUED = int(os.getenv("ROAD_JOB_MAX_QUEUED", 8))
 CLEANUP_INTERVAL = 60 * 60  # 1 hour
+# How long a job on a chunked upload waits with no new bytes before giving up
+# (SAVE_DIR, its janitor and the upload manager live in services.workspace)
+UPLOAD_STALL_TIMEOUT = int(os.getenv("ROAD_UPLOAD_STALL_TIMEOUT", 10 * 60))
 
-# Ensure save dir exists
-if not os.path.exists(SAVE_DIR):
-    os.makedirs(SAVE_DIR)
-
-# --- Helper: Cleanup old files ---
-def cleanup_temp_files():
-    now = datetime.now()
-    for fname in os.listdir(SAVE_DIR):
-        fpath = os.path.join(SAVE_DIR, fname)
-        if os.path.isfile(fpath):
-            mtime = datetime.fromtimestamp(os.path.getmtime(fpath))
-            if (now - mtime) > timedelta(hours=2):
+# Shared road model, loaded once per process and kept warm between requests
+road_model = RoadModelHolder(MODEL_PATH, input_size=TARGET_SIZE, backend=ROAD_BACKEND, quantize=ROAD_QUANTIZE,
+                             cache_dir=MODEL_CACHE_DIR)
+crop_pool = CropProcessPool(MODEL_PATH, ROAD_PROCESS_WORKERS, backend=ROAD_BACKEND, quantize=ROAD_QUANTIZE,
+                            cache_dir=MODEL_CACHE_DIR, tag=lambda: f"road_{road_model.fingerprint()[:12]}",
+                            input_size=TARGET_SIZE,
+                            threads_per_worker=ROAD_THREADS_PER_WORKER) if ROAD_PROCESS_WORKERS else None
+# The pool's workers hold a model copy each: they count against the registry budget and are
+# shut down when it unloads the pool; warm-up follows STARTUP_MODE like the other subsystems
+road_pool = model_registry.register('road_pool', crop_pool.warm, sizeof=lambda pool: pool.nbytes,
+                                    unload=lambda pool: pool.shutdown()) if crop_pool else None
+
+# Loaded road graphs for the routing API
+road_graphs = RoadGraphCache()
+
+# Background jobs for /api/extract_roads/jobs
+road_jobs = RoadJobQueue(workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED)
+
+@road_extract_bp.record_once
+def _start_background_services(state):
+    # Crop pool workers import app.py again: they must not start pools and janitors of their own
+    if not is_main_process():
+        return
+    # The road model and the crop pool are started with the other subsystems (services.startup)
+    artifact_janitor.start()
+
+# --- Pipelines ---
+def _run_inference(img, prob_mask, binary_mask, batch_size, progress, prescreen=True, label=''):
+    """Predict every patch of the crop layout into the masks; returns patch counts"""
+    height, width, _ = img.shape
+    boxes = list(iter_patch_boxes(height, width, CROP_GRID, PATCH_SIZE))
+    progress.set_patches(count_by_crop(boxes, height, width, CROP_GRID))
+    on_batch = lambda chunk: progress.advance(count_by_crop(chunk, height, width, CROP_GRID))
+    skipped = []
+    if prescreen:
+        with progress.phase('prescreen'):
+            boxes, skipped = screen_patches(img, boxes, params=SCREEN_PARAMS)
+        on_batch(skipped)
+    # The pool copies the image and both masks into shared memory, which would put
+    # memmapped masks back in RAM whole: memmap runs predict in this process instead
+    use_pool = road_pool is not None and not isinstance(prob_mask, np.memmap)
+    with ExitStack() as stack:
+        # --- Step 6: Lease whatever runs the predictions (already warm unless still loading
+        # or unloaded by the registry): the pool's workers or the in-process model ---
+        with progress.phase('model_wait'):
+            if use_pool:
+                pool = stack.enter_context(road_pool.lease())
+            else:
+                stack.enter_context(road_model.lease(count=False))
+        with progress.phase('inference'):
+            if use_pool:
+                predict_calls = pool.predict(img, group_by_crop(boxes, height, width, CROP_GRID), prob_mask,
+                                             binary_mask, batch_size=batch_size, target_size=TARGET_SIZE,
+                                             on_crop=lambda crop, crop_boxes: on_batch(crop_boxes))
+            else:
+                predict_calls = predict_patches(img, boxes, road_model.predict, prob_mask, binary_mask,
+                                                batch_size=batch_size, target_size=TARGET_SIZE, on_batch=on_batch)
+    app.logger.info(f'Road extraction{label}: {len(boxes)} patches in {predict_calls} predict calls, '
+                    f'{len(skipped)} skipped')
+    return {'patches_total': len(boxes) + len(skipped), 'patches_skipped': len(skipped), 'predict_calls': predict_calls}
+
+def _tiles_dir_name(base_filename):
+    return f"{base_filename}_tiles"
+
+def _write_tiles(write, base_filename, progress):
+    """Run a pyramid writer for this job, publishing the tile set once its first level is on disk"""
+    name = _tiles_dir_name(base_filename)
+    on_level = lambda z, manifest: progress.publish('tiles', name) if z == 0 else None
+    with progress.phase('tiles'):
+        write(os.path.join(SAVE_DIR, name), fmt=TILE_FORMAT, workers=POSTPROCESS_WORKERS, on_level=on_level)
+    return name
+
+def _save_raw_masks(prefix, prob_u8, binary_mask, profile):
+    """Write the prob mask (and, in the full profile, the raw 0/255 binary mask)"""
+    if profile == 'compact':
+        write_prob_webp(f"{prefix}_prob_mask", prob_u8)
+        return
+    cv2.imwrite(f"{prefix}_prob_mask.png", prob_u8)
+    cv2.imwrite(f"{prefix}_binary_mask.png", binary_mask)
+
+def _save_outputs(prefix, filled_mask, overlay_bgr, profile):
+    """Write the processed mask and overlay; returns their paths and the kinds built on request
+
+    In the compact profile `overlay_bgr` is not used: serve_bigroads_file
+    composites the overlay (and decodes an RLE mask) the first time it is asked for.
+    """
+    processed_mask_path = f"{prefix}_processed_mask.png"
+    overlay_path = f"{prefix}_overlay.png"
+    if profile != 'compact':
+        cv2.imwrite(processed_mask_path, filled_mask)
+        cv2.imwrite(overlay_path, overlay_bgr)
+        return processed_mask_path, overlay_path, []
+    if MASK_ENCODING == 'rle':
+        write_rle(f"{prefix}_processed_mask.npz", filled_mask)
+        return processed_mask_path, overlay_path, ['mask', 'overlay']
+    write_bilevel_png(processed_mask_path, filled_mask)
+    return processed_mask_path, overlay_path, ['overlay']
+
+def _write_vectors(mask, base_filename, georef, progress):
+    """Vectorize the processed mask into <base>_roads.geojson and the <base>_graph.npz road graph
+
+    Returns {'geojson': name, 'graph': name, 'stats': {...}}.
+    """
+    with progress.phase('vectorize'):
+        nodes, segments = trace_roads(mask, min_length=VECTOR_MIN_LENGTH)
+        lines = segment_lines(segments, georef, epsilon=VECTOR_EPSILON)
+        collection = to_geojson(segments, lines, georef)
+        geojson_name = f"{base_filename}_roads.geojson"
+        write_geojson(os.path.join(SAVE_DIR, geojson_name), collection)
+    with progress.phase('graph'):
+        graph = RoadGraph.build(node_lonlat(nodes, georef), [(a, b) for a, b, _ in segments], lines, geo=bool(georef))
+        graph_name = f"{base_filename}_graph.npz"
+        graph.save(os.path.join(SAVE_DIR, graph_name))
+    stats = {'road_segments': len(collection['features']), 'graph_nodes': graph.num_nodes,
+             'graph_components': int(graph.component.max()) + 1 if graph.num_nodes else 0}
+    return {'geojson': geojson_name, 'graph': graph_name, 'stats': stats}
+
+def extract_in_memory(img, base_filename, options, georef=None, progress=NULL_PROGRESS):
+    """Run inference and post-processing with full-size in-memory masks"""
+    tiles, profile = options['tiles'], options['profile']
+    height, width, _ = img.shape
+    # --- Step 7: Prepare full masks ---
+    full_prob_mask = np.zeros((height, width), dtype=np.float32)
+    full_binary_mask = np.zeros((height, width), dtype=np.uint8)
+    # --- Step 8: Batched inference over all crops ---
+    stats = _run_inference(img, full_prob_mask, full_binary_mask, options['batch_size'], progress,
+                           options['prescreen'])
+    prob_mask = (full_prob_mask * 255).astype(np.uint8)
+    # --- Step 9: Save final masks ---
+    prefix = os.path.join(SAVE_DIR, base_filename)
+    with progress.phase('save_masks'):
+        _save_raw_masks(prefix, prob_mask, full_binary_mask * 255, profile)
+    # --- Post-processing ---
+    with progress.phase('postprocess'):
+        filled_mask = postprocess_mask(prob_mask, POSTPROCESS_PARAMS, tile_size=POSTPROCESS_TILE_SIZE,
+                                       workers=POSTPROCESS_WORKERS)
+        overlay = None
+        if tiles or profile != 'compact':
+            overlay = overlay_image(img, filled_mask, POSTPROCESS_PARAMS['alpha'], tile_size=POSTPROCESS_TILE_SIZE,
+                                    workers=POSTPROCESS_WORKERS)
+    vectors = _write_vectors(filled_mask, base_filename, georef, progress) if options['vectorize'] else None
+    # Tiles first: the viewer can start on the coarse levels while the full-size PNGs are encoded
+    tiles_name = None
+    if tiles:
+        layers = {'orig': (array_reader(img), False), 'mask': (array_reader(filled_mask, rgb=False), True),
+                  'overlay': (array_reader(overlay), False)}
+        tiles_name = _write_tiles(lambda out_dir, **kw: write_tile_pyramid(layers, height, width, out_dir, **kw),
+                                  base_filename, progress)
+    with progress.phase('save_outputs'):
+        overlay_bgr = cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR) if profile != 'compact' else None
+        processed_mask_path, overlay_path, derived = _save_outputs(prefix, filled_mask, overlay_bgr, profile)
+    return {'mask': processed_mask_path, 'overlay': overlay_path, 'derived': derived, 'tiles': tiles_name,
+            'vectors': vectors, 'stats': stats}
+
+def _open_memmap(path, dtype, shape):
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+def extract_with_memmaps(img, base_filename, options, georef=None, progress=NULL_PROGRESS):
+    """Same pipeline as extract_in_memory, but every full-size mask lives in a memmap
+
+    The probability mask is quantized to float16 or uint8 and post-processing
+    runs over the memmaps in row chunks, so only the input image and one chunk
+    of working arrays need to fit in RAM.
+    """
+    tiles, profile, prob_dtype = options['tiles'], options['profile'], options['prob_dtype']
+    height, width, _ = img.shape
+    prefix = os.path.join(SAVE_DIR, base_filename)
+    mm_paths = {name: f"{prefix}_{name}.dat" for name in ('prob', 'prob_u8', 'binary', 'processed', 'overlay')}
+    try:
+        prob_mm = _open_memmap(mm_paths['prob'], prob_dtype, (height, width))
+        binary_mm = _open_memmap(mm_paths['binary'], np.uint8, (height, width))
+        stats = _run_inference(img, prob_mm, binary_mm, options['batch_size'], progress, options['prescreen'],
+                               label=' (memmap)')
+
+        # Write the raw masks chunk by chunk into uint8 maps that cv2 can encode without a copy
+        with progress.phase('save_masks'):
+            chunks = row_chunks(height, POSTPROCESS_CHUNK_ROWS)
+            prob_u8 = prob_mm if prob_mm.dtype == np.uint8 else _open_memmap(mm_paths['prob_u8'], np.uint8, (height, width))
+            for y0, y1 in chunks:
+                if prob_u8 is not prob_mm:
+                    prob_u8[y0:y1] = prob_to_uint8(prob_mm[y0:y1])
+                binary_mm[y0:y1] *= 255
+            _save_raw_masks(prefix, prob_u8, binary_mm, profile)
+
+        # Post-processing over the memmaps, one chunk at a time
+        with progress.phase('postprocess'):
+            processed_mm = _open_memmap(mm_paths['processed'], np.uint8, (height, width))
+            overlay_mm = None
+            if tiles or profile != 'compact':
+                overlay_mm = _open_memmap(mm_paths['overlay'], np.uint8, (height, width, 3))
+            read_prob = lambda y0, y1: np.asarray(prob_u8[y0:y1])
+            for y0, y1, filled in iter_filled_rows(read_prob, height, chunks, POSTPROCESS_PARAMS):
+                processed_mm[y0:y1] = filled
+                if overlay_mm is not None:
+                    overlay = overlay_rows(img[y0:y1], filled, POSTPROCESS_PARAMS['alpha'])
+                    overlay_mm[y0:y1] = cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR)
+        vectors = _write_vectors(processed_mm, base_filename, georef, progress) if options['vectorize'] else None
+        tiles_name = None
+        if tiles:
+            layers = {'orig': (array_reader(img), False), 'mask': (array_reader(processed_mm, rgb=False), True),
+                      'overlay': (array_reader(overlay_mm, rgb=False), False)}
+            tiles_name = _write_tiles(lambda out_dir, **kw: write_tile_pyramid(layers, height, width, out_dir, **kw),
+                                      base_filename, progress)
+        with progress.phase('save_outputs'):
+            processed_mask_path, overlay_path, derived = _save_outputs(prefix, processed_mm, overlay_mm, profile)
+        return {'mask': processed_mask_path, 'overlay': overlay_path, 'derived': derived, 'tiles': tiles_name,
+                'vectors': vectors, 'stats': stats}
+    finally:
+        prob_mm = prob_u8 = binary_mm = processed_mm = overlay_mm = layers = None
+        for path in mm_paths.values():
+            if os.path.exists(path):
                 try:
-                    os.remove(fpath)
+                    os.remove(path)
                 except Exception:
                     pass
 
-# --- Main API ---
-@road_extract_bp.route('/api/extract_roads', methods=['POST'])
-def extract_roads():
-    try:
-        cleanup_temp_files()
-        if 'file' not in request.files:
-            app.logger.error('No file uploaded')
-            return jsonify({'error': 'No file uploaded'}), 400
-        file = request.files['file']
-        filename = secure_filename(file.filename)
-        if not filename.lower().endswith(('.tif', '.tiff')):
-            app.logger.error('Only TIFF files supported')
-            return jsonify({'error': 'Only TIFF files supported'}), 400
-        # Save uploaded file
-        temp_input = os.path.join(SAVE_DIR, f"input_{datetime.now().timestamp()}_{filename}")
-        file.save(temp_input)
-        base_filename = os.path.splitext(os.path.basename(temp_input))[0]
-        # --- Step 2: Load TIFF image ---
+def parse_options(form):
+    """Pipeline options from the upload form; raises InvalidUploadError on bad values"""
+    prob_dtype = form.get('prob_dtype', PROB_DTYPE)
+    if prob_dtype not in ('float16', 'uint8'):
+        raise InvalidUploadError('prob_dtype must be float16 or uint8')
+    profile = form.get('profile', OUTPUT_PROFILE)
+    if profile not in OUTPUT_PROFILES:
+        raise InvalidUploadError(f'profile must be one of {OUTPUT_PROFILES}')
+    return {
+        'batch_size': max(1, form.get('batch_size', BATCH_SIZE, type=int)),
+        'stream': form.get('stream', '').lower() in ('1', 'true', 'yes'),
+        'memmap': form.get('memmap', str(USE_MEMMAP)).lower() in ('1', 'true', 'yes'),
+        'prob_dtype': prob_dtype,
+        'prescreen': form.get('prescreen', str(PRESCREEN)).lower() in ('1', 'true', 'yes'),
+        'tiles': form.get('tiles', str(TILES)).lower() in ('1', 'true', 'yes'),
+        'profile': profile,
+        'vectorize': form.get('vectorize', str(VECTORIZE)).lower() in ('1', 'true', 'yes'),
+    }
+
+def run_extraction(temp_input, options, progress=NULL_PROGRESS, wait_rows=None):
+    """Run the road pipeline on a saved upload and return the output file names
+
+    `wait_rows` (see extract_roads_streaming) lets a streamed run start while the
+    upload is still arriving; the in-memory pipelines wait for the whole file.
+    The model is leased where the predictions run (see _run_inference).
+    """
+    base_filename = os.path.splitext(os.path.basename(temp_input))[0]
+    # --- Step 1: Large scenes are streamed window by window ---
+    size = raster_size(temp_input)
+    if wait_rows is not None and size is None:
+        # GDAL can't open the partial file yet: wait for all of it
+        wait_rows(None)
+        size = raster_size(temp_input)
+    if size and (options['stream'] or size[0] * size[1] >= STREAM_MIN_PIXELS):
+        with ExitStack() as stack:
+            # Streaming predicts in this process: keep the model loaded for the whole run
+            with progress.phase('model_wait'):
+                stack.enter_context(road_model.lease(count=False))
+            result = extract_roads_streaming(temp_input, os.path.join(SAVE_DIR, base_filename),
+                                             road_model.predict, POSTPROCESS_PARAMS,
+                                             batch_size=options['batch_size'], target_size=TARGET_SIZE,
+                                             patch_size=PATCH_SIZE, crop_grid=CROP_GRID,
+                                             screen_params=SCREEN_PARAMS if options['prescreen'] else None,
+                                             wait_rows=wait_rows, profile=options['profile'],
+                                             progress=progress)
+        app.logger.info(f"Road extraction (stream): {result['patches']} patches in {result['predict_calls']} "
+                        f"predict calls, {result['patches_skipped']} skipped")
+        extra, stats = {}, {}
+        if options['vectorize']:
+            vectors = _write_vectors(read_mask_raster(result['processed']), base_filename, read_georef(temp_input),
+                                     progress)
+            extra.update(geojson=vectors['geojson'], graph=vectors['graph'])
+            stats.update(vectors['stats'])
+        if options['tiles']:
+            # The compact profile has no overlay raster: its tiles are composited from orig and mask
+            sources = {'orig': (temp_input, False), 'mask': (result['processed'], True)}
+            if 'overlay' in result:
+                sources['overlay'] = (result['overlay'], False)
+            alpha = None if 'overlay' in result else POSTPROCESS_PARAMS['alpha']
+            extra['tiles'] = _write_tiles(
+                lambda out_dir, **kw: write_raster_pyramid(sources, out_dir, overlay_alpha=alpha, **kw),
+                base_filename, progress)
+        if 'overlay' in result:
+            extra['overlay_tif'] = os.path.basename(result['overlay'])
+        return dict(extra, **{
+            'mode': 'stream',
+            'orig': os.path.basename(result['orig_preview']),
+            'mask': os.path.basename(result['mask_preview']),
+            'overlay': os.path.basename(result['overlay_preview']),
+            'prob_tif': os.path.basename(result['prob']),
+            'mask_tif': os.path.basename(result['processed']),
+            'stats': dict(stats, patches_total=result['patches'], patches_skipped=result['patches_skipped'],
+                          predict_calls=result['predict_calls']),
+        })
+    if wait_rows is not None:
+        wait_rows(None)
+    # --- Step 2: Load TIFF image ---
+    with progress.phase('load'):
         img = cv2.imread(temp_input)
         if img is None:
             app.logger.error(f'Cannot load image: {temp_input}')
-            return jsonify({'error': 'Cannot load image'}), 400
+            raise InvalidUploadError('Cannot load image')
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        height, width, _ = img.shape
         # --- Step 3: Convert TIFF to PNG ---
         png_path = os.path.join(SAVE_DIR, f"{base_filename}.png")
         cv2.imwrite(png_path, img)
-        # --- Step 6: Load model ---
-        model = tf.keras.models.load_model(MODEL_PATH)
-        # --- Step 7: Prepare full masks ---
-        full_prob_mask = np.zeros((height, width), dtype=np.float32)
-        full_binary_mask = np.zeros((height, width), dtype=np.uint8)
-        # --- Step 8: Process crops ---
-        crop_rows, crop_cols = 2, 4
-        crop_height = int(np.ceil(height / crop_rows))
-        crop_width = int(np.ceil(width / crop_cols))
-        for i in range(crop_rows):
-            for j in range(crop_cols):
-                y0 = i * crop_height
-                y1 = min((i + 1) * crop_height, height)
-                x0 = j * crop_width
-                x1 = min((j + 1) * crop_width, width)
-                crop = img[y0:y1, x0:x1]
-                ch, cw, _ = crop.shape
-                n_rows = int(np.ceil(ch / PATCH_SIZE[1]))
-                n_cols = int(np.ceil(cw / PATCH_SIZE[0]))
-                crop_prob_mask = np.zeros((ch, cw), dtype=np.float32)
-                crop_binary_mask = np.zeros((ch, cw), dtype=np.uint8)
-                for pi in range(n_rows):
-                    for pj in range(n_cols):
-                        py0 = pi * PATCH_SIZE[1]
-                        py1 = min((pi + 1) * PATCH_SIZE[1], ch)
-                        px0 = pj * PATCH_SIZE[0]
-                        px1 = min((pj + 1) * PATCH_SIZE[0], cw)
-                        patch = crop[py0:py1, px0:px1]
-                        patch_resized = cv2.resize(patch, TARGET_SIZE)
-                        patch_input = np.expand_dims(patch_resized / 255.0, axis=0)
-                        pred = model.predict(patch_input, verbose=0)[0]
-                        pred_binary = (pred > 0.5).astype(np.uint8)
-                        pred_resized = cv2.resize(pred.squeeze(), (px1-px0, py1-py0), interpolation=cv2.INTER_LINEAR)
-                        pred_binary_resized = cv2.resize(pred_binary.squeeze(), (px1-px0, py1-py0), interpolation=cv2.INTER_NEAREST)
-                        crop_prob_mask[py0:py1, px0:px1] = pred_resized
-                        crop_binary_mask[py0:py1, px0:px1] = pred_binary_resized
-                full_prob_mask[y0:y1, x0:x1] = crop_prob_mask
-                full_binary_mask[y0:y1, x0:x1] = crop_binary_mask
-        # --- Step 9: Save final masks ---
-        prob_mask_path = os.path.join(SAVE_DIR, f"{base_filename}_prob_mask.png")
-        binary_mask_path = os.path.join(SAVE_DIR, f"{base_filename}_binary_mask.png")
-        cv2.imwrite(prob_mask_path, (full_prob_mask * 255).astype(np.uint8))
-        cv2.imwrite(binary_mask_path, full_binary_mask * 255)
-        # --- Post-processing ---
-        threshold = 127
-        min_road_area = 500
-        kernel_size_close = 7
-        kernel_size_open = 3
-        alpha = 0.6
-        orig_img = img
-        prob_mask = (full_prob_mask * 255).astype(np.uint8)
-        _, binary_mask = cv2.threshold(prob_mask, threshold, 255, cv2.THRESH_BINARY)
-        kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size_close, kernel_size_close))
-        closed_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_CLOSE, kernel_close)
-        kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size_open, kernel_size_open))
-        opened_mask = cv2.morphologyEx(closed_mask, cv2.MORPH_OPEN, kernel_open)
-        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(opened_mask, connectivity=8)
-        processed_mask = np.zeros_like(opened_mask)
-        for i in range(1, num_labels):
-            if stats[i, cv2.CC_STAT_AREA] >= min_road_area:
-                processed_mask[labels == i] = 255
-        high_prob_mask = (prob_mask > 200).astype(np.uint8) * 255
-        filled_mask = cv2.bitwise_or(processed_mask, high_prob_mask)
-        overlay = orig_img.copy()
-        red_mask = np.zeros_like(orig_img)
-        red_mask[:, :, 0] = filled_mask
-        overlay = cv2.addWeighted(overlay, 1, red_mask, alpha, 0)
-        processed_mask_path = os.path.join(SAVE_DIR, f"{base_filename}_processed_mask.png")
-        overlay_path = os.path.join(SAVE_DIR, f"{base_filename}_overlay.png")
-        cv2.imwrite(processed_mask_path, filled_mask)
-        cv2.imwrite(overlay_path, cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+    georef = read_georef(temp_input) if options['vectorize'] else None
+    if options['memmap']:
+        outputs = extract_with_memmaps(img, base_filename, options, georef, progress=progress)
+    else:
+        outputs = extract_in_memory(img, base_filename, options, georef, progress=progress)
+    result = {
+        'mode': 'memmap' if options['memmap'] else 'memory',
+        'orig': os.path.basename(png_path),
+        'mask': os.path.basename(outputs['mask']),
+        'overlay': os.path.basename(outputs['overlay']),
+        'stats': outputs['stats'],
+    }
+    if outputs['tiles']:
+        result['tiles'] = outputs['tiles']
+    if outputs['derived']:
+        result['derived'] = outputs['derived']
+    if outputs['vectors']:
+        result.update(geojson=outputs['vectors']['geojson'], graph=outputs['vectors']['graph'])
+        result['stats'].update(outputs['vectors']['stats'])
+    return result
+
+def tile_urls(tileset, base_url):
+    """{layer: z/x/y URL template} of a tile pyramid; masks are always PNG (see write_tile_pyramid)"""
+    return {layer: f'{base_url}/api/bigroads_tiles/{tileset}/{layer}/{{z}}/{{x}}/{{y}}.'
+                   f'{"png" if layer == "mask" else TILE_FORMAT}'
+            for layer in ('orig', 'mask', 'overlay')}
+
+def result_urls(result, base_url):
+    """Map run_extraction file names to /api/bigroads_file URLs (orig_url, mask_url, ...)
+
+    The tile pyramid is a directory: it gets per-layer URL templates (tiles_url)
+    and the manifest URL (tiles_manifest_url) instead.
+    """
+    urls = {f'{key}_url': f'{base_url}/api/bigroads_file/{name}' for key, name in result.items()
+            if key not in ('mode', 'stats', 'derived', 'tiles')}
+    if result.get('tiles'):
+        urls['tiles_url'] = tile_urls(result['tiles'], base_url)
+        urls['tiles_manifest_url'] = f"{base_url}/api/bigroads_tiles/{result['tiles']}/tiles.json"
+    if result.get('mode') == 'stream':
+        urls['mode'] = 'stream'
+    urls.update(result.get('stats', {}))
+    return urls
+
+def _save_upload():
+    """Validate and save the uploaded TIFF, hashing it on the way to disk
+
+    Returns (path, sha256, None) or (None, None, error response).
+    """
+    if 'file' not in request.files:
+        app.logger.error('No file uploaded')
+        return None, None, (jsonify({'error': 'No file uploaded'}), 400)
+    file = request.files['file']
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(('.tif', '.tiff')):
+        app.logger.error('Only TIFF files supported')
+        return None, None, (jsonify({'error': 'Only TIFF files supported'}), 400)
+    temp_input = os.path.join(SAVE_DIR, f"input_{datetime.now().timestamp()}_{filename}")
+    # Pinned until the job is done; the caller must release it
+    artifact_janitor.pin(temp_input)
+    upload_hash = save_and_hash(file.stream, temp_input)
+    return temp_input, upload_hash, None
+
+def result_cache_key(upload_hash, options):
+    """Cache key: upload hash + model file hash + everything that changes the outputs"""
+    params = dict(POSTPROCESS_PARAMS, target_size=TARGET_SIZE, patch_size=PATCH_SIZE, crop_grid=CROP_GRID,
+                  backend=ROAD_BACKEND, quantize=ROAD_QUANTIZE,
+                  stream=options['stream'], memmap=options['memmap'],
+                  prescreen=SCREEN_PARAMS if options['prescreen'] else None,
+                  tiles=TILE_FORMAT if options['tiles'] else None,
+                  profile=options['profile'],
+                  vectorize=(VECTOR_EPSILON, VECTOR_MIN_LENGTH) if options['vectorize'] else None,
+                  mask_encoding=MASK_ENCODING if options['profile'] == 'compact' else None,
+                  prob_dtype=options['prob_dtype'] if options['memmap'] else None)
+    return cache_key(upload_hash, road_model.fingerprint(), params)
+
+def _cached_result(temp_input, key):
+    """Cached result for key, dropping the duplicate upload on a hit"""
+    result = result_cache.get(key)
+    if result:
+        app.logger.info(f'Road extraction cache hit: {result["orig"]}')
+        artifact_janitor.touch(result['orig'])
+        os.remove(temp_input)
+    return result
+
+def run_cached_extraction(temp_input, key, options, progress=NULL_PROGRESS):
+    result = run_extraction(temp_input, options, progress=progress)
+    result_cache.put(key, os.path.splitext(os.path.basename(temp_input))[0], result)
+    return result
+
+# --- Main API ---
+@road_extract_bp.route('/api/extract_roads', methods=['POST'])
+def extract_roads():
+    temp_input = None
+    try:
+        options = parse_options(request.form)
+        temp_input, upload_hash, error = _save_upload()
+        if error:
+            return error
+        key = result_cache_key(upload_hash, options)
+        result = _cached_result(temp_input, key)
+        if result:
+            return jsonify(dict(result_urls(result, request.host_url.rstrip('/')), cached=True))
+        result = run_cached_extraction(temp_input, key, options)
         # --- Return URLs (use send_file endpoint) ---
+        return jsonify(result_urls(result, request.host_url.rstrip('/')))
+    except InvalidUploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        app.logger.error(f"Error in /api/extract_roads: {e}\n{traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if temp_input:
+            artifact_janitor.release(temp_input)
+
+# --- Job API: submit, poll status, fetch result ---
+def _run_job(job, flask_app, temp_input, key, options):
+    try:
+        with flask_app.app_context():
+            return run_cached_extraction(temp_input, key, options, progress=job)
+    finally:
+        artifact_janitor.release(temp_input)
+
+@road_extract_bp.route('/api/extract_roads/jobs', methods=['POST'])
+def submit_extract_roads_job():
+    temp_input = None
+    submitted = False
+    try:
+        options = parse_options(request.form)
+        temp_input, upload_hash, error = _save_upload()
+        if error:
+            return error
+        key = result_cache_key(upload_hash, options)
+        result = _cached_result(temp_input, key)
+        if result:
+            job = road_jobs.add_finished(result)
+        else:
+            job = road_jobs.submit(_run_job, app._get_current_object(), temp_input, key, options)
+            submitted = True
         base_url = request.host_url.rstrip('/')
         return jsonify({
-            'orig_url': f'{base_url}/api/bigroads_file/{os.path.basename(png_path)}',
-            'mask_url': f'{base_url}/api/bigroads_file/{os.path.basename(processed_mask_path)}',
-            'overlay_url': f'{base_url}/api/bigroads_file/{os.path.basename(overlay_path)}'
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'cached': bool(result),
+            'status_url': f'{base_url}/api/extract_roads/jobs/{job.id}',
+            'result_url': f'{base_url}/api/extract_roads/jobs/{job.id}/result'
+        }), 202
+    except QueueFullError as e:
+        if temp_input and os.path.exists(temp_input):
+            os.remove(temp_input)
+        return jsonify({'error': str(e), 'queue': road_jobs.stats()}), 503
+    except InvalidUploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         import traceback
-        app.logger.error(f"Error in /api/extract_roads: {e}\n{traceback.format_exc()}")
+        app.logger.error(f"Error in /api/extract_roads/jobs: {e}\n{traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if temp_input and not submitted:
+            artifact_janitor.release(temp_input)
+
+@road_extract_bp.route('/api/extract_roads/jobs/<job_id>')
+def extract_roads_job_status(job_id):
+    job = road_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    status = job.to_dict()
+    status['outputs'] = result_urls(status['outputs'], request.host_url.rstrip('/'))
+    return jsonify(status)
+
+@road_extract_bp.route('/api/extract_roads/jobs/<job_id>/result')
+def extract_roads_job_result(job_id):
+    job = road_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'error':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'error': 'Job not finished', 'status': job.status}), 409
+    return jsonify(result_urls(job.result, request.host_url.rstrip('/')))
+
+# --- Resumable chunked uploads: create, append (PUT at an offset), status, extract while arriving ---
+def _upload_or_404(upload_id):
+    session = upload_manager.get(upload_id)
+    if session is None:
+        return None, (jsonify({'error': 'Unknown upload'}), 404)
+    return session, None
+
+def _upload_status(session):
+    base_url = request.host_url.rstrip('/')
+    return dict(session.to_dict(), upload_url=f'{base_url}/api/uploads/{session.id}')
+
+@road_extract_bp.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start an upload: form fields filename, size (bytes) and optionally sha256"""
+    filename = secure_filename(request.form.get('filename', ''))
+    if not filename.lower().endswith(('.tif', '.tiff')):
+        return jsonify({'error': 'Only TIFF files supported'}), 400
+    size = request.form.get('size', 0, type=int)
+    if not 0 < size <= UPLOAD_MAX_BYTES:
+        return jsonify({'error': f'size must be between 1 and {UPLOAD_MAX_BYTES} bytes'}), 400
+    path = os.path.join(SAVE_DIR, f"input_{datetime.now().timestamp()}_{filename}")
+    session = upload_manager.create(path, filename, size, request.form.get('sha256') or None)
+    return jsonify(_upload_status(session)), 201
+
+@road_extract_bp.route('/api/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def append_upload(upload_id):
+    """Append the raw request body at the Upload-Offset header (or ?offset=)
+
+    Chunks are written to disk as they are read from the socket. Re-sending a
+    chunk that was already stored is harmless; a gap is rejected with 409 and
+    the offset to resume from.
+    """
+    session, error = _upload_or_404(upload_id)
+    if error:
+        return error
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Upload-Offset header or offset parameter required'}), 400
+    try:
+        session.write(offset, request.stream)
+    except ValueError as e:
+        return jsonify(dict(_upload_status(session), error=str(e))), 409
+    except InvalidUploadData as e:
+        return jsonify(dict(_upload_status(session), error=str(e))), 400
+    return jsonify(_upload_status(session))
+
+@road_extract_bp.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session, error = _upload_or_404(upload_id)
+    if error:
+        return error
+    return jsonify(_upload_status(session))
+
+@road_extract_bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    session, error = _upload_or_404(upload_id)
+    if error:
+        return error
+    if session.owned:
+        # The job fails at its next wait for bytes and discards the upload itself
+        session.cancel()
+        return jsonify({'upload_id': upload_id, 'status': 'cancelled'}), 202
+    upload_manager.discard(session)
+    return jsonify({'upload_id': upload_id, 'status': 'deleted'})
+
+def _first_band_arrived(session):
+    """The whole upload, or its TIFF header and the first row band the streaming pipeline reads"""
+    if session.complete:
+        return True
+    if session.layout is None:
+        return False
+    (_, y1), _ = row_bands(session.layout['height'], session.layout['width'], CROP_GRID, PATCH_SIZE)[0]
+    return session.received >= bytes_for_rows(session.layout, y1)
+
+def _wait_for_upload(job, session):
+    """Runs before the job takes a worker (see RoadJobQueue.submit_after)"""
+    try:
+        with job.phase('upload_wait'):
+            session.wait(_first_band_arrived, UPLOAD_STALL_TIMEOUT)
+    except Exception:
+        upload_manager.finish(session)
+        raise
+
+def _run_upload_job(job, flask_app, session, options):
+    """Extraction on a chunked upload, started on the first row bands if they arrive before the rest"""
+    try:
+        with flask_app.app_context():
+            if session.complete:
+                key = result_cache_key(session.sha256, options)
+                return _cached_result(session.path, key) or run_cached_extraction(session.path, key, options,
+                                                                                  progress=job)
+            # Still arriving: only the streaming pipeline can read the scene band by band
+            options = dict(options, stream=True)
+            result = run_extraction(session.path, options, progress=job,
+                                    wait_rows=lambda y1: session.wait_for_rows(y1, UPLOAD_STALL_TIMEOUT))
+            # The content hash is known now that the last byte is in
+            base = os.path.splitext(os.path.basename(session.path))[0]
+            result_cache.put(result_cache_key(session.sha256, options), base, result)
+            return result
+    finally:
+        upload_manager.finish(session)
+
+@road_extract_bp.route('/api/uploads/<upload_id>/extract_roads', methods=['POST'])
+def submit_upload_job(upload_id):
+    """Queue road extraction for an upload; may be called right after the upload is created"""
+    session, error = _upload_or_404(upload_id)
+    if error:
+        return error
+    try:
+        options = parse_options(request.form)
+        upload_manager.claim(session)
+        try:
+            job = road_jobs.submit_after(lambda job: _wait_for_upload(job, session), _run_upload_job,
+                                         app._get_current_object(), session, options)
+        except QueueFullError:
+            upload_manager.unclaim(session)
+            raise
+        base_url = request.host_url.rstrip('/')
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'upload': _upload_status(session),
+            'status_url': f'{base_url}/api/extract_roads/jobs/{job.id}',
+            'result_url': f'{base_url}/api/extract_roads/jobs/{job.id}/result'
+        }), 202
+    except QueueFullError as e:
+        return jsonify({'error': str(e), 'queue': road_jobs.stats()}), 503
+    except InvalidUploadData as e:
+        return jsonify({'error': str(e)}), 409
+    except InvalidUploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+@road_extract_bp.route('/api/extract_roads/model')
+def road_model_status():
+    return jsonify(dict(road_model.status(), process_pool=crop_pool.status() if crop_pool else None))
+
+@road_extract_bp.route('/api/extract_roads/model/parity', methods=['POST'])
+def road_model_parity():
+    """Compare the active backend with the Keras reference on patches of an uploaded TIFF"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file uploaded'}), 400
+        data = np.frombuffer(request.files['file'].read(), dtype=np.uint8)
+        img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if img is None:
+            return jsonify({'error': 'Cannot load image'}), 400
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        boxes = list(iter_patch_boxes(img.shape[0], img.shape[1], CROP_GRID, PATCH_SIZE))[:PARITY_MAX_PATCHES]
+        patches = np.stack([cv2.resize(img[y0:y1, x0:x1], TARGET_SIZE) for y0, y1, x0, x1 in boxes])
+        patches = patches.astype(np.float32) / 255.0
+        batches = [patches[i:i + BATCH_SIZE] for i in range(0, len(patches), BATCH_SIZE)]
+        return jsonify(dict(road_model.parity(batches), patches=len(patches)))
+    except Exception as e:
+        import traceback
+        app.logger.error(f"Error in /api/extract_roads/model/parity: {e}\n{traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+@road_extract_bp.route('/api/extract_roads/cache')
+def road_cache_status():
+    return jsonify(dict(result_cache.stats(), disk=artifact_janitor.stats(), uploads=upload_manager.stats()))
+
 # Serve temp files
 @road_extract_bp.route('/api/bigroads_file/<filename>')
 def serve_bigroads_file(filename):
-    fpath = os.path.join(SAVE_DIR, filename)
+    fpath = os.path.join(SAVE_DIR, secure_filename(filename))
     if not os.path.exists(fpath):
-        return 'Not found', 404
+        # Compact outputs: overlay (and RLE mask PNG) are built on first request and kept on disk
+        fpath = derive_artifact(SAVE_DIR, secure_filename(filename), POSTPROCESS_PARAMS['alpha'])
+        if fpath is None:
+            return 'Not found', 404
+        artifact_janitor.add_file(fpath)
+    artifact_janitor.touch(filename)
     return send_file(fpath)
+
+# Tile pyramid: manifest (levels_ready grows while the job runs) and z/x/y tiles
+@road_extract_bp.route('/api/bigroads_tiles/<tileset>/tiles.json')
+def serve_bigroads_manifest(tileset):
+    manifest = read_manifest(os.path.join(SAVE_DIR, secure_filename(tileset)))
+    if manifest is None:
+        return 'Not found', 404
+    artifact_janitor.touch(tileset)
+    return jsonify(manifest)
+
+@road_extract_bp.route('/api/bigroads_tiles/<tileset>/<layer>/<int:z>/<int:x>/<int:y>.<ext>')
+def serve_bigroads_tile(tileset, layer, z, x, y, ext):
+    if ext not in TILE_FORMATS:
+        return 'Not found', 404
+    fpath = tile_path(os.path.join(SAVE_DIR, secure_filename(tileset)), secure_filename(layer), z, x, y, ext)
+    if not os.path.exists(fpath):
+        return 'Not found', 404
+    artifact_janitor.touch(tileset)
+    return send_file(fpath, max_age=24 * 60 * 60)
+
+# --- Road graph queries (no image processing: the graph is loaded from its .npz) ---
+def _load_graph(graph_name):
+    path = os.path.join(SAVE_DIR, secure_filename(graph_name))
+    if not graph_name.endswith('_graph.npz') or not os.path.exists(path):
+        return None
+    artifact_janitor.touch(graph_name)
+    return road_graphs.get(path)
+
+def _parse_point(value, name):
+    """'x,y' query parameter (lon,lat for georeferenced graphs, pixel x,y otherwise)"""
+    try:
+        x, y = (float(v) for v in (value or '').split(','))
+    except ValueError:
+        raise InvalidUploadError(f"'{name}' must be given as x,y")
+    return x, y
+
+def _snap(graph, point):
+    node, distance = graph.nearest_node(*point)
+    return node, {'node': node, 'coordinates': graph.node_xy[node].round(7).tolist(),
+                  'snap_distance': round(distance, 2)}
+
+@road_extract_bp.route('/api/road_graph/<graph_name>')
+def road_graph_summary(graph_name):
+    graph = _load_graph(graph_name)
+    if graph is None:
+        return jsonify({'error': 'Unknown graph'}), 404
+    top = request.args.get('top', 10, type=int)
+    return jsonify(dict(graph.components(top=top), units='m' if graph.geo else 'px'))
+
+@road_extract_bp.route('/api/road_graph/<graph_name>/component')
+def road_graph_component(graph_name):
+    """Which connected road network a point is on, and how big it is"""
+    try:
+        graph = _load_graph(graph_name)
+        if graph is None:
+            return jsonify({'error': 'Unknown graph'}), 404
+        node, snapped = _snap(graph, _parse_point(request.args.get('at'), 'at'))
+        return jsonify(dict(graph.component_of(node), snapped=snapped))
+    except (InvalidUploadError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@road_extract_bp.route('/api/road_graph/<graph_name>/route')
+def road_graph_route(graph_name):
+    """Shortest road path between two points (snapped to the nearest graph nodes)"""
+    try:
+        graph = _load_graph(graph_name)
+        if graph is None:
+            return jsonify({'error': 'Unknown graph'}), 404
+        source, source_snap = _snap(graph, _parse_point(request.args.get('from'), 'from'))
+        target, target_snap = _snap(graph, _parse_point(request.args.get('to'), 'to'))
+        t0 = time.perf_counter()
+        path = graph.shortest_path(source, target)
+        response = {'from': source_snap, 'to': target_snap, 'reachable': path is not None,
+                    'units': 'm' if graph.geo else 'px'}
+        if path is not None:
+            length, edges, nodes = path
+            response.update(length=round(length, 2), edges=len(edges), geometry={
+                'type': 'LineString', 'coordinates': graph.path_geometry(edges, nodes).round(7).tolist()})
+        response['query_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+        return jsonify(response)
+    except (InvalidUploadError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,175 @@
+import os
+import shutil
+import threading
+import time
+
+
+def artifact_group(name):
+    """Job a file in big_masks belongs to: 'input_<timestamp>' for job outputs, else the file itself"""
+    if name.startswith('input_'):
+        return '_'.join(name.split('_')[:2])
+    return name
+
+
+def artifact_size(path):
+    """Size of a file, or the total size of a directory of artifacts (e.g. a tile pyramid)"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+class ArtifactJanitor:
+    """Background cleanup of job artifacts with a disk quota and an idle TTL
+
+    Keeps an in-memory index of artifact groups (all files of one job) with
+    their sizes and last access time, so the request path never lists or stats
+    the directory. A daemon thread evicts groups idle longer than `ttl` and then
+    least-recently-used groups until the total fits in `max_bytes`, deleting
+    files in small batches. Groups of running jobs are pinned and never evicted.
+    A directory in root (such as a job's tile pyramid) counts as one artifact.
+    `on_sweep()` runs after every pass, for related housekeeping.
+    """
+
+    def __init__(self, root, max_bytes, ttl, interval=60, batch_size=50, batch_pause=0.05, on_evict=None,
+                 on_sweep=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.on_evict = on_evict
+        self.on_sweep = on_sweep
+        self.evicted_files = 0
+        self._groups = {}
+        self._pinned = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="artifact-janitor", daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def _run(self):
+        self._scan()
+        while True:
+            try:
+                self._index_pending()
+                self.sweep()
+                if self.on_sweep:
+                    self.on_sweep()
+            except Exception as e:
+                print(f"Artifact janitor sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def _scan(self):
+        """Index whatever is already on disk (once, at startup)"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.'):
+                continue
+            self._add(name, artifact_size(path), os.stat(path).st_mtime)
+
+    def _index_pending(self):
+        """Index the files of jobs that finished since the last pass"""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return
+        now = time.time()
+        for name in os.listdir(self.root):
+            if artifact_group(name) in pending:
+                try:
+                    self._add(name, artifact_size(os.path.join(self.root, name)), now)
+                except OSError:
+                    pass
+
+    def _add(self, name, size, accessed):
+        with self._lock:
+            group = self._groups.setdefault(artifact_group(name), {'files': {}, 'last_access': accessed})
+            group['files'][name] = size
+            group['last_access'] = max(group['last_access'], accessed)
+
+    # --- Hooks for the request/job path (no filesystem scans) ---
+    def pin(self, path):
+        """Protect the group of `path` while its job is running"""
+        group = artifact_group(os.path.basename(path))
+        with self._lock:
+            self._pinned[group] = self._pinned.get(group, 0) + 1
+        return group
+
+    def release(self, path):
+        """Unpin a finished job; its files are indexed on the janitor's next pass"""
+        group = artifact_group(os.path.basename(path))
+        with self._lock:
+            count = self._pinned.get(group, 0)
+            if not count:
+                print(f"Artifact janitor: {group} released but not pinned")
+                return
+            if count == 1:
+                del self._pinned[group]
+            else:
+                self._pinned[group] = count - 1
+            self._pending.add(group)
+
+    def add_file(self, path):
+        """Index a file created after its job finished (e.g. an overlay built on request)"""
+        try:
+            self._add(os.path.basename(path), artifact_size(path), time.time())
+        except OSError:
+            pass
+
+    def touch(self, name):
+        """Record an access to a file (or any file of its job)"""
+        with self._lock:
+            group = self._groups.get(artifact_group(name))
+            if group:
+                group['last_access'] = time.time()
+
+    # --- Eviction ---
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            candidates = sorted((g['last_access'], key) for key, g in self._groups.items()
+                                if key not in self._pinned)
+            total = sum(sum(g['files'].values()) for g in self._groups.values())
+            victims = []
+            for last_access, key in candidates:
+                if now - last_access <= self.ttl and total <= self.max_bytes:
+                    break
+                group = self._groups.pop(key)
+                total -= sum(group['files'].values())
+                victims.append((key, list(group['files'])))
+        for start in range(0, len(victims), self.batch_size):
+            for key, names in victims[start:start + self.batch_size]:
+                for name in names:
+                    path = os.path.join(self.root, name)
+                    try:
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                        self.evicted_files += 1
+                    except OSError:
+                        pass
+                if self.on_evict:
+                    self.on_evict(key)
+            time.sleep(self.batch_pause)
+        return len(victims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'groups': len(self._groups),
+                'files': sum(len(g['files']) for g in self._groups.values()),
+                'bytes': sum(sum(g['files'].values()) for g in self._groups.values()),
+                'max_bytes': self.max_bytes,
+                'ttl_s': self.ttl,
+                'pinned': len(self._pinned),
+                'evicted_files': self.evicted_files,
+            }
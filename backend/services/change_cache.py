@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def change_cache_key(model_input, model_hash, params):
+    """Content address of one prediction: the decoded (6, H, W) pre+post input + model weights + settings
+
+    Hashing the decoded pixels rather than the upload bytes means the same
+    pair hits whether it arrives as PNG, JPEG re-save, base64 or multipart.
+    """
+    digest = hashlib.sha256()
+    array = np.ascontiguousarray(model_input)
+    digest.update(f"{array.dtype}{array.shape}".encode())
+    digest.update(memoryview(array).cast('B'))
+    digest.update(model_hash.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ChangeResultCache:
+    """Change masks and their stats: an LRU in memory backed by one .npz per entry on disk
+
+    Masks are stored bit-packed, so a 256x256 result is 8 KB in memory and a
+    little less on disk. Entries evicted from memory are still served from
+    disk (and promoted back); the disk store keeps at most `max_disk_entries`
+    files, dropping the least recently written. Both survive a restart.
+    """
+
+    def __init__(self, root, max_entries=256, max_disk_entries=10000):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._disk_keys = OrderedDict(
+            (name[:-4], None) for name in sorted(os.listdir(root), key=lambda n: os.path.getmtime(os.path.join(root, n)))
+            if name.endswith('.npz'))
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.npz")
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """(mask, stats) for key, or None; mask is a uint8 0/1 array"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            try:
+                with np.load(self._path(key)) as data:
+                    entry = (data['bits'], tuple(data['shape']), json.loads(str(data['stats'])))
+            except (FileNotFoundError, ValueError, KeyError, OSError):
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self._remember(key, entry)
+                self.hits += 1
+                self.disk_hits += 1
+        bits, shape, stats = entry
+        mask = np.unpackbits(bits, count=int(np.prod(shape))).reshape(shape)
+        return mask, dict(stats)
+
+    def put(self, key, mask, stats):
+        mask = np.asarray(mask) > 0.5
+        entry = (np.packbits(mask.ravel()), mask.shape, dict(stats))
+        tmp_path = self._path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, bits=entry[0], shape=np.array(mask.shape), stats=np.array(json.dumps(entry[2])))
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._remember(key, entry)
+            self._disk_keys[key] = None
+            self._disk_keys.move_to_end(key)
+            stale = []
+            while len(self._disk_keys) > self.max_disk_entries:
+                stale.append(self._disk_keys.popitem(last=False)[0])
+        for old_key in stale:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'memory_entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_entries': len(self._disk_keys),
+                'max_disk_entries': self.max_disk_entries,
+            }
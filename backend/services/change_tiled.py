@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+import cv2
+import numpy as np
+import rasterio
+from rasterio.coords import disjoint_bounds
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+from services.road_stream import to_rgb_uint8, write_preview, GTIFF_OPTIONS, PREVIEW_MAX_SIZE
+from services.road_jobs import NULL_PROGRESS
+
+WINDOW_SIZE = 256
+OVERLAP = 32
+
+# --- Co-registration ---
+def _georeferenced(src):
+    return src.crs is not None and not src.transform.is_identity
+
+@contextmanager
+def open_pair(pre_path, post_path):
+    """Yield (pre, post, area): pre resampled onto post's pixel grid and their overlap in that grid
+
+    Georeferenced inputs are aligned by their CRS and geotransform (pre goes
+    through a WarpedVRT, so nothing is resampled up front); inputs without a
+    geotransform must have the same size and are taken pixel for pixel.
+    """
+    with rasterio.open(pre_path) as pre_src, rasterio.open(post_path) as post:
+        if _georeferenced(pre_src) and _georeferenced(post):
+            pre_bounds = transform_bounds(pre_src.crs, post.crs, *pre_src.bounds)
+            if disjoint_bounds(pre_bounds, post.bounds):
+                raise ValueError('The pre and post images do not overlap')
+            overlap = (max(pre_bounds[0], post.bounds.left), max(pre_bounds[1], post.bounds.bottom),
+                       min(pre_bounds[2], post.bounds.right), min(pre_bounds[3], post.bounds.top))
+            area = from_bounds(*overlap, transform=post.transform).round_offsets().round_lengths()
+            area = area.intersection(Window(0, 0, post.width, post.height))
+            with WarpedVRT(pre_src, crs=post.crs, transform=post.transform, width=post.width, height=post.height,
+                           resampling=Resampling.bilinear, add_alpha=pre_src.nodata is None) as pre:
+                yield pre, post, area
+        elif (pre_src.height, pre_src.width) == (post.height, post.width):
+            yield pre_src, post, Window(0, 0, post.width, post.height)
+        else:
+            raise ValueError('Images without a geotransform must have the same size')
+
+def _read_rgb(src, window):
+    return to_rgb_uint8(src.read(indexes=[1, 2, 3] if src.count >= 3 else [1, 1, 1], window=window))
+
+# --- Sliding windows ---
+def window_starts(length, size, stride):
+    """Window offsets covering [0, length); the last window is shifted back to end on the edge"""
+    if length <= size:
+        return [0]
+    starts = list(range(0, length - size + 1, stride))
+    if starts[-1] != length - size:
+        starts.append(length - size)
+    return starts
+
+def blend_weights(size, overlap):
+    """Per-pixel window weight: 1 in the centre, ramping down linearly across the overlap
+
+    Window borders, where the UNet sees the least context, count less where
+    windows overlap; the accumulated weights are divided out again.
+    """
+    ramp = np.ones(size, dtype=np.float32)
+    if overlap:
+        edge = (np.arange(overlap, dtype=np.float32) + 1) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+def _window_pair(pre_band, post_band, x, size):
+    """(6, size, size) float32 model input for one window, zero-padded at the scene edge"""
+    pair = np.zeros((6, size, size), dtype=np.float32)
+    pre, post = pre_band[:, x:x + size], post_band[:, x:x + size]
+    h, w = pre.shape[:2]
+    pair[:3, :h, :w] = pre.transpose(2, 0, 1)
+    pair[3:, :h, :w] = post.transpose(2, 0, 1)
+    pair *= 1.0 / 255
+    return pair
+
+# --- Pipeline ---
+def detect_changes_tiled(pre_path, post_path, out_prefix, predict_fn, batch_size=8, window_size=WINDOW_SIZE,
+                         overlap=OVERLAP, threshold=0.5, progress=NULL_PROGRESS):
+    """Full-resolution change detection over overlapping windows of a co-registered image pair
+
+    `predict_fn` maps a (B, 6, size, size) float32 batch to (B, size, size)
+    change probabilities. Windows are visited one row at a time; their
+    weighted probabilities are accumulated in a buffer one window tall, and
+    rows that no later window touches are normalized, thresholded and
+    written to tiled GeoTIFFs right away. Memory therefore depends on the
+    scene width and window size, not on the scene size. Pixels outside
+    either image's valid data are never counted as change.
+    """
+    paths = {
+        'prob': f"{out_prefix}_change_prob.tif",
+        'mask': f"{out_prefix}_change_mask.tif",
+        'mask_preview': f"{out_prefix}_change_mask.png",
+        'overlay_preview': f"{out_prefix}_change_overlay.png",
+    }
+    stride = window_size - overlap
+    if stride <= 0:
+        raise ValueError('overlap must be smaller than the window size')
+    weights = blend_weights(window_size, overlap)
+    with open_pair(pre_path, post_path) as (pre, post, area):
+        height, width = int(area.height), int(area.width)
+        row0, col0 = int(area.row_off), int(area.col_off)
+        rows = window_starts(height, window_size, stride)
+        cols = window_starts(width, window_size, stride)
+        profile = dict(GTIFF_OPTIONS, width=width, height=height, count=1, dtype='uint8', crs=post.crs,
+                       transform=post.window_transform(area))
+        progress.set_patches({'windows': len(rows) * len(cols)})
+        acc = np.zeros((window_size, width), dtype=np.float32)
+        acc_weight = np.zeros((window_size, width), dtype=np.float32)
+        counts = {'changed': 0, 'valid': 0, 'predict_calls': 0}
+        band_top = 0  # scene row of acc[0]
+
+        with rasterio.open(paths['prob'], 'w', **profile) as prob_dst, \
+                rasterio.open(paths['mask'], 'w', **profile) as mask_dst:
+
+            def flush(y_end):
+                """Normalize and write rows [band_top, y_end), then shift the buffers up"""
+                n = y_end - band_top
+                if n <= 0:
+                    return
+                prob = np.divide(acc[:n], acc_weight[:n], out=np.zeros((n, width), np.float32),
+                                 where=acc_weight[:n] > 0)
+                region = Window(col0, row0 + band_top, width, n)
+                valid = (pre.dataset_mask(window=region) > 0) & (post.dataset_mask(window=region) > 0)
+                prob[~valid] = 0
+                changed = prob > threshold
+                out = Window(0, band_top, width, n)
+                prob_dst.write((prob * 255).astype(np.uint8), 1, window=out)
+                mask_dst.write(changed.astype(np.uint8) * 255, 1, window=out)
+                counts['changed'] += int(np.count_nonzero(changed))
+                counts['valid'] += int(np.count_nonzero(valid))
+                acc[:-n], acc_weight[:-n] = acc[n:], acc_weight[n:]
+                acc[-n:] = acc_weight[-n:] = 0
+
+            for y in rows:
+                with progress.phase('flush'):
+                    flush(y)
+                band_top = max(band_top, y)
+                with progress.phase('read'):
+                    region = Window(col0, row0 + y, width, min(window_size, height - y))
+                    pre_band, post_band = _read_rgb(pre, region), _read_rgb(post, region)
+                h = pre_band.shape[0]
+                for start in range(0, len(cols), batch_size):
+                    xs = cols[start:start + batch_size]
+                    with progress.phase('inference'):
+                        probs = predict_fn(np.stack([_window_pair(pre_band, post_band, x, window_size) for x in xs]))
+                    counts['predict_calls'] += 1
+                    for x, p in zip(xs, probs):
+                        w = min(window_size, width - x)
+                        acc[:h, x:x + w] += p[:h, :w] * weights[:h, :w]
+                        acc_weight[:h, x:x + w] += weights[:h, :w]
+                    progress.advance({'windows': len(xs)})
+            with progress.phase('flush'):
+                flush(height)
+
+        with progress.phase('previews'):
+            write_preview(paths['mask'], paths['mask_preview'], rgb=False)
+            _write_overlay_preview(post, area, paths['mask'], paths['overlay_preview'])
+
+    return dict(paths, stats={
+        'width': width,
+        'height': height,
+        'windows': len(rows) * len(cols),
+        'predict_calls': counts['predict_calls'],
+        'valid_pixels': counts['valid'],
+        'changed_pixels': counts['changed'],
+        'change_percentage': round(counts['changed'] / counts['valid'] * 100, 2) if counts['valid'] else 0.0,
+    })
+
+def _write_overlay_preview(post, area, mask_path, out_path):
+    """Downsampled post image with changes in red, from decimated reads of both rasters"""
+    scale = min(1.0, PREVIEW_MAX_SIZE / max(area.width, area.height))
+    out_h, out_w = max(1, int(area.height * scale)), max(1, int(area.width * scale))
+    img = to_rgb_uint8(post.read(indexes=[1, 2, 3] if post.count >= 3 else [1, 1, 1], window=area,
+                                 out_shape=(3, out_h, out_w), resampling=Resampling.average))
+    with rasterio.open(mask_path) as mask_src:
+        mask = mask_src.read(1, out_shape=(out_h, out_w), resampling=Resampling.nearest)
+    overlay = img.astype(np.float32)
+    overlay[..., 0] += (mask > 0) * 127.5
+    cv2.imwrite(out_path, cv2.cvtColor(np.clip(overlay, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR))
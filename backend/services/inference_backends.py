@@ -0,0 +1,342 @@
+import os
+import time
+import numpy as np
+
+BACKENDS = ('keras', 'tflite', 'onnx', 'torch', 'torch_opt')
+QUANTIZE_MODES = (None, 'float16', 'int8')
+# torch_opt runs float32 or bfloat16; torch's dynamic int8 quantization only covers
+# Linear/RNN layers, so it would leave an all-convolution UNet unchanged
+TORCH_OPT_QUANTIZE_MODES = (None, 'bfloat16')
+TORCH_COMPILE_MODES = ('trace', 'compile', 'none')
+
+
+class InferenceBackend:
+    """Common interface: predict(batch ndarray) -> ndarray of probabilities/logits"""
+    name = 'base'
+    quantize = None
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def describe(self):
+        return {'backend': self.name, 'quantize': self.quantize}
+
+
+# --- Keras / TFLite (road model) ---
+class KerasBackend(InferenceBackend):
+    name = 'keras'
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter (XNNPACK is the default CPU delegate for float models)
+
+    quantize='float16' stores float16 weights; 'int8' uses dynamic-range
+    quantization (int8 weights, float activations), which needs no calibration data.
+    """
+    name = 'tflite'
+
+    def __init__(self, keras_model, quantize=None, cache_path=None, num_threads=None):
+        import tensorflow as tf
+        self.quantize = quantize
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                flatbuffer = f.read()
+        else:
+            converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+            if quantize:
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if quantize == 'float16':
+                converter.target_spec.supported_types = [tf.float16]
+            flatbuffer = converter.convert()
+            if cache_path:
+                with open(cache_path, 'wb') as f:
+                    f.write(flatbuffer)
+        self.interpreter = tf.lite.Interpreter(model_content=flatbuffer, num_threads=num_threads or os.cpu_count())
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        if self._batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self._input, list(batch.shape))
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        self.interpreter.set_tensor(self._input, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output)
+
+
+# --- PyTorch (change-detection UNet reference) ---
+class TorchBackend(InferenceBackend):
+    name = 'torch'
+
+    def __init__(self, model, device=None):
+        import torch
+        self.torch = torch
+        self.model = model
+        self.device = device or next(model.parameters()).device
+
+    def predict(self, batch):
+        with self.torch.no_grad():
+            x = self.torch.from_numpy(np.asarray(batch, dtype=np.float32)).to(self.device)
+            return self.model(x).cpu().numpy()
+
+
+def fold_batchnorm(model):
+    """Fold each Conv2d -> BatchNorm2d pair of the model's nn.Sequential blocks into the convolution
+
+    The model must be in eval mode (running statistics are baked into the conv
+    weights); the BatchNorm is replaced by an Identity. Returns the number folded.
+    """
+    import torch.nn as nn
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+    folded = 0
+    for block in [m for m in model.modules() if isinstance(m, nn.Sequential)]:
+        names = list(block._modules)
+        for a, b in zip(names, names[1:]):
+            conv, bn = block._modules[a], block._modules[b]
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                block._modules[a] = fuse_conv_bn_eval(conv, bn)
+                block._modules[b] = nn.Identity()
+                folded += 1
+    return folded
+
+
+class TorchOptimizedBackend(InferenceBackend):
+    """PyTorch tuned for CPU inference
+
+    A copy of the model with BatchNorm folded into the convolutions, in
+    channels_last layout, run under torch.inference_mode with an explicit
+    intra-op thread count. compile_mode 'trace' freezes a TorchScript trace
+    (optimize_for_inference fuses conv + ReLU where oneDNN allows), 'compile'
+    uses torch.compile (needs a C++ toolchain) and 'none' stays eager.
+    quantize='bfloat16' runs weights and activations in bfloat16, which is
+    only faster on CPUs with AVX512-BF16/AMX.
+    """
+    name = 'torch_opt'
+
+    def __init__(self, model, quantize=None, num_threads=None, compile_mode='trace', input_shape=(6, 256, 256)):
+        import copy
+        import torch
+        self.torch = torch
+        self.quantize = quantize
+        self.compile_mode = compile_mode
+        # Process-wide setting: this backend owns torch's CPU thread pool
+        self.num_threads = num_threads or os.cpu_count()
+        torch.set_num_threads(self.num_threads)
+        self.dtype = torch.bfloat16 if quantize == 'bfloat16' else torch.float32
+        model = copy.deepcopy(model).cpu().eval()
+        self.folded_bn = fold_batchnorm(model)
+        model = model.to(dtype=self.dtype, memory_format=torch.channels_last)
+        if compile_mode == 'trace':
+            example = self._to_input(np.zeros((1,) + tuple(input_shape), dtype=np.float32))
+            with torch.no_grad():
+                model = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.trace(model, example)))
+        elif compile_mode == 'compile':
+            model = torch.compile(model, dynamic=True)
+        self.model = model
+
+    def _to_input(self, batch):
+        x = self.torch.from_numpy(np.asarray(batch, dtype=np.float32)).to(self.dtype)
+        return x.contiguous(memory_format=self.torch.channels_last)
+
+    def predict(self, batch):
+        with self.torch.inference_mode():
+            return self.model(self._to_input(batch)).float().contiguous().numpy()
+
+    def describe(self):
+        return dict(super().describe(), compile=self.compile_mode, threads=self.num_threads,
+                    folded_batchnorm=self.folded_bn, memory_format='channels_last')
+
+
+# --- ONNX Runtime (both models) ---
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime CPU session; 'int8' = dynamic quantization, 'float16' = converted weights"""
+    name = 'onnx'
+
+    def __init__(self, onnx_path, quantize=None, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+        self.quantize = quantize
+        path = _quantize_onnx(onnx_path, quantize) if quantize else onnx_path
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self._input = self.session.get_inputs()[0]
+        self._float16_input = self._input.type == 'tensor(float16)'
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float16 if self._float16_input else np.float32)
+        out = self.session.run(None, {self._input.name: batch})[0]
+        return out.astype(np.float32)
+
+
+def _quantize_onnx(onnx_path, quantize):
+    out_path = f"{os.path.splitext(onnx_path)[0]}_{quantize}.onnx"
+    if os.path.exists(out_path):
+        return out_path
+    if quantize == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, out_path, weight_type=QuantType.QInt8)
+    elif quantize == 'float16':
+        try:
+            import onnx
+            from onnxconverter_common import float16
+        except ImportError:
+            raise ImportError("float16 ONNX models need onnx and onnxconverter-common")
+        onnx.save(float16.convert_float_to_float16(onnx.load(onnx_path)), out_path)
+    else:
+        raise ValueError(f"Unknown quantize mode: {quantize}")
+    return out_path
+
+
+def export_keras_onnx(keras_model, onnx_path, input_size=(256, 256)):
+    if os.path.exists(onnx_path):
+        return onnx_path
+    try:
+        import tensorflow as tf
+        import tf2onnx
+    except ImportError:
+        raise ImportError("Exporting the road model to ONNX needs tf2onnx (pip install tf2onnx)")
+    spec = (tf.TensorSpec((None, input_size[1], input_size[0], 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, output_path=onnx_path)
+    return onnx_path
+
+
+def export_torch_onnx(torch_model, onnx_path, in_channels=6, input_size=(256, 256)):
+    if os.path.exists(onnx_path):
+        return onnx_path
+    import torch
+    dummy = torch.zeros(1, in_channels, input_size[1], input_size[0], device=next(torch_model.parameters()).device)
+    torch.onnx.export(torch_model, dummy, onnx_path, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}}, opset_version=17)
+    return onnx_path
+
+
+# --- Factories ---
+def _check(kind, quantize, allowed, quantize_modes=QUANTIZE_MODES):
+    if kind not in allowed:
+        raise ValueError(f"Unknown backend '{kind}', expected one of {allowed}")
+    if quantize not in quantize_modes:
+        raise ValueError(f"Unknown quantize mode '{quantize}' for {kind}, expected one of {quantize_modes[1:]}")
+
+
+def build_road_backend(kind, keras_model, quantize=None, cache_dir=None, tag='road', num_threads=None):
+    """Backend for the Keras road model; converted models are cached in cache_dir under `tag`"""
+    _check(kind, quantize, ('keras', 'tflite', 'onnx'))
+    if kind == 'keras':
+        if quantize:
+            raise ValueError("Quantization needs the tflite or onnx backend")
+        return KerasBackend(keras_model)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    if kind == 'tflite':
+        cache_path = os.path.join(cache_dir, f"{tag}_{quantize or 'float32'}.tflite") if cache_dir else None
+        return TFLiteBackend(keras_model, quantize, cache_path, num_threads)
+    onnx_path = export_keras_onnx(keras_model, os.path.join(cache_dir or '.', f"{tag}.onnx"))
+    return OnnxBackend(onnx_path, quantize, num_threads)
+
+
+def build_unet_backend(kind, torch_model, quantize=None, cache_dir=None, tag='unet', num_threads=None,
+                       compile_mode='trace'):
+    """Backend for the change-detection UNet (NCHW input, logits output)"""
+    if kind == 'torch_opt':
+        _check(kind, quantize, ('torch_opt',), TORCH_OPT_QUANTIZE_MODES)
+        if compile_mode not in TORCH_COMPILE_MODES:
+            raise ValueError(f"Unknown compile mode '{compile_mode}', expected one of {TORCH_COMPILE_MODES}")
+        return TorchOptimizedBackend(torch_model, quantize, num_threads, compile_mode)
+    _check(kind, quantize, ('torch', 'onnx'))
+    if kind == 'torch':
+        if quantize:
+            raise ValueError("Quantization needs the onnx or torch_opt backend")
+        return TorchBackend(torch_model)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    onnx_path = export_torch_onnx(torch_model, os.path.join(cache_dir or '.', f"{tag}.onnx"))
+    return OnnxBackend(onnx_path, quantize, num_threads)
+
+
+# --- Parity check ---
+def parity_check(reference, candidate, batches, threshold=0.5, to_prob=None):
+    """Compare a candidate backend against the reference on the same inputs
+
+    Masks are binarized at `threshold` (after `to_prob`, e.g. a sigmoid for
+    logits) and compared by IoU; `iou_drop` is 1 - IoU, i.e. how much of the
+    reference road/change mask the candidate disagrees on.
+    """
+    intersection = union = 0
+    abs_diff_sum = abs_diff_max = count = 0.0
+    ref_time = cand_time = 0.0
+    for batch in batches:
+        t0 = time.perf_counter()
+        ref = np.asarray(reference.predict(batch), dtype=np.float32)
+        ref_time += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        cand = np.asarray(candidate.predict(batch), dtype=np.float32).reshape(ref.shape)
+        cand_time += time.perf_counter() - t0
+        if to_prob:
+            ref, cand = to_prob(ref), to_prob(cand)
+        ref_mask, cand_mask = ref > threshold, cand > threshold
+        intersection += int(np.logical_and(ref_mask, cand_mask).sum())
+        union += int(np.logical_or(ref_mask, cand_mask).sum())
+        diff = np.abs(ref - cand)
+        abs_diff_sum += float(diff.sum())
+        abs_diff_max = max(abs_diff_max, float(diff.max()))
+        count += diff.size
+    iou = intersection / union if union else 1.0
+    return {
+        'reference': reference.describe(),
+        'candidate': candidate.describe(),
+        'iou_vs_reference': round(iou, 5),
+        'iou_drop': round(1 - iou, 5),
+        'mean_abs_diff': round(abs_diff_sum / count, 6) if count else 0.0,
+        'max_abs_diff': round(abs_diff_max, 6),
+        'reference_time_s': round(ref_time, 3),
+        'candidate_time_s': round(cand_time, 3),
+        'speedup': round(ref_time / cand_time, 2) if cand_time else None,
+    }
+
+
+# --- Micro-benchmark ---
+def benchmark(backend, batch_sizes=(1, 8, 32), input_shape=(6, 256, 256), repeats=5, warmup=1):
+    """Forward latency of a backend on random inputs at each batch size
+
+    Warm-up runs (lazy init, allocator, JIT specialization) are not timed;
+    the median of `repeats` timed runs is reported with the min and the
+    per-sample cost.
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size,) + tuple(input_shape), dtype=np.float32)
+        for _ in range(warmup):
+            backend.predict(batch)
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            backend.predict(batch)
+            times.append(time.perf_counter() - t0)
+        times.sort()
+        median = times[len(times) // 2]
+        results.append({
+            'batch_size': batch_size,
+            'median_ms': round(median * 1000, 2),
+            'min_ms': round(times[0] * 1000, 2),
+            'per_sample_ms': round(median * 1000 / batch_size, 2),
+            'samples_per_s': round(batch_size / median, 2),
+        })
+    return {'backend': backend.describe(), 'repeats': repeats, 'warmup': warmup, 'results': results}
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
@@ -0,0 +1,190 @@
+import gc
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from services.startup import LazySubsystem
+
+# RAM the registry may keep in model weights (MB, 0 = no limit); idle models past it are unloaded
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 4096))
+# Models warmed up at startup (unless STARTUP_MODE=lazy); the others load on their first lease
+MODEL_PRELOAD = {name.strip() for name in os.getenv("MODEL_PRELOAD", "roads,road_pool,change_detection").split(',')
+                 if name.strip()}
+
+
+def model_nbytes(obj, _seen=None):
+    """Approximate bytes of weights held by a model-like object
+
+    Understands torch modules, Keras models and spaCy pipelines; tuples and
+    lists are summed and anything with a `.model` (transformers pipelines,
+    inference backends, services) is looked through. The same module
+    reached twice is counted once. Unknown objects count as 0.
+    """
+    seen = set() if _seen is None else _seen
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (tuple, list)):
+        return sum(model_nbytes(item, seen) for item in obj)
+    if hasattr(obj, 'parameters') and hasattr(obj, 'buffers'):
+        return sum(t.numel() * t.element_size() for t in list(obj.parameters()) + list(obj.buffers()))
+    if hasattr(obj, 'count_params') and hasattr(obj, 'weights'):
+        return sum(int(np.prod(w.shape)) * np.dtype(getattr(w.dtype, 'name', w.dtype)).itemsize
+                   for w in obj.weights)
+    if hasattr(obj, 'pipe_names') and hasattr(obj, 'to_bytes'):
+        return len(obj.to_bytes())
+    if hasattr(obj, 'model'):
+        return model_nbytes(obj.model, seen) + model_nbytes(getattr(obj, 'backend', None), seen)
+    return 0
+
+
+class ManagedModel(LazySubsystem):
+    """A registry entry: loads like a LazySubsystem, is used through lease() and can be unloaded again
+
+    Only models named in MODEL_PRELOAD are warmed up at startup. A failed
+    load is not final: the next start() or lease() tries again, and the
+    last error stays in status() meanwhile.
+    """
+
+    def __init__(self, registry, name, factory, imports=(), sizeof=model_nbytes, unload=None):
+        super().__init__(name, factory, imports)
+        self.registry = registry
+        self.sizeof = sizeof
+        self.unload = unload
+        self.preload = name in MODEL_PRELOAD
+        self.refs = 0
+        self.inferences = 0
+        self.loads = 0
+        self.failures = 0
+        self.last_error = None
+        self.evictions = 0
+        self.nbytes = 0
+        self.last_used = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self._ready.is_set():
+                # The last load failed: start over
+                self.error = None
+                self._ready = threading.Event()
+        return super().start()
+
+    def _load(self):
+        super()._load()
+        if self.error is None:
+            self.nbytes = self.sizeof(self._value)
+            self.loads += 1
+        else:
+            self.failures += 1
+            self.last_error = self.error
+            with self._lock:
+                self._thread = None
+        self.registry.enforce_budget(keep=self)
+
+    @contextmanager
+    def lease(self, timeout=None, count=True):
+        """The loaded model, kept resident (never evicted) until the block exits
+
+        Each lease counts as one inference; pass count=False for a lease that
+        only pins the model across a run whose predictions lease it again.
+        """
+        with self.registry._lock:
+            self.refs += 1
+        used = False
+        try:
+            model = self.get(timeout)
+            used = count
+            yield model
+        finally:
+            with self.registry._lock:
+                self.refs -= 1
+                self.inferences += used
+                self.last_used = time.time()
+            self.registry.enforce_budget(keep=self)
+
+    def _unload(self):
+        """Drop the model; the next lease loads it again. Caller holds the registry lock."""
+        if self.unload is not None and self._value is not None:
+            self.unload(self._value)
+        self._value = None
+        self.nbytes = 0
+        self.evictions += 1
+        with self._lock:
+            self._thread = None
+            self._ready = threading.Event()
+
+    def status(self):
+        return dict(super().status(), refs=self.refs, inferences=self.inferences, loads=self.loads,
+                    failures=self.failures, last_error=self.last_error, evictions=self.evictions, memory_mb=round(self.nbytes / 1024 ** 2, 1),
+                    idle_s=round(time.time() - self.last_used, 1) if self.last_used else None)
+
+
+class ModelRegistry:
+    """Models by name, loaded on first lease and unloaded least recently used first when over budget
+
+    Only idle models (loaded, no lease held) are ever unloaded, so a budget
+    smaller than the models in use at once is exceeded rather than breaking
+    requests. Footprints are the weights counted by `sizeof`, not the
+    runtime's own overhead.
+    """
+
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = budget_bytes or None
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, imports=(), sizeof=model_nbytes, unload=None):
+        """Add a model built by `factory()` after importing `imports`; nothing is loaded yet
+
+        `unload(model)` frees what dropping the reference doesn't, such as
+        worker processes that hold their own copies.
+        """
+        entry = ManagedModel(self, name, factory, imports, sizeof, unload)
+        self.models[name] = entry
+        return entry
+
+    def lease(self, name, timeout=None, count=True):
+        return self.models[name].lease(timeout, count)
+
+    @property
+    def resident_bytes(self):
+        return sum(entry.nbytes for entry in self.models.values())
+
+    def enforce_budget(self, keep=None):
+        """Unload idle models, least recently used first, until the resident ones fit the budget"""
+        if self.budget_bytes is None:
+            return
+        evicted = []
+        with self._lock:
+            while self.resident_bytes > self.budget_bytes:
+                idle = [entry for entry in self.models.values()
+                        if entry is not keep and entry.refs == 0 and entry.ready and entry.nbytes]
+                if not idle:
+                    break
+                victim = min(idle, key=lambda entry: entry.last_used or 0)
+                victim._unload()
+                evicted.append(victim.name)
+        if evicted:
+            gc.collect()
+            print(f"Model registry over budget: unloaded {', '.join(evicted)}")
+
+    def evict(self, name):
+        """Unload one model now if it is idle; False if it is leased or not loaded"""
+        with self._lock:
+            entry = self.models[name]
+            if entry.refs or not entry.ready:
+                return False
+            entry._unload()
+        gc.collect()
+        return True
+
+    def stats(self):
+        return {
+            "budget_mb": round(self.budget_bytes / 1024 ** 2, 1) if self.budget_bytes else None,
+            "resident_mb": round(self.resident_bytes / 1024 ** 2, 1),
+            "models": {name: entry.status() for name, entry in self.models.items()},
+        }
+
+
+model_registry = ModelRegistry(MODEL_MEMORY_BUDGET_MB * 1024 ** 2)
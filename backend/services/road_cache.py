@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def save_and_hash(stream, dest_path, chunk_size=HASH_CHUNK_SIZE):
+    """Copy an upload stream to disk while hashing it; returns the sha256 hex digest"""
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(upload_hash, model_hash, params):
+    """Content address of one extraction: input bytes + model weights + post-processing parameters"""
+    payload = json.dumps({'upload': upload_hash, 'model': model_hash, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RoadResultCache:
+    """Content-addressed index of finished road extractions
+
+    Each entry records the output files of one job. Disk usage is bounded by the
+    artifact janitor, which evicts jobs LRU-first and tells the cache to forget
+    them; an entry whose files have gone missing is dropped on lookup. The
+    index is kept in memory and mirrored to a JSON file so hits survive restarts.
+    """
+
+    INDEX_NAME = '.road_cache_index.json'
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, self.INDEX_NAME)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in sorted(entries.items(), key=lambda kv: kv[1]['last_access']):
+            self._entries[key] = entry
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """Return the cached result for key (and mark it recently used), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and all(os.path.exists(os.path.join(self.root, name)) for name in entry['files']):
+                entry['last_access'] = time.time()
+                self._entries.move_to_end(key)
+                self._save_index()
+                self.hits += 1
+                return entry['result']
+            if entry:
+                del self._entries[key]
+                self._save_index()
+            self.misses += 1
+            return None
+
+    def put(self, key, prefix, result):
+        """Record a finished extraction; `result` maps output kinds to file names in root"""
+        with self._lock:
+            # Outputs built on first request ('derived') are not required for a hit
+            derived = set(result.get('derived', ()))
+            files = [name for kind, name in result.items()
+                     if kind not in ('mode', 'stats', 'derived') and kind not in derived]
+            self._entries[key] = {'prefix': prefix, 'files': files, 'result': result, 'last_access': time.time()}
+            self._entries.move_to_end(key)
+            self._save_index()
+
+    def forget_prefix(self, prefix):
+        """Drop entries whose files (job prefix, or the part before its first '_') were evicted"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry['prefix'] == prefix or entry['prefix'].startswith(prefix + '_')]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._save_index()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,239 @@
+import heapq
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# --- Distances ---
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = (np.radians(v) for v in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def polyline_length(xy, geo):
+    if len(xy) < 2:
+        return 0.0
+    if geo:
+        return float(haversine(xy[:-1, 0], xy[:-1, 1], xy[1:, 0], xy[1:, 1]).sum())
+    return float(np.hypot(*np.diff(xy, axis=0).T).sum())
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+class RoadGraph:
+    """Road network in CSR layout: junctions/endpoints are nodes, skeleton segments are edges
+
+    Everything is a flat numpy array, so a graph is a single .npz next to the
+    job's other artifacts and loads without any image processing:
+
+    - node_xy (n, 2): node coordinates, WGS84 lon/lat if `geo` else pixel (x, y)
+    - indptr (n + 1), indices / weights / edge_of (2E): symmetric adjacency;
+      weights are metres if `geo` else pixels
+    - edge_nodes (E, 2), edge_ptr (E + 1), edge_xy: each edge's end nodes and
+      simplified polyline
+    - component (n): connected component label of every node
+
+    Edge weights are never shorter than the straight line between their end
+    nodes, so straight-line distance is a consistent A* heuristic.
+    """
+
+    ARRAYS = ('node_xy', 'indptr', 'indices', 'weights', 'edge_of', 'edge_nodes', 'edge_ptr', 'edge_xy',
+              'component')
+
+    def __init__(self, geo, **arrays):
+        self.geo = bool(geo)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._adjacency = None
+        self._lock = threading.Lock()
+
+    # --- Construction ---
+    @classmethod
+    def build(cls, node_xy, edge_nodes, lines, geo):
+        """Graph from node coordinates, (a, b) node pairs per edge and each edge's polyline"""
+        edge_nodes = np.asarray(edge_nodes, dtype=np.int64).reshape(-1, 2)
+        # Drop nodes that lost all their edges (e.g. to spur pruning)
+        used = np.unique(edge_nodes)
+        remap = np.full(len(node_xy), -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        node_xy = np.asarray(node_xy, dtype=np.float64)[used].reshape(-1, 2)
+        edge_nodes = remap[edge_nodes]
+        n, num_edges = len(node_xy), len(edge_nodes)
+
+        a, b = edge_nodes[:, 0], edge_nodes[:, 1]
+        if geo:
+            straight = haversine(node_xy[a, 0], node_xy[a, 1], node_xy[b, 0], node_xy[b, 1])
+        else:
+            straight = np.hypot(*(node_xy[a] - node_xy[b]).T)
+        lengths = np.array([polyline_length(np.asarray(line), geo) for line in lines], dtype=np.float64)
+        weights = np.maximum(lengths.reshape(-1), straight.reshape(-1)) if num_edges else np.zeros(0)
+
+        src = np.concatenate([a, b])
+        order = np.argsort(src, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=n))])
+        edge_ids = np.concatenate([np.arange(num_edges), np.arange(num_edges)])
+
+        parent = list(range(n))
+        for u, v in edge_nodes.tolist():
+            ru, rv = _find(parent, u), _find(parent, v)
+            if ru != rv:
+                parent[max(ru, rv)] = min(ru, rv)
+        roots = np.array([_find(parent, i) for i in range(n)], dtype=np.int64).reshape(-1)
+        _, component = np.unique(roots, return_inverse=True)
+
+        counts = [len(line) for line in lines]
+        return cls(
+            geo,
+            node_xy=node_xy,
+            indptr=indptr.astype(np.int64),
+            indices=np.concatenate([b, a])[order].astype(np.int32),
+            weights=np.concatenate([weights, weights])[order].astype(np.float32),
+            edge_of=edge_ids[order].astype(np.int32),
+            edge_nodes=edge_nodes.astype(np.int32),
+            edge_ptr=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            edge_xy=np.concatenate(lines).reshape(-1, 2) if lines else np.zeros((0, 2)),
+            component=component.astype(np.int32),
+        )
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, geo=np.array(self.geo), **{name: getattr(self, name) for name in self.ARRAYS})
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(bool(data['geo']), **{name: data[name] for name in cls.ARRAYS})
+
+    # --- Queries ---
+    @property
+    def num_nodes(self):
+        return len(self.node_xy)
+
+    def _distances(self, x, y, xy):
+        if self.geo:
+            return haversine(x, y, xy[..., 0], xy[..., 1])
+        return np.hypot(xy[..., 0] - x, xy[..., 1] - y)
+
+    def nearest_node(self, x, y):
+        """(node, distance) of the node closest to a coordinate in the graph's coordinate space"""
+        if not self.num_nodes:
+            raise ValueError("Road graph has no nodes")
+        distances = self._distances(x, y, self.node_xy)
+        node = int(np.argmin(distances))
+        return node, float(distances[node])
+
+    def components(self, top=10):
+        """Component count and the largest components by node count and total road length"""
+        sizes = np.bincount(self.component, minlength=1) if self.num_nodes else np.zeros(0, dtype=np.int64)
+        edge_component = self.component[self.edge_nodes[:, 0]] if len(self.edge_nodes) else np.zeros(0, np.int64)
+        edge_weights = self.weights[np.unique(self.edge_of, return_index=True)[1]] if len(self.edge_of) else []
+        lengths = np.bincount(edge_component, weights=edge_weights, minlength=len(sizes))
+        largest = np.argsort(-lengths, kind='stable')[:top]
+        return {
+            'nodes': self.num_nodes,
+            'edges': len(self.edge_nodes),
+            'components': len(sizes),
+            'largest': [{'component': int(c), 'nodes': int(sizes[c]), 'length': round(float(lengths[c]), 1)}
+                        for c in largest],
+        }
+
+    def component_of(self, node):
+        c = int(self.component[node])
+        return {'component': c, 'nodes': int(np.count_nonzero(self.component == c))}
+
+    def _adjacency_lists(self):
+        """Python lists of the CSR arrays: far faster than numpy scalars in the search loop"""
+        with self._lock:
+            if self._adjacency is None:
+                self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist(),
+                                   self.edge_of.tolist(), self.node_xy.tolist())
+            return self._adjacency
+
+    def _heuristic(self, node_xy, target):
+        """Straight-line distance to the target (scalar math; called once per pushed node)"""
+        tx, ty = node_xy[target]
+        if not self.geo:
+            return lambda n: math.hypot(node_xy[n][0] - tx, node_xy[n][1] - ty)
+        cos_ty, rtx, rty = math.cos(math.radians(ty)), math.radians(tx), math.radians(ty)
+
+        def h(n):
+            lon, lat = math.radians(node_xy[n][0]), math.radians(node_xy[n][1])
+            a = math.sin((rty - lat) / 2) ** 2 + math.cos(lat) * cos_ty * math.sin((rtx - lon) / 2) ** 2
+            return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+        return h
+
+    def shortest_path(self, source, target):
+        """A* between two nodes; returns (length, [edge ids in order], [node ids]) or None if unreachable"""
+        if self.component[source] != self.component[target]:
+            return None
+        indptr, indices, weights, edge_of, node_xy = self._adjacency_lists()
+        h = self._heuristic(node_xy, target)
+        best = {source: 0.0}
+        came_from = {}
+        heap = [(h(source), 0.0, source)]
+        done = set()
+        while heap:
+            _, dist, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                cand = dist + weights[k]
+                if cand < best.get(nxt, float('inf')):
+                    best[nxt] = cand
+                    came_from[nxt] = (node, edge_of[k])
+                    heapq.heappush(heap, (cand + h(nxt), cand, nxt))
+        if target not in best:
+            return None
+        nodes, edges = [target], []
+        while nodes[-1] != source:
+            prev, edge = came_from[nodes[-1]]
+            edges.append(edge)
+            nodes.append(prev)
+        return best[target], edges[::-1], nodes[::-1]
+
+    def path_geometry(self, edges, nodes):
+        """Concatenated polyline of a path's edges, each oriented in travel direction"""
+        parts = []
+        for edge, start in zip(edges, nodes):
+            line = self.edge_xy[self.edge_ptr[edge]:self.edge_ptr[edge + 1]]
+            if self.edge_nodes[edge][0] != start:
+                line = line[::-1]
+            parts.append(line if not parts else line[1:])
+        if not parts:
+            return self.node_xy[nodes[:1]]
+        return np.concatenate(parts)
+
+
+class RoadGraphCache:
+    """Small LRU of loaded graphs, so repeated queries skip the .npz load"""
+
+    def __init__(self, max_graphs=8):
+        self.max_graphs = max_graphs
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+                return graph
+        graph = RoadGraph.load(path)
+        with self._lock:
+            self._graphs[key] = graph
+            while len(self._graphs) > self.max_graphs:
+                self._graphs.popitem(last=False)
+        return graph
@@ -0,0 +1,162 @@
+import cv2
+import numpy as np
+
+# --- Patch layout ---
+def iter_patch_boxes(height, width, crop_grid=(2, 4), patch_size=(500, 500)):
+    """Yield (y0, y1, x0, x1) for every patch of every crop, in full-image coordinates"""
+    crop_rows, crop_cols = crop_grid
+    crop_height = int(np.ceil(height / crop_rows))
+    crop_width = int(np.ceil(width / crop_cols))
+    for i in range(crop_rows):
+        for j in range(crop_cols):
+            cy0 = i * crop_height
+            cy1 = min((i + 1) * crop_height, height)
+            cx0 = j * crop_width
+            cx1 = min((j + 1) * crop_width, width)
+            if cy1 <= cy0 or cx1 <= cx0:
+                continue
+            for py0 in range(cy0, cy1, patch_size[1]):
+                for px0 in range(cx0, cx1, patch_size[0]):
+                    yield (py0, min(py0 + patch_size[1], cy1), px0, min(px0 + patch_size[0], cx1))
+
+def crop_index(y0, x0, height, width, crop_grid=(2, 4)):
+    """Row-major index of the crop containing pixel (y0, x0)"""
+    crop_height = int(np.ceil(height / crop_grid[0]))
+    crop_width = int(np.ceil(width / crop_grid[1]))
+    return (y0 // crop_height) * crop_grid[1] + x0 // crop_width
+
+def count_by_crop(boxes, height, width, crop_grid=(2, 4)):
+    """Number of patch boxes in each crop, keyed by row-major crop index"""
+    counts = {}
+    for crop, crop_boxes in group_by_crop(boxes, height, width, crop_grid).items():
+        counts[crop] = len(crop_boxes)
+    return counts
+
+def group_by_crop(boxes, height, width, crop_grid=(2, 4)):
+    """Patch boxes of each crop, keyed by row-major crop index"""
+    groups = {}
+    for box in boxes:
+        groups.setdefault(crop_index(box[0], box[2], height, width, crop_grid), []).append(box)
+    return groups
+
+# --- Pre-screen: skip empty, nodata and saturated patches ---
+SCREEN_DEFAULTS = {
+    'max_nodata_frac': 0.99,     # pixels that are 0 in every band
+    'max_saturated_frac': 0.98,  # pixels at or above `saturation` in every band (cloud)
+    'saturation': 250,
+    'min_variance': 2.0,         # grey-level variance below this is a flat, featureless patch
+}
+
+def patch_stats(img, boxes, offset=(0, 0), saturation=250):
+    """Per-patch nodata/saturated fractions, mean brightness and variance in one pass
+
+    `boxes` must tile `img` as a rectilinear grid (as iter_patch_boxes does), so
+    per-patch sums come from np.add.reduceat over each patch row instead of a
+    Python loop per patch. Returns a dict of arrays aligned with `boxes`.
+    """
+    oy, ox = offset
+    rows = sorted({(y0, y1) for y0, y1, _, _ in boxes})
+    cols = sorted({(x0, x1) for _, _, x0, x1 in boxes})
+    row_index = {y0: r for r, (y0, _) in enumerate(rows)}
+    col_index = {x0: c for c, (x0, _) in enumerate(cols)}
+    col_starts = np.array([x0 - ox for x0, _ in cols])
+    widths = np.array([x1 - x0 for x0, x1 in cols], dtype=np.float64)
+    shape = (len(rows), len(cols))
+    nodata, saturated, mean, var = (np.zeros(shape) for _ in range(4))
+    for r, (y0, y1) in enumerate(rows):
+        band = img[y0 - oy:y1 - oy, col_starts[0]:]
+        area = (y1 - y0) * widths
+        nodata[r] = np.add.reduceat((band.max(axis=2) == 0).sum(axis=0), col_starts - col_starts[0]) / area
+        saturated[r] = np.add.reduceat((band.min(axis=2) >= saturation).sum(axis=0), col_starts - col_starts[0]) / area
+        gray = cv2.cvtColor(band, cv2.COLOR_RGB2GRAY).astype(np.float32)
+        s1 = np.add.reduceat(gray.sum(axis=0, dtype=np.float64), col_starts - col_starts[0])
+        s2 = np.add.reduceat((gray * gray).sum(axis=0, dtype=np.float64), col_starts - col_starts[0])
+        mean[r] = s1 / area
+        var[r] = s2 / area - mean[r] ** 2
+    idx = tuple(np.array([(row_index[b[0]], col_index[b[2]]) for b in boxes]).T)
+    return {'nodata_frac': nodata[idx], 'saturated_frac': saturated[idx], 'brightness': mean[idx], 'variance': var[idx]}
+
+def screen_patches(img, boxes, offset=(0, 0), params=None):
+    """Split boxes into (to_predict, skipped) using cheap per-patch statistics
+
+    Skipped patches are left at zero probability in the output masks.
+    """
+    boxes = list(boxes)
+    if not boxes:
+        return [], []
+    params = dict(SCREEN_DEFAULTS, **(params or {}))
+    stats = patch_stats(img, boxes, offset, params['saturation'])
+    skip = ((stats['nodata_frac'] >= params['max_nodata_frac'])
+            | (stats['saturated_frac'] >= params['max_saturated_frac'])
+            | (stats['variance'] < params['min_variance']))
+    return [b for b, s in zip(boxes, skip) if not s], [b for b, s in zip(boxes, skip) if s]
+
+# --- Vectorized batch resizing (matches cv2.resize sampling) ---
+def _linear_taps(src, dst):
+    pos = (np.arange(dst, dtype=np.float32) + 0.5) * (src / dst) - 0.5
+    pos = np.clip(pos, 0, src - 1)
+    i0 = np.floor(pos).astype(np.intp)
+    i1 = np.minimum(i0 + 1, src - 1)
+    return i0, i1, (pos - i0).astype(np.float32)
+
+def resize_batch_linear(batch, height, width):
+    """Bilinear resize of a (N, H, W) float batch to (N, height, width)"""
+    y0, y1, wy = _linear_taps(batch.shape[1], height)
+    x0, x1, wx = _linear_taps(batch.shape[2], width)
+    wy = wy[None, :, None]
+    wx = wx[None, None, :]
+    rows = batch[:, y0] * (1 - wy) + batch[:, y1] * wy
+    return rows[:, :, x0] * (1 - wx) + rows[:, :, x1] * wx
+
+def resize_batch_nearest(batch, height, width):
+    """Nearest-neighbour resize of a (N, H, W) batch to (N, height, width)"""
+    yi = np.minimum((np.arange(height) * (batch.shape[1] / height)).astype(np.intp), batch.shape[1] - 1)
+    xi = np.minimum((np.arange(width) * (batch.shape[2] / width)).astype(np.intp), batch.shape[2] - 1)
+    return batch[:, yi[:, None], xi[None, :]]
+
+# --- Batched inference ---
+def scatter_predictions(preds, boxes, prob_mask, binary_mask, offset=(0, 0)):
+    """Resize a batch of predictions back to their patch sizes and write them into the masks"""
+    oy, ox = offset
+    groups = {}
+    for k, (y0, y1, x0, x1) in enumerate(boxes):
+        groups.setdefault((y1 - y0, x1 - x0), []).append(k)
+    for (h, w), idx in groups.items():
+        group = preds[idx]
+        prob = resize_batch_linear(group, h, w)
+        if prob_mask.dtype == np.uint8:
+            # Quantized storage keeps the same 0-255 scale the post-processing thresholds
+            prob = (prob * 255).astype(np.uint8)
+        binary = resize_batch_nearest((group > 0.5).astype(np.uint8), h, w)
+        for n, k in enumerate(idx):
+            y0, y1, x0, x1 = boxes[k]
+            prob_mask[y0 - oy:y1 - oy, x0 - ox:x1 - ox] = prob[n]
+            binary_mask[y0 - oy:y1 - oy, x0 - ox:x1 - ox] = binary[n]
+
+def predict_patches(img, boxes, predict_fn, prob_mask, binary_mask, batch_size=32, target_size=(256, 256),
+                    offset=(0, 0), on_batch=None):
+    """Run predict_fn on fixed-size batches of resized patches and scatter the results
+
+    `offset` is the (y, x) position of `img` and the masks inside the full image,
+    so a window of the scene can be processed with full-image patch boxes.
+    `on_batch(boxes)` is called after each batch has been scattered.
+    Returns the number of predict calls made.
+    """
+    oy, ox = offset
+    boxes = list(boxes)
+    batch = np.zeros((batch_size, target_size[1], target_size[0], 3), dtype=np.float32)
+    calls = 0
+    for start in range(0, len(boxes), batch_size):
+        chunk = boxes[start:start + batch_size]
+        batch[len(chunk):] = 0
+        for k, (y0, y1, x0, x1) in enumerate(chunk):
+            batch[k] = cv2.resize(img[y0 - oy:y1 - oy, x0 - ox:x1 - ox], target_size)
+        batch[:len(chunk)] /= 255.0
+        preds = np.asarray(predict_fn(batch))
+        if preds.ndim == 4:
+            preds = preds[..., 0]
+        scatter_predictions(preds[:len(chunk)], chunk, prob_mask, binary_mask, offset)
+        calls += 1
+        if on_batch:
+            on_batch(chunk)
+    return calls
@@ -0,0 +1,207 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class NullProgress:
+    """Progress sink used when a pipeline runs outside the job queue"""
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def set_patches(self, crop_totals):
+        pass
+
+    def advance(self, crop_counts):
+        pass
+
+    def publish(self, kind, name):
+        pass
+
+
+NULL_PROGRESS = NullProgress()
+
+
+class RoadJob(NullProgress):
+    """State of one queued road extraction: status, per-crop progress and phase timings"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.current_phase = None
+        self.phases = {}
+        self.crops = {}
+        self.result = None
+        self.outputs = {}
+        self.error = None
+        self._inference_started = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a step; phases may nest (e.g. 'tiles' inside 'postprocess') and restore the outer one"""
+        t0 = time.perf_counter()
+        previous, self.current_phase = self.current_phase, name
+        try:
+            yield
+        finally:
+            self.phases[name] = round(self.phases.get(name, 0) + time.perf_counter() - t0, 3)
+            self.current_phase = previous
+
+    def set_patches(self, crop_totals):
+        """crop_totals maps crop index -> number of patches in that crop"""
+        with self._lock:
+            self.crops = {crop: {'done': 0, 'total': total} for crop, total in crop_totals.items()}
+            self._inference_started = time.time()
+
+    def advance(self, crop_counts):
+        with self._lock:
+            for crop, n in crop_counts.items():
+                self.crops[crop]['done'] += n
+
+    def publish(self, kind, name):
+        """Make an output usable before the job finishes (e.g. a tile pyramid being written)"""
+        with self._lock:
+            self.outputs[kind] = name
+
+    def to_dict(self):
+        with self._lock:
+            done = sum(c['done'] for c in self.crops.values())
+            total = sum(c['total'] for c in self.crops.values())
+            crops = {str(k): dict(v) for k, v in sorted(self.crops.items())}
+            outputs = dict(self.outputs)
+        eta = None
+        if self.status == 'running' and done and self._inference_started and done < total:
+            eta = round((time.time() - self._inference_started) / done * (total - done), 1)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'phase': self.current_phase,
+            'patches_done': done,
+            'patches_total': total,
+            'progress': round(done / total, 4) if total else 0.0,
+            'crops': crops,
+            'eta_s': eta,
+            'phase_timings_s': dict(self.phases),
+            'outputs': outputs,
+            'queued_s': round((self.started or time.time()) - self.created, 3),
+            'elapsed_s': round((self.finished or time.time()) - self.started, 3) if self.started else None,
+            'error': self.error,
+        }
+
+
+class RoadJobQueue:
+    """Bounded worker pool for road extraction jobs
+
+    At most `workers` jobs run at once and at most `max_queued` more wait;
+    submitting beyond that raises QueueFullError instead of piling up uploads.
+    """
+
+    def __init__(self, workers=2, max_queued=8, keep_finished=200):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='road-job')
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs); its return value becomes job.result"""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError(f"Road job queue is full ({self.workers} running, {self.max_queued} queued)")
+        job = RoadJob()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def submit_after(self, wait, fn, *args, **kwargs):
+        """Like submit(), but the job only takes a worker once wait(job) has returned
+
+        The wait (e.g. for the first rows of an upload) runs on a thread of
+        its own, so slow inputs can't hold every worker; the job still counts
+        against the queue bound. If wait raises, the job fails with its error.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError(f"Road job queue is full ({self.workers} running, {self.max_queued} queued)")
+        job = RoadJob()
+        job.status = 'waiting'
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        threading.Thread(target=self._wait_then_submit, args=(job, wait, fn, args, kwargs),
+                         name=f"road-job-wait-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def _wait_then_submit(self, job, wait, fn, args, kwargs):
+        try:
+            wait(job)
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'error'
+            job.finished = time.time()
+            job.current_phase = None
+            self._slots.release()
+            return
+        job.status = 'queued'
+        self._executor.submit(self._run, job, fn, args, kwargs)
+
+    def add_finished(self, result):
+        """Register a job that is already done (e.g. served from the result cache)"""
+        job = RoadJob()
+        job.started = job.finished = job.created
+        job.status = 'done'
+        job.result = result
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.started = time.time()
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'error'
+            print(f"Road job {job.id} failed: {e}\n{traceback.format_exc()}")
+        finally:
+            job.finished = time.time()
+            job.current_phase = None
+            self._slots.release()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        finished.sort(key=lambda j: j.finished)
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            'workers': self.workers,
+            'max_queued': self.max_queued,
+            'waiting': sum(j.status == 'waiting' for j in jobs),
+            'queued': sum(j.status == 'queued' for j in jobs),
+            'running': sum(j.status == 'running' for j in jobs),
+        }
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from services.road_postprocess import overlay_rows
+
+OUTPUT_PROFILES = ('full', 'compact')
+MASK_ENCODINGS = ('bilevel', 'rle')
+# libwebp cannot encode images larger than this in either dimension
+WEBP_MAX_DIMENSION = 16383
+
+# --- Compact encodings ---
+def write_bilevel_png(path, mask):
+    """1-bit PNG of a 0/255 mask (typically 10-20x smaller than 8-bit, and faster to encode)"""
+    if not cv2.imwrite(path, mask, [cv2.IMWRITE_PNG_BILEVEL, 1]):
+        raise RuntimeError(f"Could not write {path}")
+    return path
+
+def write_prob_webp(path_base, prob):
+    """uint8 probability mask as WebP, falling back to PNG beyond WebP's size limit; returns the path"""
+    if max(prob.shape[:2]) > WEBP_MAX_DIMENSION:
+        path = f"{path_base}.png"
+        cv2.imwrite(path, prob, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    else:
+        path = f"{path_base}.webp"
+        cv2.imwrite(path, prob, [cv2.IMWRITE_WEBP_QUALITY, 90])
+    return path
+
+def rle_encode(mask):
+    """Row-major run lengths of a binary mask: (first value, runs)"""
+    flat = np.asarray(mask).ravel() > 0
+    if not flat.size:
+        return False, np.zeros(0, dtype=np.uint32)
+    edges = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], edges, [flat.size])))
+    return bool(flat[0]), runs.astype(np.uint32)
+
+def rle_decode(shape, first, runs):
+    values = np.zeros(len(runs), dtype=np.uint8)
+    values[(0 if first else 1)::2] = 255
+    return np.repeat(values, runs).reshape(shape)
+
+def write_rle(path, mask):
+    first, runs = rle_encode(mask)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, shape=np.array(mask.shape), first=np.array(first), runs=runs)
+    return path
+
+def read_rle(path):
+    with np.load(path) as data:
+        return rle_decode(tuple(data['shape']), bool(data['first']), data['runs'])
+
+# --- Artifacts built on first request ---
+# name -> [lock, holders and waiters]; an entry goes once nobody uses its lock
+_derive_locks = {}
+_derive_locks_lock = threading.Lock()
+
+@contextmanager
+def _derive_lock(name):
+    with _derive_locks_lock:
+        entry = _derive_locks.setdefault(name, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _derive_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _derive_locks[name]
+
+def _write_atomic(path, img):
+    # A temp file of its own per writer: another process (or worker) may build the same file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.derive_', suffix='.png')
+    os.close(fd)
+    try:
+        if not cv2.imwrite(tmp_path, img):
+            raise RuntimeError(f"Could not write {path}")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _load_mask(root, base):
+    path = os.path.join(root, f"{base}_processed_mask.png")
+    if os.path.exists(path):
+        return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    rle_path = os.path.join(root, f"{base}_processed_mask.npz")
+    if os.path.exists(rle_path):
+        return read_rle(rle_path)
+    return None
+
+def derive_artifact(root, name, alpha):
+    """Build a lazily-written output (overlay, or the PNG of an RLE mask) and cache it on disk
+
+    Returns the path, or None if `name` is not derivable from the files in root.
+    Concurrent requests for the same file wait for a single build.
+    """
+    if name.endswith('_overlay.png'):
+        base = name[:-len('_overlay.png')]
+    elif name.endswith('_processed_mask.png'):
+        base = name[:-len('_processed_mask.png')]
+    else:
+        return None
+    path = os.path.join(root, name)
+    with _derive_lock(name):
+        if os.path.exists(path):
+            return path
+        mask = _load_mask(root, base)
+        if mask is None:
+            return None
+        if name.endswith('_processed_mask.png'):
+            _write_atomic(path, mask)
+            return path
+        orig_path = os.path.join(root, f"{base}.png")
+        if not os.path.exists(orig_path):
+            return None
+        # The original PNG holds the RGB array as written by the pipeline
+        img = cv2.imread(orig_path, cv2.IMREAD_COLOR)
+        _write_atomic(path, cv2.cvtColor(overlay_rows(img, mask, alpha), cv2.COLOR_RGB2BGR))
+        return path
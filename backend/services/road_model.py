@@ -0,0 +1,95 @@
+import threading
+import time
+import numpy as np
+from services.road_cache import file_sha256
+from services.inference_backends import KerasBackend, build_road_backend, parity_check
+from services.model_registry import model_registry
+
+
+class RoadModelHolder:
+    """Process-wide road model, loaded through the model registry and kept warm while it fits the budget"""
+
+    def __init__(self, model_path, input_size=(256, 256), backend='keras', quantize=None, cache_dir=None,
+                 registry=model_registry, name='roads'):
+        self.model_path = model_path
+        self.input_size = input_size
+        self.backend_kind = backend
+        self.quantize = quantize
+        self.cache_dir = cache_dir
+        self.load_time = None
+        self.warmup_time = None
+        self._fingerprint = None
+        self._fingerprint_lock = threading.Lock()
+        self._predict_lock = threading.Lock()
+        # TensorFlow takes seconds to import: the registry imports it in the loader thread
+        self.entry = registry.register(name, self._build, imports=('tensorflow',))
+
+    def _build(self):
+        import tensorflow as tf
+        t0 = time.perf_counter()
+        model = tf.keras.models.load_model(self.model_path)
+        tag = f"road_{self.fingerprint()[:12]}"
+        backend = build_road_backend(self.backend_kind, model, self.quantize, self.cache_dir, tag=tag)
+        self.load_time = time.perf_counter() - t0
+
+        # Warm-up prediction so the first request doesn't pay for graph tracing
+        t0 = time.perf_counter()
+        dummy = np.zeros((1, self.input_size[1], self.input_size[0], 3), dtype=np.float32)
+        backend.predict(dummy)
+        self.warmup_time = time.perf_counter() - t0
+        print(f"Road model ({self.backend_kind}, {self.quantize or 'float32'}) loaded in "
+              f"{self.load_time:.2f}s, warm-up {self.warmup_time:.2f}s")
+        return model, backend
+
+    def start(self):
+        """Start loading the model in a background thread (idempotent)"""
+        return self.entry.start()
+
+    def wait(self, timeout=None):
+        """Block until the load has finished or failed; False on timeout"""
+        return self.entry.wait(timeout)
+
+    @property
+    def ready(self):
+        return self.entry.ready
+
+    @property
+    def error(self):
+        return self.entry.error
+
+    def lease(self, timeout=None, count=True):
+        """(keras model, backend), kept loaded until the block exits; see ManagedModel.lease"""
+        return self.entry.lease(timeout, count)
+
+    def get(self, timeout=None):
+        """Return the loaded model, waiting for the background load if needed"""
+        return self.entry.get(timeout)[0]
+
+    def fingerprint(self):
+        """sha256 of the model file, computed once; used to key cached results"""
+        with self._fingerprint_lock:
+            if self._fingerprint is None:
+                self._fingerprint = file_sha256(self.model_path)
+            return self._fingerprint
+
+    def predict(self, batch):
+        """Run a prediction; calls are serialized so request threads can share one model"""
+        with self.lease() as (_, backend), self._predict_lock:
+            return backend.predict(batch)
+
+    def parity(self, batches):
+        """Compare the active backend against the reference Keras model on the given batches"""
+        with self.lease() as (model, backend), self._predict_lock:
+            return parity_check(KerasBackend(model), backend, batches)
+
+    def status(self):
+        entry = self.entry.status()
+        return dict(entry, **{
+            "model_path": self.model_path,
+            "backend": self.backend_kind,
+            "quantize": self.quantize,
+            "loading": entry["state"] == 'loading',
+            "ready": self.ready,
+            "load_time_s": round(self.load_time, 3) if self.load_time is not None else None,
+            "warmup_time_s": round(self.warmup_time, 3) if self.warmup_time is not None else None,
+        })
@@ -0,0 +1,189 @@
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from services.road_inference import predict_patches
+
+# --- Worker side ---
+_worker = {}
+
+def _init_worker(model_path, backend, quantize, cache_dir, tag, threads, input_size, next_index):
+    """Load the model once per worker process, with its thread pools capped at `threads`"""
+    # Thread pool sizes must be set before TensorFlow initializes its runtime
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    with next_index.get_lock():
+        index = next_index.value
+        next_index.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        # Give each worker its own slice of the cores so workers don't migrate onto each other
+        cores = sorted(os.sched_getaffinity(0))
+        own = cores[index * threads:(index + 1) * threads]
+        if len(own) == threads:
+            os.sched_setaffinity(0, own)
+    import tensorflow as tf
+    from services.inference_backends import build_road_backend
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from services.model_registry import model_nbytes
+    model = tf.keras.models.load_model(model_path)
+    _worker['backend'] = build_road_backend(backend, model, quantize, cache_dir, tag=tag, num_threads=threads)
+    _worker['backend'].predict(np.zeros((1, input_size[1], input_size[0], 3), dtype=np.float32))
+    _worker['index'] = index
+    _worker['nbytes'] = model_nbytes(_worker['backend'])
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _predict_crop(crop, boxes, img_spec, prob_spec, binary_spec, batch_size, target_size):
+    """Predict one crop's patches straight into the shared output masks"""
+    segments, arrays = [], []
+    try:
+        for spec in (img_spec, prob_spec, binary_spec):
+            shm, array = _attach(spec)
+            segments.append(shm)
+            arrays.append(array)
+        t0 = time.perf_counter()
+        calls = predict_patches(arrays[0], boxes, _worker['backend'].predict, arrays[1], arrays[2],
+                                batch_size=batch_size, target_size=target_size)
+        return crop, len(boxes), calls, time.perf_counter() - t0
+    finally:
+        # Views must go before their segment can be closed
+        arrays.clear()
+        for shm in segments:
+            shm.close()
+
+def _ping():
+    return _worker.get('nbytes', 0)
+
+# --- Parent side ---
+def _share(shape, dtype, fill_from=None):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if fill_from is None:
+        array[:] = 0
+    else:
+        array[:] = fill_from
+    return shm, array, (shm.name, shape, np.dtype(dtype).str)
+
+
+class CropProcessPool:
+    """Pool of worker processes that each hold a copy of the road model
+
+    The crops of the 2x4 layout are independent, so each one is predicted in a
+    worker process. The image and the output masks live in shared memory (nothing
+    large is pickled) and every worker is limited to cpu_count // workers
+    intra-op threads on its own cores, so N workers fill a many-core host
+    without oversubscribing it. The whole image and masks are copied into
+    shared memory (and the masks back), so the caller keeps memmapped masks
+    out of the pool. Workers are spawned, not forked, because
+    TensorFlow is not fork-safe. `tag` (or a callable returning it) names the
+    converted models in cache_dir, as for RoadModelHolder. `nbytes` is the
+    weights all workers hold together, for the model registry budget.
+    """
+
+    def __init__(self, model_path, workers, backend='keras', quantize=None, cache_dir=None,
+                 tag='road', input_size=(256, 256), threads_per_worker=None):
+        self.model_path = model_path
+        self.workers = workers
+        self.backend = backend
+        self.quantize = quantize
+        self.cache_dir = cache_dir
+        self.tag = tag
+        self.input_size = input_size
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.crops_done = 0
+        self.restarts = 0
+        self.nbytes = 0
+        self._ctx = mp.get_context('spawn')
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                next_index = self._ctx.Value('i', 0)
+                tag = self.tag() if callable(self.tag) else self.tag
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=self._ctx, initializer=_init_worker,
+                    initargs=(self.model_path, self.backend, self.quantize, self.cache_dir, tag,
+                              self.threads_per_worker, self.input_size, next_index))
+            return self._executor
+
+    def warm(self):
+        """Spawn the workers and wait until they have loaded their models; returns the pool"""
+        pool = self._pool()
+        try:
+            sizes = [future.result() for future in [pool.submit(_ping) for _ in range(self.workers)]]
+        except Exception:
+            # e.g. a worker failed to load the model: drop the broken pool so a retry starts clean
+            self.shutdown()
+            raise
+        self.nbytes = max(sizes) * self.workers
+        return self
+
+    def shutdown(self):
+        """Stop the workers (freeing their models); the next predict spawns new ones"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def predict(self, img, boxes_by_crop, prob_mask, binary_mask, batch_size=32, target_size=(256, 256),
+                on_crop=None):
+        """Predict {crop: boxes} into the masks; `on_crop(crop, boxes)` runs as each crop finishes
+
+        Returns the total number of predict calls made by the workers.
+        """
+        segments, arrays = [], {}
+        try:
+            for key, array, fill_from in (('img', img, img), ('prob', prob_mask, None), ('binary', binary_mask, None)):
+                shm, arrays[key], spec = _share(array.shape, array.dtype, fill_from)
+                segments.append((shm, spec))
+            (_, img_spec), (_, prob_spec), (_, binary_spec) = segments
+
+            pool = self._pool()
+            futures = [pool.submit(_predict_crop, crop, boxes, img_spec, prob_spec, binary_spec,
+                                   batch_size, target_size)
+                       for crop, boxes in boxes_by_crop.items() if boxes]
+            calls = 0
+            try:
+                for future in as_completed(futures):
+                    crop, _, crop_calls, _ = future.result()
+                    calls += crop_calls
+                    self.crops_done += 1
+                    if on_crop:
+                        on_crop(crop, boxes_by_crop[crop])
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); reap the rest and start a fresh pool on the next call
+                self.shutdown()
+                self.restarts += 1
+                raise
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+            prob_mask[:] = arrays['prob']
+            binary_mask[:] = arrays['binary']
+            return calls
+        finally:
+            arrays.clear()
+            for shm, _ in segments:
+                shm.close()
+                shm.unlink()
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'threads_per_worker': self.threads_per_worker,
+            'started': self._executor is not None,
+            'crops_done': self.crops_done,
+            'restarts': self.restarts,
+        }
@@ -0,0 +1,190 @@
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Row chunking ---
+def row_chunks(height, chunk_rows):
+    return [(y0, min(y0 + chunk_rows, height)) for y0 in range(0, height, chunk_rows)]
+
+def morphology_halo(params):
+    """Rows of context needed so close+open on a chunk matches the full-image result"""
+    return 2 * (params['kernel_size_close'] // 2) + 2 * (params['kernel_size_open'] // 2)
+
+def prob_to_uint8(rows):
+    """Probability rows as the 0-255 uint8 mask the post-processing thresholds"""
+    if rows.dtype == np.uint8:
+        return np.asarray(rows)
+    return (rows * 255).astype(np.uint8)
+
+def opened_rows(read_prob, height, y0, y1, params, halo):
+    """Threshold + close + open for rows [y0, y1), computed with a halo of neighbouring rows
+
+    `read_prob(y0, y1)` returns uint8 probability rows from whatever backs the mask.
+    """
+    hy0 = max(0, y0 - halo)
+    hy1 = min(height, y1 + halo)
+    prob = read_prob(hy0, hy1)
+    _, binary = cv2.threshold(prob, params['threshold'], 255, cv2.THRESH_BINARY)
+    kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (params['kernel_size_close'],) * 2)
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel_close)
+    kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (params['kernel_size_open'],) * 2)
+    opened = cv2.morphologyEx(closed, cv2.MORPH_OPEN, kernel_open)
+    return opened[y0 - hy0:y1 - hy0], prob[y0 - hy0:y1 - hy0]
+
+# --- Connected components across chunk seams ---
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def seam_pairs(upper_row, lower_row):
+    """Global label pairs that are 8-connected across the seam between two chunks"""
+    pairs = []
+    for d in (-1, 0, 1):
+        a = upper_row[max(0, -d):len(upper_row) - max(0, d)]
+        b = lower_row[max(0, d):len(lower_row) - max(0, -d)]
+        hit = (a > 0) & (b > 0)
+        pairs.append(np.stack([a[hit], b[hit]], axis=1))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def resolve_keep_lut(areas, pairs, min_area):
+    """Merge labels linked by `pairs`, sum their areas and build one keep/drop lookup table
+
+    `areas[i]` is the pixel count of global label i (label 0 is background).
+    Returns a uint8 table with 255 for labels whose merged component is large enough.
+    """
+    parent = np.arange(len(areas))
+    for a, b in (np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)):
+        ra, rb = _find(parent, a), _find(parent, b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    root = parent
+    while not np.array_equal(root, root[root]):
+        root = root[root]
+    root_area = np.bincount(root, weights=areas, minlength=len(areas))
+    keep_lut = np.where(root_area[root] >= min_area, 255, 0).astype(np.uint8)
+    keep_lut[0] = 0
+    return keep_lut
+
+def component_keep_lut(read_prob, height, chunks, params):
+    """Label every chunk, merge labels that touch across seams and decide which to keep
+
+    Returns a uint8 lookup table (255 = keep) indexed by global label, and the
+    global label offset of each chunk.
+    """
+    halo = morphology_halo(params)
+    offsets, areas, pairs = [], [np.zeros(1, dtype=np.int64)], []
+    next_id = 1
+    prev_last_row = None
+    for y0, y1 in chunks:
+        opened, _ = opened_rows(read_prob, height, y0, y1, params, halo)
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(opened, connectivity=8)
+        offsets.append(next_id - 1)
+        areas.append(stats[1:, cv2.CC_STAT_AREA].astype(np.int64))
+        first_row = np.where(labels[0] > 0, labels[0] + next_id - 1, 0)
+        if prev_last_row is not None:
+            pairs.append(seam_pairs(prev_last_row, first_row))
+        prev_last_row = np.where(labels[-1] > 0, labels[-1] + next_id - 1, 0)
+        next_id += num_labels - 1
+
+    keep_lut = resolve_keep_lut(np.concatenate(areas), pairs, params['min_road_area'])
+    return keep_lut, offsets
+
+def iter_filled_rows(read_prob, height, chunks, params):
+    """Yield (y0, y1, filled_mask_rows) for each chunk of the post-processed road mask"""
+    halo = morphology_halo(params)
+    keep_lut, offsets = component_keep_lut(read_prob, height, chunks, params)
+    for (y0, y1), offset in zip(chunks, offsets):
+        opened, prob = opened_rows(read_prob, height, y0, y1, params, halo)
+        _, labels, _, _ = cv2.connectedComponentsWithStats(opened, connectivity=8)
+        processed = keep_lut[np.where(labels > 0, labels + offset, 0)]
+        high_prob_mask = (prob > 200).astype(np.uint8) * 255
+        yield y0, y1, cv2.bitwise_or(processed, high_prob_mask)
+
+def overlay_rows(rgb, filled, alpha):
+    red_mask = np.zeros_like(rgb)
+    red_mask[:, :, 0] = filled
+    return cv2.addWeighted(rgb, 1, red_mask, alpha, 0)
+
+# --- Tile-parallel engine for in-memory masks ---
+def tile_boxes(height, width, tile_size):
+    return [(y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+            for y0 in range(0, height, tile_size) for x0 in range(0, width, tile_size)]
+
+def _morphology_tile(prob_mask, opened, box, params, halo):
+    """Threshold + close + open one tile using a halo so its core matches the full-image result"""
+    height, width = prob_mask.shape
+    y0, y1, x0, x1 = box
+    hy0, hy1 = max(0, y0 - halo), min(height, y1 + halo)
+    hx0, hx1 = max(0, x0 - halo), min(width, x1 + halo)
+    _, binary = cv2.threshold(prob_mask[hy0:hy1, hx0:hx1], params['threshold'], 255, cv2.THRESH_BINARY)
+    kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (params['kernel_size_close'],) * 2)
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel_close)
+    kernel_open = cv2.getStructuringElement(cv2.MORPH_RECT, (params['kernel_size_open'],) * 2)
+    tile = cv2.morphologyEx(closed, cv2.MORPH_OPEN, kernel_open)
+    opened[y0:y1, x0:x1] = tile[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+def postprocess_mask(prob_mask, params, tile_size=1024, workers=None):
+    """Tile-parallel equivalent of threshold/close/open/component filter/high-prob fill
+
+    Morphology runs per tile with a halo. Each tile is labelled on its own, the
+    labels are made global with per-tile offsets, components touching across
+    tile seams are merged, and a single area lookup table decides which labels
+    survive - one pass over the pixels instead of one pass per component.
+    `prob_mask` is the uint8 (0-255) probability mask; returns the filled mask.
+    """
+    height, width = prob_mask.shape
+    workers = workers or os.cpu_count() or 1
+    halo = morphology_halo(params)
+    tiles = tile_boxes(height, width, tile_size)
+    opened = np.empty_like(prob_mask)
+    labels = np.empty((height, width), dtype=np.int32)
+
+    def label_tile(box):
+        y0, y1, x0, x1 = box
+        num_labels, tile_labels, stats, _ = cv2.connectedComponentsWithStats(opened[y0:y1, x0:x1], connectivity=8)
+        labels[y0:y1, x0:x1] = tile_labels
+        return num_labels - 1, stats[1:, cv2.CC_STAT_AREA].astype(np.int64)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda box: _morphology_tile(prob_mask, opened, box, params, halo), tiles))
+        tile_stats = list(pool.map(label_tile, tiles))
+
+        offsets = np.cumsum([0] + [n for n, _ in tile_stats[:-1]])
+
+        def globalize(item):
+            (y0, y1, x0, x1), offset = item
+            tile = labels[y0:y1, x0:x1]
+            tile[tile > 0] += int(offset)
+        list(pool.map(globalize, zip(tiles, offsets)))
+
+        # Components that cross a tile seam (including diagonally at corners)
+        pairs = []
+        for y in sorted({box[0] for box in tiles if box[0] > 0}):
+            pairs.append(seam_pairs(labels[y - 1], labels[y]))
+        for x in sorted({box[2] for box in tiles if box[2] > 0}):
+            pairs.append(seam_pairs(labels[:, x - 1], labels[:, x]))
+        areas = np.concatenate([np.zeros(1, dtype=np.int64)] + [a for _, a in tile_stats])
+        keep_lut = resolve_keep_lut(areas, pairs, params['min_road_area'])
+
+        filled = np.empty_like(prob_mask)
+
+        def fill_tile(box):
+            y0, y1, x0, x1 = box
+            high_prob_mask = (prob_mask[y0:y1, x0:x1] > 200).astype(np.uint8) * 255
+            filled[y0:y1, x0:x1] = cv2.bitwise_or(keep_lut[labels[y0:y1, x0:x1]], high_prob_mask)
+        list(pool.map(fill_tile, tiles))
+    return filled
+
+def overlay_image(img, filled, alpha, tile_size=1024, workers=None):
+    """Tile-parallel red overlay of the filled mask on an RGB image"""
+    overlay = np.empty_like(img)
+
+    def overlay_tile(box):
+        y0, y1, x0, x1 = box
+        overlay[y0:y1, x0:x1] = overlay_rows(img[y0:y1, x0:x1], filled[y0:y1, x0:x1], alpha)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(overlay_tile, tile_boxes(img.shape[0], img.shape[1], tile_size)))
+    return overlay
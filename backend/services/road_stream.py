@@ -0,0 +1,165 @@
+from contextlib import nullcontext
+import cv2
+import numpy as np
+import rasterio
+import rasterio.errors
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from services.road_inference import iter_patch_boxes, predict_patches, count_by_crop, screen_patches
+from services.road_postprocess import iter_filled_rows, overlay_rows
+from services.road_jobs import NULL_PROGRESS
+
+PREVIEW_MAX_SIZE = 4096
+GTIFF_OPTIONS = dict(driver='GTiff', tiled=True, blockxsize=256, blockysize=256, compress='deflate')
+
+# --- Helpers ---
+def to_rgb_uint8(data):
+    """Convert (bands, h, w) raster data to an (h, w, 3) uint8 RGB array, as cv2.imread would"""
+    if data.shape[0] < 3:
+        data = np.repeat(data[:1], 3, axis=0)
+    data = data[:3]
+    if data.dtype == np.uint16:
+        data = (data >> 8).astype(np.uint8)
+    elif data.dtype != np.uint8:
+        data = np.clip(data, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(data.transpose(1, 2, 0))
+
+def raster_size(path):
+    """(height, width) of a raster read from its header, or None if rasterio can't open it"""
+    try:
+        with rasterio.open(path) as src:
+            return src.height, src.width
+    except rasterio.errors.RasterioError:
+        return None
+
+def read_rgb_window(src, y0, y1, x0=0, x1=None):
+    x1 = src.width if x1 is None else x1
+    return to_rgb_uint8(src.read(window=Window(x0, y0, x1 - x0, y1 - y0)))
+
+def read_arrived_window(path, y0, y1):
+    """read_rgb_window on a fresh handle, so no blocks cached before the rows arrived are reused"""
+    with rasterio.open(path) as src:
+        return read_rgb_window(src, y0, y1)
+
+def row_bands(height, width, crop_grid, patch_size):
+    """Group the patch boxes into full-width row bands, one per patch row"""
+    bands = {}
+    for box in iter_patch_boxes(height, width, crop_grid, patch_size):
+        bands.setdefault((box[0], box[1]), []).append(box)
+    return sorted(bands.items())
+
+def write_preview(src_path, out_path, rgb=True):
+    """Write a downsampled PNG preview of a raster without reading it at full size"""
+    with rasterio.open(src_path) as src:
+        scale = min(1.0, PREVIEW_MAX_SIZE / max(src.width, src.height))
+        out_h = max(1, int(src.height * scale))
+        out_w = max(1, int(src.width * scale))
+        if rgb:
+            data = src.read(indexes=[1, 2, 3] if src.count >= 3 else [1, 1, 1],
+                            out_shape=(3, out_h, out_w), resampling=Resampling.average)
+            cv2.imwrite(out_path, cv2.cvtColor(to_rgb_uint8(data), cv2.COLOR_RGB2BGR))
+        else:
+            cv2.imwrite(out_path, src.read(1, out_shape=(out_h, out_w), resampling=Resampling.nearest))
+
+def write_overlay_preview(orig_preview, mask_preview, out_path, alpha):
+    """Composite the overlay preview from the image and mask previews (same size, both on disk)"""
+    rgb = cv2.cvtColor(cv2.imread(orig_preview, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    mask = cv2.imread(mask_preview, cv2.IMREAD_GRAYSCALE)
+    cv2.imwrite(out_path, cv2.cvtColor(overlay_rows(rgb, mask, alpha), cv2.COLOR_RGB2BGR))
+
+# --- Streaming pipeline ---
+def extract_roads_streaming(input_path, out_prefix, predict_fn, params, batch_size=32,
+                            target_size=(256, 256), patch_size=(500, 500), crop_grid=(2, 4),
+                            screen_params=None, wait_rows=None, profile='full', progress=NULL_PROGRESS):
+    """Run road extraction over a GeoTIFF one row band at a time
+
+    Inference, post-processing and the overlay are all computed band by band and
+    written straight into tiled GeoTIFFs, so peak memory depends on the scene
+    width and patch height rather than on the full scene size. Connected
+    components are still filtered exactly (see road_postprocess). With
+    `screen_params`, patches that are clearly empty are skipped before inference.
+
+    `wait_rows(y1)` lets the input still be arriving (see upload_sessions): it
+    is called before each band is read and blocks until rows [0, y1) are on
+    disk; `wait_rows(None)` blocks until the whole file is there, which pass 2
+    and the previews need.
+
+    The 'compact' `profile` skips the full-size binary mask and overlay
+    GeoTIFFs (the two largest outputs); the overlay preview is then
+    composited from the image and mask previews.
+    """
+    compact = profile == 'compact'
+    paths = {
+        'prob': f"{out_prefix}_prob_mask.tif",
+        'processed': f"{out_prefix}_processed_mask.tif",
+        'orig_preview': f"{out_prefix}.png",
+        'mask_preview': f"{out_prefix}_processed_mask.png",
+        'overlay_preview': f"{out_prefix}_overlay.png",
+    }
+    if not compact:
+        paths.update(binary=f"{out_prefix}_binary_mask.tif", overlay=f"{out_prefix}_overlay.tif")
+    with rasterio.open(input_path) as src:
+        height, width = src.height, src.width
+        gtiff = dict(GTIFF_OPTIONS, width=width, height=height, count=1, dtype='uint8',
+                     crs=src.crs, transform=src.transform)
+        bands = row_bands(height, width, crop_grid, patch_size)
+
+        # --- Pass 1: inference, band by band ---
+        predict_calls = skipped = 0
+        all_boxes = [box for _, boxes in bands for box in boxes]
+        progress.set_patches(count_by_crop(all_boxes, height, width, crop_grid))
+        on_batch = lambda chunk: progress.advance(count_by_crop(chunk, height, width, crop_grid))
+        with progress.phase('inference'), \
+                rasterio.open(paths['prob'], 'w', **gtiff) as prob_dst, \
+                (nullcontext() if compact else rasterio.open(paths['binary'], 'w', **gtiff)) as binary_dst:
+            for (y0, y1), boxes in bands:
+                if wait_rows is not None:
+                    wait_rows(y1)
+                    img = read_arrived_window(input_path, y0, y1)
+                else:
+                    img = read_rgb_window(src, y0, y1)
+                prob = np.zeros((y1 - y0, width), dtype=np.float32)
+                binary = np.zeros((y1 - y0, width), dtype=np.uint8)
+                if screen_params is not None:
+                    boxes, skipped_boxes = screen_patches(img, boxes, offset=(y0, 0), params=screen_params)
+                    skipped += len(skipped_boxes)
+                    on_batch(skipped_boxes)
+                predict_calls += predict_patches(img, boxes, predict_fn, prob, binary, batch_size=batch_size,
+                                                 target_size=target_size, offset=(y0, 0), on_batch=on_batch)
+                window = Window(0, y0, width, y1 - y0)
+                prob_dst.write((prob * 255).astype(np.uint8), 1, window=window)
+                if binary_dst is not None:
+                    binary_dst.write(binary * 255, 1, window=window)
+
+        if wait_rows is not None:
+            with progress.phase('upload_wait'):
+                wait_rows(None)
+
+        # --- Pass 2: post-process in row chunks straight from the prob raster ---
+        with progress.phase('postprocess'), rasterio.open(paths['prob']) as prob_src, \
+                (rasterio.open(input_path) if wait_rows is not None else nullcontext(src)) as rgb_src:
+            read_prob = lambda y0, y1: prob_src.read(1, window=Window(0, y0, width, y1 - y0))
+            chunks = [band for band, _ in bands]
+            with rasterio.open(paths['processed'], 'w', **gtiff) as processed_dst, \
+                    (nullcontext() if compact else
+                     rasterio.open(paths['overlay'], 'w', **dict(gtiff, count=3))) as overlay_dst:
+                for y0, y1, filled in iter_filled_rows(read_prob, height, chunks, params):
+                    window = Window(0, y0, width, y1 - y0)
+                    processed_dst.write(filled, 1, window=window)
+                    if overlay_dst is not None:
+                        overlay = overlay_rows(read_rgb_window(rgb_src, y0, y1), filled, params['alpha'])
+                        overlay_dst.write(overlay.transpose(2, 0, 1), window=window)
+
+    # --- Previews for the viewer ---
+    with progress.phase('previews'):
+        write_preview(input_path, paths['orig_preview'])
+        write_preview(paths['processed'], paths['mask_preview'], rgb=False)
+        if compact:
+            write_overlay_preview(paths['orig_preview'], paths['mask_preview'], paths['overlay_preview'],
+                                  params['alpha'])
+        else:
+            write_preview(paths['overlay'], paths['overlay_preview'])
+    paths['patches'] = sum(len(boxes) for _, boxes in bands)
+    paths['predict_calls'] = predict_calls
+    paths['patches_skipped'] = skipped
+    return paths
@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import rasterio
+from contextlib import ExitStack
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from services.road_stream import to_rgb_uint8
+
+TILE_SIZE = 256
+# Levels up to this size are resampled from one in-memory copy instead of tile by tile
+IN_MEMORY_LEVEL_MAX = 4096
+MANIFEST_NAME = 'tiles.json'
+TILE_FORMATS = ('webp', 'png')
+
+# --- Pyramid geometry ---
+def max_zoom(height, width, tile_size=TILE_SIZE):
+    """Finest zoom level; level z is the scene downsampled by 2 ** (max_zoom - z)"""
+    return max(0, math.ceil(math.log2(max(height, width) / tile_size)))
+
+def level_size(height, width, z, top):
+    scale = 2 ** (top - z)
+    return math.ceil(height / scale), math.ceil(width / scale)
+
+# --- Region readers: (y0, y1, x0, x1, out_h, out_w) -> BGR or grey uint8 ---
+def array_reader(array, rgb=True):
+    """Reader over an in-memory or memmap array; `rgb` arrays are converted to BGR for encoding"""
+    def read(y0, y1, x0, x1, out_h, out_w):
+        region = np.asarray(array[y0:y1, x0:x1])
+        if region.shape[:2] != (out_h, out_w):
+            region = cv2.resize(region, (out_w, out_h), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(region, cv2.COLOR_RGB2BGR) if rgb else region
+    return read
+
+def raster_reader(src, rgb=True):
+    """Reader over an open rasterio dataset using decimated windowed reads"""
+    lock = threading.Lock()
+
+    def read(y0, y1, x0, x1, out_h, out_w):
+        window = Window(x0, y0, x1 - x0, y1 - y0)
+        with lock:
+            if rgb:
+                data = src.read(indexes=[1, 2, 3] if src.count >= 3 else [1, 1, 1], window=window,
+                                out_shape=(3, out_h, out_w), resampling=Resampling.average)
+            else:
+                data = src.read(1, window=window, out_shape=(out_h, out_w), resampling=Resampling.average)
+        if rgb:
+            return cv2.cvtColor(to_rgb_uint8(data), cv2.COLOR_RGB2BGR)
+        return data.astype(np.uint8)
+    return read
+
+def overlay_reader(image_reader, mask_reader, alpha):
+    """Reader compositing a grey mask reader in red over a BGR image reader, for scenes without an overlay raster"""
+    def read(*region):
+        bgr = image_reader(*region)
+        red = np.zeros_like(bgr)
+        red[:, :, 2] = mask_reader(*region)
+        return cv2.addWeighted(bgr, 1, red, alpha, 0)
+    return read
+
+# --- Tile encoding ---
+def _pad(tile, tile_size):
+    """Pad an edge tile to tile_size; colour tiles get a transparent border"""
+    h, w = tile.shape[:2]
+    if tile.ndim == 3:
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2BGRA)
+    if (h, w) == (tile_size, tile_size):
+        return tile
+    padded = np.zeros((tile_size, tile_size) + tile.shape[2:], dtype=tile.dtype)
+    padded[:h, :w] = tile
+    return padded
+
+def _encode(tile, fmt):
+    if fmt == 'webp':
+        ok, data = cv2.imencode('.webp', tile, [cv2.IMWRITE_WEBP_QUALITY, 80])
+    else:
+        ok, data = cv2.imencode('.png', tile, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise RuntimeError(f"Could not encode {fmt} tile")
+    return data.tobytes()
+
+def tile_path(out_dir, layer, z, x, y, ext):
+    return os.path.join(out_dir, layer, str(z), str(x), f"{y}.{ext}")
+
+def _write_tile(out_dir, layer, z, x, y, ext, tile, tile_size):
+    path = tile_path(out_dir, layer, z, x, y, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(_encode(_pad(tile, tile_size), ext))
+
+def _write_manifest(out_dir, manifest):
+    tmp_path = os.path.join(out_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+
+# --- Pyramid ---
+def write_tile_pyramid(layers, height, width, out_dir, fmt='webp', tile_size=TILE_SIZE, workers=None,
+                       on_level=None):
+    """Write a z/x/y tile pyramid for each layer, coarsest level first
+
+    `layers` maps a layer name to (reader, grey) where grey layers (masks) are
+    always written as lossless PNG. Levels up to IN_MEMORY_LEVEL_MAX are
+    resampled from a single downsampled read; finer levels read each tile's
+    window from the source. tiles.json is rewritten after every level with
+    `levels_ready`, so a viewer can show the coarse levels while the finer ones
+    are still being written. `on_level(z, manifest)` is called likewise.
+    """
+    if fmt not in TILE_FORMATS:
+        raise ValueError(f"Unknown tile format '{fmt}', expected one of {TILE_FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+    top = max_zoom(height, width, tile_size)
+    base_z = max([z for z in range(top + 1) if max(level_size(height, width, z, top)) <= IN_MEMORY_LEVEL_MAX],
+                 default=0)
+    manifest = {
+        'tile_size': tile_size,
+        'width': width,
+        'height': height,
+        'min_zoom': 0,
+        'max_zoom': top,
+        'levels_ready': 0,
+        'layers': {name: 'png' if grey else fmt for name, (_, grey) in layers.items()},
+    }
+    # Coarse levels: one downsampled read per layer, then repeated halving
+    base = {name: reader(0, height, 0, width, *level_size(height, width, base_z, top))
+            for name, (reader, _) in layers.items()}
+    levels = {base_z: base}
+    for z in range(base_z - 1, -1, -1):
+        levels[z] = {name: cv2.resize(level, (math.ceil(level.shape[1] / 2), math.ceil(level.shape[0] / 2)),
+                                      interpolation=cv2.INTER_AREA)
+                     for name, level in levels[z + 1].items()}
+
+    def coarse_tile(task):
+        z, name, x, y = task
+        level = levels[z][name]
+        _write_tile(out_dir, name, z, x, y, manifest['layers'][name],
+                    level[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size], tile_size)
+
+    def fine_tile(task):
+        z, name, x, y = task
+        scale = 2 ** (top - z)
+        span = tile_size * scale
+        y0, x0 = y * span, x * span
+        y1, x1 = min(height, y0 + span), min(width, x0 + span)
+        reader, _ = layers[name]
+        tile = reader(y0, y1, x0, x1, math.ceil((y1 - y0) / scale), math.ceil((x1 - x0) / scale))
+        _write_tile(out_dir, name, z, x, y, manifest['layers'][name], tile, tile_size)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for z in range(top + 1):
+            lh, lw = level_size(height, width, z, top)
+            tasks = [(z, name, x, y) for name in layers
+                     for y in range(math.ceil(lh / tile_size)) for x in range(math.ceil(lw / tile_size))]
+            list(pool.map(coarse_tile if z <= base_z else fine_tile, tasks))
+            levels.pop(z, None)
+            manifest['levels_ready'] = z + 1
+            _write_manifest(out_dir, manifest)
+            if on_level:
+                on_level(z, manifest)
+    return manifest
+
+def write_raster_pyramid(sources, out_dir, overlay_alpha=None, **kwargs):
+    """write_tile_pyramid over rasters on disk; `sources` maps layer -> (path, grey)
+
+    With `overlay_alpha`, an 'overlay' layer is composited from the 'orig'
+    and 'mask' sources instead of being read from a raster of its own.
+    """
+    with ExitStack() as stack:
+        datasets = {name: stack.enter_context(rasterio.open(path)) for name, (path, _) in sources.items()}
+        first = next(iter(datasets.values()))
+        layers = {name: (raster_reader(datasets[name], rgb=not grey), grey) for name, (_, grey) in sources.items()}
+        if overlay_alpha is not None:
+            layers['overlay'] = (overlay_reader(layers['orig'][0], layers['mask'][0], overlay_alpha), False)
+        return write_tile_pyramid(layers, first.height, first.width, out_dir, **kwargs)
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
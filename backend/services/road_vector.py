@@ -0,0 +1,214 @@
+import json
+import cv2
+import numpy as np
+import rasterio
+import rasterio.errors
+from rasterio.warp import transform as warp_transform
+
+# 8-neighbourhood as (dy, dx), in ring order
+NEIGHBOURS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+# --- Skeletonization ---
+def _zhang_suen(mask):
+    """Vectorized Zhang-Suen thinning (used when opencv-contrib is not installed)"""
+    padded = np.pad((mask > 0).astype(np.uint8), 1)
+    core = padded[1:-1, 1:-1]
+    while True:
+        changed = False
+        for step in (0, 1):
+            p2, p3, p4 = padded[:-2, 1:-1], padded[:-2, 2:], padded[1:-1, 2:]
+            p5, p6, p7 = padded[2:, 2:], padded[2:, 1:-1], padded[2:, :-2]
+            p8, p9 = padded[1:-1, :-2], padded[:-2, :-2]
+            ring = (p2, p3, p4, p5, p6, p7, p8, p9, p2)
+            count = sum(p.astype(np.int8) for p in ring[:-1])
+            transitions = sum(((a == 0) & (b == 1)).astype(np.int8) for a, b in zip(ring[:-1], ring[1:]))
+            if step == 0:
+                cond = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                cond = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (core == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & cond
+            if remove.any():
+                core[remove] = 0
+                changed = True
+        if not changed:
+            return core.copy()
+
+def skeletonize(mask):
+    """One-pixel-wide 0/1 skeleton of a 0/255 road mask"""
+    if hasattr(cv2, 'ximgproc'):
+        return (cv2.ximgproc.thinning((mask > 0).astype(np.uint8) * 255) > 0).astype(np.uint8)
+    return _zhang_suen(mask)
+
+# --- Tracing ---
+def trace_skeleton(skeleton):
+    """Split a skeleton into segments between nodes (endpoints and junctions)
+
+    Adjacent junction pixels are merged into one node. Returns (nodes, segments):
+    `nodes` is an (n, 2) float array of node (row, col) centroids and each
+    segment is (node_a, node_b, path) with `path` an (m, 2) int array of the
+    (row, col) pixels from node a to node b. Closed loops without any
+    junction get a node of their own.
+    """
+    height, width = skeleton.shape
+    padded = np.pad((skeleton > 0).astype(np.uint8), 1)
+    degree = cv2.filter2D(padded, -1, np.ones((3, 3), np.float32), borderType=cv2.BORDER_CONSTANT) - padded
+    node_mask = (padded > 0) & (degree != 2)
+    num_nodes, node_labels = cv2.connectedComponents(node_mask.astype(np.uint8), connectivity=8)
+
+    pw = width + 2
+    offsets = [dy * pw + dx for dy, dx in NEIGHBOURS]
+    on = padded.ravel().tobytes()
+    flat_labels = node_labels.ravel()
+    node_of = {int(i): int(flat_labels[i]) - 1 for i in np.flatnonzero(flat_labels)}
+    visited = bytearray(len(on))
+
+    node_pixels = [[] for _ in range(num_nodes - 1)]
+    for pixel, node in node_of.items():
+        node_pixels[node].append(pixel)
+
+    def walk(start, first):
+        """Follow the skeleton from node pixel `start` through `first` to the next node pixel"""
+        path = [start, first]
+        prev, cur = start, first
+        visited[first] = 1
+        while cur not in node_of:
+            # Prefer reaching another node, then unvisited skeleton, then looping back to the start node
+            other = fresh = same = None
+            for off in offsets:
+                nxt = cur + off
+                if nxt == prev or not on[nxt]:
+                    continue
+                if nxt in node_of:
+                    if node_of[nxt] != node_of[start]:
+                        other = nxt
+                        break
+                    if len(path) > 2:
+                        same = nxt
+                elif not visited[nxt] and fresh is None:
+                    fresh = nxt
+            step = other if other is not None else fresh if fresh is not None else same
+            if step is None:
+                # Dead end that is not an endpoint (e.g. a pixel triangle): it becomes a node
+                node_of[cur] = len(node_pixels)
+                node_pixels.append([cur])
+                break
+            if step not in node_of:
+                visited[step] = 1
+            path.append(step)
+            prev, cur = cur, step
+        return node_of[start], node_of[path[-1]], path
+
+    segments = []
+    for pixel in list(node_of):
+        for off in offsets:
+            nxt = pixel + off
+            if on[nxt] and nxt not in node_of and not visited[nxt]:
+                segments.append(walk(pixel, nxt))
+
+    # Closed loops without any junction: cut each at one pixel, which becomes a node
+    remaining = np.flatnonzero((padded.ravel() > 0) & (np.frombuffer(bytes(visited), dtype=np.uint8) == 0))
+    for pixel in remaining.tolist():
+        if visited[pixel] or pixel in node_of:
+            continue
+        node_of[pixel] = len(node_pixels)
+        node_pixels.append([pixel])
+        visited[pixel] = 1
+        for off in offsets:
+            nxt = pixel + off
+            if on[nxt] and not visited[nxt]:
+                segments.append(walk(pixel, nxt))
+                break
+
+    def to_rc(pixels):
+        pixels = np.asarray(pixels, dtype=np.int64)
+        return np.stack([pixels // pw - 1, pixels % pw - 1], axis=1)
+
+    nodes = np.array([to_rc(p).mean(axis=0) for p in node_pixels]).reshape(-1, 2)
+    return nodes, [(a, b, to_rc(path)) for a, b, path in segments]
+
+def prune_spurs(segments, num_nodes, min_length):
+    """Drop dangling segments shorter than min_length pixels (skeleton noise at road edges)"""
+    degree = np.bincount([n for a, b, _ in segments for n in (a, b)], minlength=num_nodes)
+    return [(a, b, path) for a, b, path in segments
+            if len(path) >= min_length or (degree[a] > 1 and degree[b] > 1)]
+
+def simplify(path, epsilon):
+    """Douglas-Peucker simplification of an (m, 2) (row, col) path; returns (x, y) float vertices"""
+    xy = path[:, ::-1].astype(np.int32).reshape(-1, 1, 2)
+    return cv2.approxPolyDP(xy, epsilon, closed=False).reshape(-1, 2).astype(np.float64)
+
+# --- Georeferencing ---
+def read_georef(path):
+    """(transform, crs) of a GeoTIFF, or None when it has no geotransform"""
+    try:
+        with rasterio.open(path) as src:
+            if src.transform.is_identity or src.crs is None:
+                return None
+            return src.transform, src.crs
+    except rasterio.errors.RasterioError:
+        return None
+
+def read_mask_raster(path):
+    """First band of a mask GeoTIFF (e.g. the streamed processed mask) as a uint8 array"""
+    with rasterio.open(path) as src:
+        return src.read(1)
+
+def _to_lonlat(lines, georef):
+    """Pixel (x, y) vertices -> WGS84 (lon, lat) via the affine transform and the raster CRS"""
+    transform, crs = georef
+    counts = [len(line) for line in lines]
+    xy = np.concatenate(lines) + 0.5  # pixel centres
+    xs, ys = transform * (xy[:, 0], xy[:, 1])
+    if crs.to_epsg() != 4326:
+        xs, ys = warp_transform(crs, 'EPSG:4326', xs, ys)
+    coords = np.stack([xs, ys], axis=1)
+    return np.split(coords, np.cumsum(counts)[:-1])
+
+def node_lonlat(nodes, georef):
+    """(row, col) node centroids -> (lon, lat) (or pixel (x, y) without georef)"""
+    xy = nodes[:, ::-1].astype(np.float64)
+    if not georef or not len(xy):
+        return xy
+    return _to_lonlat([xy], georef)[0]
+
+# --- Centerlines ---
+def trace_roads(mask, min_length=10):
+    """Skeleton of a 0/255 road mask traced into (nodes, segments) without short spurs"""
+    nodes, segments = trace_skeleton(skeletonize(mask))
+    return nodes, prune_spurs(segments, len(nodes), min_length)
+
+def segment_lines(segments, georef=None, epsilon=1.5):
+    """Simplified vertices of each segment, in WGS84 lon/lat with `georef`, else pixel (x, y)"""
+    lines = [simplify(path, epsilon) for _, _, path in segments]
+    if georef and lines:
+        lines = _to_lonlat(lines, georef)
+    return lines
+
+# --- GeoJSON ---
+def to_geojson(segments, lines, georef=None):
+    """FeatureCollection of the traced segments; each feature carries its length in pixels"""
+    precision = 7 if georef else 1
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': np.round(line, precision).tolist()},
+        'properties': {'length_px': len(path)},
+    } for (_, _, path), line in zip(segments, lines) if len(line) >= 2]
+    return {
+        'type': 'FeatureCollection',
+        'properties': {'coordinates': 'lonlat' if georef else 'pixel', 'segments': len(features)},
+        'features': features,
+    }
+
+def vectorize_mask(mask, georef=None, epsilon=1.5, min_length=10):
+    """Road centerlines of a 0/255 mask as a GeoJSON FeatureCollection dict
+
+    Coordinates are WGS84 lon/lat when `georef` (see read_georef) is given,
+    otherwise pixel (x, y).
+    """
+    _, segments = trace_roads(mask, min_length)
+    return to_geojson(segments, segment_lines(segments, georef, epsilon), georef)
+
+def write_geojson(path, collection):
+    with open(path, 'w') as f:
+        json.dump(collection, f, separators=(',', ':'))
+    return path
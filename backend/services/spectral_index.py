@@ -0,0 +1,288 @@
+import ast
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from services.road_jobs import NULL_PROGRESS
+
+# Band order of common Sentinel-2 GeoTIFF stacks, by band count (used when the
+# raster has no band descriptions)
+SENTINEL2_LAYOUTS = {
+    13: ('B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B9', 'B10', 'B11', 'B12'),  # L1C
+    12: ('B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B9', 'B11', 'B12'),  # L2A
+    10: ('B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B11', 'B12'),  # 10 m + 20 m bands
+    4: ('B2', 'B3', 'B4', 'B8'),  # 10 m bands
+}
+INDEX_EXPRESSIONS = {
+    'ndvi': '(B8 - B4) / (B8 + B4)',
+    'ndwi': '(B3 - B8) / (B3 + B8)',
+    'ndbi': '(B11 - B8) / (B11 + B8)',
+}
+INDEX_NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,31}$')
+WINDOW_SIZE = 1024
+HISTOGRAM_BINS = 64
+HISTOGRAM_RANGE = (-1.0, 1.0)
+# Tiled float32 GeoTIFF with internal overviews: readable window by window and
+# zoomable without a full read, like a COG
+COG_PROFILE = dict(driver='GTiff', tiled=True, blockxsize=512, blockysize=512, compress='deflate', predictor=3,
+                   count=1, dtype='float32', nodata=float('nan'), BIGTIFF='IF_SAFER')
+
+
+# --- Band expressions ---
+class BandExpression:
+    """Arithmetic over named bands (+ - * / **, numbers and a few numpy functions)
+
+    Parsed once with `ast` (nothing is eval'd) and evaluated per window in
+    float32. Intermediate results are computed in place where possible, so an
+    expression costs about one extra window-sized array whatever its length.
+    """
+
+    # name -> (ufunc, number of arguments)
+    FUNCTIONS = {'sqrt': (np.sqrt, 1), 'abs': (np.abs, 1), 'log': (np.log, 1), 'exp': (np.exp, 1),
+                 'minimum': (np.minimum, 2), 'maximum': (np.maximum, 2)}
+    OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+                 ast.Pow: np.power}
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            self._tree = ast.parse(text, mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression '{text}': {e.msg}")
+        self.bands = sorted(self._check(self._tree))
+        if not self.bands:
+            raise ValueError(f"Expression '{text}' uses no band")
+
+    def _check(self, node):
+        """Band names used by the expression; raises ValueError on anything but arithmetic"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return set()
+        if isinstance(node, ast.Name):
+            return {node.id}
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            return self._check(node.operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in self.OPERATORS:
+            return self._check(node.left) | self._check(node.right)
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.FUNCTIONS
+                and not node.keywords):
+            arity = self.FUNCTIONS[node.func.id][1]
+            if len(node.args) != arity:
+                raise ValueError(f"{node.func.id}() takes {arity} argument{'s' if arity > 1 else ''} "
+                                 f"in expression '{self.text}'")
+            return set().union(*(self._check(arg) for arg in node.args))
+        raise ValueError(f"Unsupported syntax in expression '{self.text}'")
+
+    def _eval(self, node, bands):
+        """(value, owned): owned arrays are temporaries that the next operation may overwrite"""
+        if isinstance(node, ast.Constant):
+            return np.float32(node.value), False
+        if isinstance(node, ast.Name):
+            return bands[node.id], False
+        if isinstance(node, ast.UnaryOp):
+            value, owned = self._eval(node.operand, bands)
+            if isinstance(node.op, ast.UAdd):
+                return value, owned
+            return np.negative(value, out=value if owned else None), np.ndim(value) > 0
+        if isinstance(node, ast.BinOp):
+            (a, a_owned), (b, b_owned) = self._eval(node.left, bands), self._eval(node.right, bands)
+            out = a if a_owned else b if b_owned and np.shape(b) == np.broadcast(a, b).shape else None
+            return self.OPERATORS[type(node.op)](a, b, out=out), np.ndim(a) + np.ndim(b) > 0
+        args = [self._eval(arg, bands) for arg in node.args]
+        out = next((v for v, owned in args if owned), None)
+        values = [v for v, _ in args]
+        return self.FUNCTIONS[node.func.id][0](*values, out=out), any(np.ndim(v) for v in values)
+
+    def evaluate(self, bands):
+        """float32 result for a window, given `bands` mapping band name -> float32 array"""
+        shape = next(iter(bands.values())).shape
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            value, owned = self._eval(self._tree, bands)
+        if not owned:
+            value = np.array(np.broadcast_to(value, shape), dtype=np.float32)
+        return value
+
+
+def parse_expressions(indices=None, custom=None):
+    """{name: BandExpression} from built-in index names and a {name: expression} dict"""
+    expressions = {}
+    for name in indices or ():
+        if name not in INDEX_EXPRESSIONS:
+            raise ValueError(f"Unknown index '{name}', expected one of {sorted(INDEX_EXPRESSIONS)}")
+        expressions[name] = BandExpression(INDEX_EXPRESSIONS[name])
+    for name, text in (custom or {}).items():
+        if not INDEX_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid index name '{name}' (lowercase letters, digits and _)")
+        expressions[name] = BandExpression(text)
+    if not expressions:
+        raise ValueError('No index requested')
+    return expressions
+
+# --- Band names ---
+def _normalize_band(name):
+    """'B04', 'b4' or 'B4 (red)' -> 'B4'; None if the text is not a Sentinel-2 band name"""
+    match = re.match(r'^\s*B0?(\d{1,2}A?)\b', name or '', re.IGNORECASE)
+    return f"B{match.group(1).upper()}" if match else None
+
+def band_indexes(src, band_map=None):
+    """Band name -> 1-based raster band index
+
+    An explicit `band_map` wins, then band descriptions (B04, B8A...), then the
+    usual Sentinel-2 stack order for the raster's band count.
+    """
+    if band_map:
+        return {name: int(index) for name, index in band_map.items()}
+    described = {_normalize_band(d): i + 1 for i, d in enumerate(src.descriptions)}
+    described.pop(None, None)
+    if described:
+        return described
+    return {name: i + 1 for i, name in enumerate(SENTINEL2_LAYOUTS.get(src.count, ()))}
+
+# --- Windows and statistics ---
+def iter_windows(height, width, size=WINDOW_SIZE):
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+def window_stats(values, value_range=HISTOGRAM_RANGE, bins=HISTOGRAM_BINS):
+    """Valid count, sum, min/max and a fixed-range histogram of one window's values"""
+    valid = values[np.isfinite(values)]
+    lo, hi = value_range
+    counts, _ = np.histogram(valid, bins=bins, range=value_range)
+    return {
+        'valid': int(valid.size),
+        'sum': float(valid.sum(dtype=np.float64)),
+        'min': float(valid.min()) if valid.size else None,
+        'max': float(valid.max()) if valid.size else None,
+        'below': int(np.count_nonzero(valid < lo)),
+        'above': int(np.count_nonzero(valid > hi)),
+        'histogram': counts,
+    }
+
+def merge_stats(window_results, value_range, bins):
+    """Scene-level statistics from the per-window ones"""
+    valid = sum(s['valid'] for s in window_results)
+    mins = [s['min'] for s in window_results if s['min'] is not None]
+    maxs = [s['max'] for s in window_results if s['max'] is not None]
+    return {
+        'valid': valid,
+        'mean': sum(s['sum'] for s in window_results) / valid if valid else None,
+        'min': min(mins, default=None),
+        'max': max(maxs, default=None),
+        'below': sum(s['below'] for s in window_results),
+        'above': sum(s['above'] for s in window_results),
+        'range': list(value_range),
+        'bins': bins,
+        'histogram': np.sum([s['histogram'] for s in window_results], axis=0).astype(int).tolist()
+        if window_results else [0] * bins,
+    }
+
+def overview_factors(height, width, block_size):
+    factors = []
+    factor = 2
+    while max(height, width) / factor >= block_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+# --- Engine ---
+def compute_indices(input_path, out_prefix, expressions, band_map=None, window_size=WINDOW_SIZE, workers=None,
+                    value_range=HISTOGRAM_RANGE, bins=HISTOGRAM_BINS, progress=NULL_PROGRESS):
+    """Evaluate band expressions over a multiband GeoTIFF window by window
+
+    Windows are processed in parallel threads, each with its own dataset
+    handle (GDAL handles are not thread-safe); reads are float32 and only
+    the bands the expressions use are read. Every index is written to
+    `{out_prefix}_{name}.tif` (tiled float32 with internal overviews, NaN as
+    nodata) and its per-window histograms to `{out_prefix}_{name}_histograms.json`.
+    Returns ({name: {'raster', 'histograms', 'stats'}}, run info).
+    """
+    with rasterio.open(input_path) as src:
+        height, width, nodata = src.height, src.width, src.nodata
+        indexes = band_indexes(src, band_map)
+        missing = sorted({b for e in expressions.values() for b in e.bands} - set(indexes))
+        if missing:
+            raise ValueError(f"Band(s) {missing} not found in the raster; pass a band map for {src.count}-band input")
+        bad = sorted(i for i in indexes.values() if not 1 <= i <= src.count)
+        if bad:
+            raise ValueError(f"Band index {bad[0]} out of range for a {src.count}-band raster")
+        profile = dict(COG_PROFILE, width=width, height=height, crs=src.crs, transform=src.transform)
+    needed = sorted({b for e in expressions.values() for b in e.bands})
+    windows = list(iter_windows(height, width, window_size))
+    paths = {name: (f"{out_prefix}_{name}.tif", f"{out_prefix}_{name}_histograms.json") for name in expressions}
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def source():
+        if not hasattr(local, 'src'):
+            local.src = rasterio.open(input_path)
+            with handles_lock:
+                handles.append(local.src)
+        return local.src
+
+    progress.set_patches({'windows': len(windows)})
+    with progress.phase('indices'):
+        dsts = {}
+        try:
+            for name, (raster_path, _) in paths.items():
+                dsts[name] = rasterio.open(raster_path, 'w', **profile)
+            write_locks = {name: threading.Lock() for name in dsts}
+
+            def process(window):
+                data = source().read([indexes[b] for b in needed], window=window, out_dtype=np.float32)
+                bands = dict(zip(needed, data))
+                invalid = {b: data[i] == nodata for i, b in enumerate(needed)} if nodata is not None else None
+                stats = {}
+                for name, expression in expressions.items():
+                    values = expression.evaluate(bands)
+                    for b in expression.bands if invalid else ():
+                        values[invalid[b]] = np.nan
+                    values[np.isinf(values)] = np.nan
+                    with write_locks[name]:
+                        dsts[name].write(values, 1, window=window)
+                    stats[name] = window_stats(values, value_range, bins)
+                progress.advance({'windows': 1})
+                return stats
+
+            with ThreadPoolExecutor(max_workers=workers or None) as pool:
+                per_window = list(pool.map(process, windows))
+        finally:
+            for handle in handles:
+                handle.close()
+            for dst in dsts.values():
+                dst.close()
+
+    with progress.phase('overviews'):
+        factors = overview_factors(height, width, COG_PROFILE['blockxsize'])
+        for raster_path, _ in paths.values():
+            if factors:
+                with rasterio.open(raster_path, 'r+') as dst:
+                    dst.build_overviews(factors, Resampling.average)
+                    dst.update_tags(ns='rio_overview', resampling='average')
+
+    results = {}
+    for name, (raster_path, histogram_path) in paths.items():
+        window_results = [stats[name] for stats in per_window]
+        summary = merge_stats(window_results, value_range, bins)
+        with open(histogram_path, 'w') as f:
+            json.dump({
+                'index': name,
+                'expression': expressions[name].text,
+                'scene': summary,
+                'windows': [{
+                    'window': [w.row_off, w.col_off, w.height, w.width],
+                    'valid': s['valid'],
+                    'mean': s['sum'] / s['valid'] if s['valid'] else None,
+                    'min': s['min'],
+                    'max': s['max'],
+                    'histogram': s['histogram'].tolist(),
+                } for w, s in zip(windows, window_results)],
+            }, f, separators=(',', ':'))
+        results[name] = {'raster': raster_path, 'histograms': histogram_path,
+                         'stats': {k: summary[k] for k in ('valid', 'mean', 'min', 'max')}}
+    return results, {'windows': len(windows), 'window_size': window_size, 'bands': needed}
@@ -0,0 +1,175 @@
+import builtins
+import importlib
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+
+# How heavy subsystems come up: 'background' warms them up in threads once the
+# app is imported, 'lazy' waits for the first request that needs them and
+# 'eager' loads them while the app is imported (the old behaviour)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+if STARTUP_MODE not in ('background', 'lazy', 'eager'):
+    raise ValueError(f"STARTUP_MODE must be background, lazy or eager, not {STARTUP_MODE!r}")
+
+PROCESS_START = time.time()
+
+
+class ImportTimer:
+    """Wall time of the top-level imports made while installed, by module name
+
+    Only the outermost import of a not-yet-loaded module is timed, so each
+    entry includes everything that module pulled in, and the entries add up
+    to the time spent importing. Nesting is tracked per thread.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._local = threading.local()
+        self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules or getattr(self._local, 'depth', 0):
+            return self._original(name, globals, locals, fromlist, level)
+        self._local.depth = 1
+        t0 = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            self._local.depth = 0
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - t0
+
+    def start(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def stop(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def breakdown(self, min_seconds=0.005):
+        """{module: seconds}, slowest first, leaving out the negligible ones"""
+        return {name: round(seconds, 3) for name, seconds in sorted(self.times.items(), key=lambda kv: -kv[1])
+                if seconds >= min_seconds}
+
+
+import_timer = ImportTimer()
+
+
+class LazySubsystem:
+    """A slow-to-build part of the backend (heavy imports plus a model), built once on demand
+
+    `imports` are imported first, each timed, then `factory()` builds the
+    object that `get()` hands out. `start()` does this in a background
+    thread; `get()` starts it if needed and waits. A failed load is reported
+    by `status()` and raised from `get()`. Subsystems with `preload` False
+    are left to their first use by start_subsystems().
+    """
+
+    preload = True
+
+    def __init__(self, name, factory, imports=()):
+        self.name = name
+        self.factory = factory
+        self.imports = imports
+        self.import_times = {}
+        self.init_time = None
+        self.error = None
+        self._value = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        register_subsystem(name, self)
+
+    def start(self):
+        """Start loading in a background thread (idempotent)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name=f"{self.name}-loader", daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def _load(self):
+        try:
+            for module in self.imports:
+                t0 = time.perf_counter()
+                importlib.import_module(module)
+                # Reloads find the modules imported already: keep the first (real) timing
+                self.import_times.setdefault(module, round(time.perf_counter() - t0, 3))
+            t0 = time.perf_counter()
+            self._value = self.factory()
+            self.init_time = time.perf_counter() - t0
+            print(f"{self.name} ready: imports {sum(self.import_times.values()):.2f}s, init {self.init_time:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error loading {self.name}: {self.error}")
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def get(self, timeout=None):
+        """The built object, waiting for the load if needed"""
+        self.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self.error is not None:
+            raise RuntimeError(f"{self.name} failed to load: {self.error}")
+        return self._value
+
+    def wait(self, timeout=None):
+        """Block until the load has finished or failed; False on timeout"""
+        return self._ready.wait(timeout)
+
+    def status(self):
+        return {
+            "state": ('ready' if self.ready else 'error' if self._ready.is_set()
+                      else 'loading' if self._thread is not None else 'idle'),
+            "import_times_s": self.import_times,
+            "init_time_s": round(self.init_time, 3) if self.init_time is not None else None,
+            "error": self.error,
+        }
+
+
+# Everything slow to load, by name: objects with start(), wait() and status()
+SUBSYSTEMS = {}
+
+
+def register_subsystem(name, subsystem):
+    SUBSYSTEMS[name] = subsystem
+
+
+def is_main_process():
+    """False in spawned worker processes (e.g. the road crop pool)
+
+    Spawned workers re-import the script that started the backend (app.py
+    as __mp_main__), so module-level startup code runs in them too; model
+    loaders, janitors and process pools must only be started when this is True.
+    """
+    return mp.parent_process() is None
+
+
+def start_subsystems():
+    """Kick off the preloaded subsystems as STARTUP_MODE says; 'eager' blocks until they are loaded"""
+    if STARTUP_MODE == 'lazy':
+        return
+    preloaded = [subsystem for subsystem in SUBSYSTEMS.values() if getattr(subsystem, 'preload', True)]
+    for subsystem in preloaded:
+        subsystem.start()
+    if STARTUP_MODE == 'eager':
+        for subsystem in preloaded:
+            subsystem.wait()
+
+
+def startup_status():
+    return {
+        "mode": STARTUP_MODE,
+        "uptime_s": round(time.time() - PROCESS_START, 3),
+        "import_times_s": import_timer.breakdown(),
+        "subsystems": {name: subsystem.status() for name, subsystem in SUBSYSTEMS.items()},
+    }
@@ -0,0 +1,375 @@
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import time
+import uuid
+import numpy as np
+from services.road_cache import HASH_CHUNK_SIZE
+
+
+class InvalidUploadData(Exception):
+    pass
+
+
+# --- Incremental TIFF header probe ---
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+TIFF_TYPE_CODES = {1: 'u1', 3: 'u2', 4: 'u4', 16: 'u8'}
+LAYOUT_TAGS = {256: 'width', 257: 'height', 277: 'samples', 278: 'rows_per_strip', 284: 'planar',
+               273: 'strip_offsets', 279: 'strip_counts', 322: 'tile_width', 323: 'tile_length',
+               324: 'tile_offsets', 325: 'tile_counts'}
+
+def check_tiff_magic(head):
+    """Endianness and BigTIFF flag from the first 8 bytes; raises InvalidUploadData if not a TIFF"""
+    if head[:2] not in (b'II', b'MM'):
+        raise InvalidUploadData('Not a TIFF file')
+    endian = '<' if head[:2] == b'II' else '>'
+    magic = struct.unpack(endian + 'H', head[2:4])[0]
+    if magic not in (42, 43):
+        raise InvalidUploadData('Not a TIFF file')
+    return endian, magic == 43
+
+def parse_tiff_layout(read_at):
+    """Image size and strip/tile byte ranges of the first IFD
+
+    `read_at(offset, n)` returns n bytes of the file, or None while they have not
+    arrived yet; the function then returns None and can be retried later.
+    """
+    head = read_at(0, 16)
+    if head is None:
+        return None
+    endian, big = check_tiff_magic(head)
+    if big:
+        ifd_offset = struct.unpack(endian + 'Q', head[8:16])[0]
+        count_fmt, entry_size, value_size = 'Q', 20, 8
+    else:
+        ifd_offset = struct.unpack(endian + 'I', head[4:8])[0]
+        count_fmt, entry_size, value_size = 'H', 12, 4
+    count_size = struct.calcsize(count_fmt)
+    raw = read_at(ifd_offset, count_size)
+    if raw is None:
+        return None
+    num_entries = struct.unpack(endian + count_fmt, raw)[0]
+    entries = read_at(ifd_offset + count_size, num_entries * entry_size)
+    if entries is None:
+        return None
+    tags = {}
+    for k in range(num_entries):
+        entry = entries[k * entry_size:(k + 1) * entry_size]
+        if big:
+            tag, typ, count = struct.unpack(endian + 'HHQ', entry[:12])
+        else:
+            tag, typ, count = struct.unpack(endian + 'HHI', entry[:8])
+        if tag not in LAYOUT_TAGS or typ not in TIFF_TYPE_CODES:
+            continue
+        size = TIFF_TYPE_SIZES[typ] * count
+        if size <= value_size:
+            data = entry[entry_size - value_size:entry_size - value_size + size]
+        else:
+            offset = struct.unpack(endian + ('Q' if big else 'I'), entry[entry_size - value_size:])[0]
+            data = read_at(offset, size)
+            if data is None:
+                return None
+        tags[LAYOUT_TAGS[tag]] = np.frombuffer(data, dtype=endian + TIFF_TYPE_CODES[typ]).astype(np.int64)
+    if 'width' not in tags or 'height' not in tags:
+        raise InvalidUploadData('TIFF has no image size')
+    width, height = int(tags['width'][0]), int(tags['height'][0])
+    tiled = 'tile_offsets' in tags
+    offsets = tags.get('tile_offsets' if tiled else 'strip_offsets')
+    counts = tags.get('tile_counts' if tiled else 'strip_counts')
+    if offsets is None or counts is None or len(offsets) != len(counts):
+        raise InvalidUploadData('TIFF has no strip or tile offsets')
+    planar = int(tags['planar'][0]) if 'planar' in tags else 1
+    return {
+        'width': width,
+        'height': height,
+        'planes': int(tags['samples'][0]) if planar == 2 and 'samples' in tags else 1,
+        'block_height': int(tags['tile_length'][0]) if tiled else int(tags.get('rows_per_strip', [height])[0]),
+        'blocks_across': math.ceil(width / int(tags['tile_width'][0])) if tiled else 1,
+        'ends': offsets + counts,
+    }
+
+def bytes_for_rows(layout, y1):
+    """File size needed before rows [0, y1) of every plane can be read"""
+    block_height = min(layout['block_height'], layout['height']) or layout['height']
+    blocks_down = math.ceil(layout['height'] / block_height)
+    rows = min(blocks_down, math.ceil(y1 / block_height)) * layout['blocks_across']
+    per_plane = blocks_down * layout['blocks_across']
+    needed = [layout['ends'][p * per_plane:p * per_plane + rows] for p in range(layout['planes'])]
+    return int(max(int(n.max()) for n in needed if len(n)))
+
+
+# --- Upload sessions ---
+class UploadSession:
+    """One resumable upload: bytes are appended in order, hashed and probed as they arrive"""
+
+    def __init__(self, upload_id, path, filename, size, expected_sha256=None, created=None):
+        self.id = upload_id
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.expected_sha256 = expected_sha256
+        self.created = created or time.time()
+        self.updated = self.created
+        self.received = 0
+        self.sha256 = None
+        self.layout = None
+        self.status = 'uploading'
+        self.error = None
+        self.owned = False
+        self.discarded = False
+        self._digest = hashlib.sha256()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(threading.Lock())
+
+    @property
+    def complete(self):
+        return self.status == 'complete'
+
+    def _read_at(self, offset, n):
+        if offset + n > self.received:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(n)
+
+    def _fail(self, message):
+        self.status = 'failed'
+        self.error = message
+
+    def write(self, offset, stream, chunk_size=HASH_CHUNK_SIZE):
+        """Append the bytes of `stream` that start at `offset`; returns the new received count
+
+        A chunk that overlaps what is already stored (a retry after a lost
+        response) has its overlapping prefix skipped. A gap raises ValueError.
+        The status is checked before every chunk, so cancel() (a DELETE or an
+        expiry) also stops a request that is still streaming.
+        """
+        with self._lock:
+            if self.status != 'uploading':
+                raise InvalidUploadData(f'Upload is {self.status}')
+            if offset > self.received:
+                raise ValueError(f'Expected offset {self.received}, got {offset}')
+            skip = self.received - offset
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as out:
+                out.seek(self.received)
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    if self.status != 'uploading':
+                        raise InvalidUploadData(f'Upload is {self.status}')
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    if self.received + len(chunk) > self.size:
+                        self._fail('More data than the declared size')
+                        raise InvalidUploadData(self.error)
+                    out.write(chunk)
+                    out.flush()
+                    self._digest.update(chunk)
+                    self.received += len(chunk)
+                    # Per chunk, so a long request that keeps sending never looks stalled or idle
+                    self.updated = time.time()
+                    self._arrived()
+            if self.received == self.size:
+                self._finish()
+            self._notify()
+            return self.received
+
+    def _arrived(self):
+        """Probe the header and wake waiting jobs after every chunk, not just every request"""
+        try:
+            self._probe()
+        except InvalidUploadData as e:
+            self._fail(str(e))
+            self._notify()
+            raise
+        self._notify()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _probe(self):
+        """Validate the TIFF header as soon as it is available and parse the image layout"""
+        if self.layout is None and self.received >= 8:
+            check_tiff_magic(self._read_at(0, 8))
+            self.layout = parse_tiff_layout(self._read_at)
+
+    def _finish(self):
+        self.sha256 = self._digest.hexdigest()
+        if self.expected_sha256 and self.expected_sha256.lower() != self.sha256:
+            self._fail('sha256 does not match the uploaded data')
+        elif self.layout is None:
+            self._fail('Incomplete TIFF header')
+        else:
+            self.status = 'complete'
+
+    def rehash(self):
+        """Rebuild the digest from the bytes on disk (after a restart)"""
+        self._digest = hashlib.sha256()
+        self.received = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    self._digest.update(chunk)
+                    self.received += len(chunk)
+        try:
+            self._probe()
+        except InvalidUploadData as e:
+            self._fail(str(e))
+        if self.received == self.size and self.status == 'uploading':
+            self._finish()
+
+    def cancel(self):
+        """Abort the upload: further chunks (even of a running request) are refused and waiting jobs fail"""
+        if self.status == 'uploading':
+            self._fail('Upload cancelled')
+        self._notify()
+
+    def wait(self, predicate, timeout=None):
+        """Block until predicate(self) holds; raises if the upload fails or no bytes arrive for `timeout` s"""
+        with self._changed:
+            while not predicate(self):
+                if self.status == 'failed':
+                    raise InvalidUploadData(self.error)
+                remaining = None if timeout is None else self.updated + timeout - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'Upload {self.id} stalled')
+                self._changed.wait(remaining if remaining is not None else 5)
+
+    def wait_for_rows(self, y1, timeout=None):
+        """Wait until rows [0, y1) are on disk; y1=None waits for the whole upload"""
+        if y1 is None:
+            self.wait(lambda s: s.complete, timeout)
+        else:
+            needed = bytes_for_rows(self.layout, y1)
+            self.wait(lambda s: s.received >= needed or s.complete, timeout)
+
+    def meta(self):
+        return {'id': self.id, 'path': self.path, 'filename': self.filename, 'size': self.size,
+                'expected_sha256': self.expected_sha256, 'created': self.created}
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'size': self.size,
+            'received': self.received,
+            'progress': round(self.received / self.size, 4) if self.size else 1.0,
+            'tiff': {'width': self.layout['width'], 'height': self.layout['height']} if self.layout else None,
+            'sha256': self.sha256,
+            'error': self.error,
+        }
+
+
+class UploadManager:
+    """Registry of resumable uploads, with a JSON sidecar per session so uploads survive a restart
+
+    `on_create(path)` / `on_discard(path)` let the caller pin and release the
+    upload file with the artifact janitor. Sessions idle longer than `ttl`
+    that no job owns are dropped (and deleted if incomplete).
+    """
+
+    def __init__(self, root, meta_dir, ttl, on_create=None, on_discard=None):
+        self.root = root
+        self.meta_dir = meta_dir
+        self.ttl = ttl
+        self.on_create = on_create
+        self.on_discard = on_discard
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(meta_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.meta_dir, f"{upload_id}.json")
+
+    def create(self, path, filename, size, expected_sha256=None):
+        self.expire()
+        session = UploadSession(uuid.uuid4().hex, path, filename, size, expected_sha256)
+        open(path, 'wb').close()
+        with open(self._meta_path(session.id), 'w') as f:
+            json.dump(session.meta(), f)
+        with self._lock:
+            self._sessions[session.id] = session
+        if self.on_create:
+            self.on_create(path)
+        return session
+
+    def get(self, upload_id):
+        """Session by id, reloading (and re-hashing) it from its sidecar after a restart"""
+        if not all(c in '0123456789abcdef' for c in upload_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is not None:
+                return session
+            try:
+                with open(self._meta_path(upload_id)) as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            session = UploadSession(meta['id'], meta['path'], meta['filename'], meta['size'],
+                                    meta['expected_sha256'], meta['created'])
+            session.rehash()
+            self._sessions[upload_id] = session
+        if self.on_create:
+            self.on_create(session.path)
+        return session
+
+    def claim(self, session):
+        """Hand the upload to a job (uploading may continue); the job calls finish() when done"""
+        with self._lock:
+            if session.owned:
+                raise InvalidUploadData('A job is already running for this upload')
+            session.owned = True
+
+    def unclaim(self, session):
+        """Undo claim() when the job could not be queued"""
+        with self._lock:
+            session.owned = False
+
+    def finish(self, session):
+        """Forget a claimed session once its job is done, keeping the file if it is complete"""
+        self.discard(session)
+
+    def discard(self, session, delete=True):
+        """Drop a session and stop any request still writing to it; later calls do nothing"""
+        with self._lock:
+            if session.discarded:
+                return
+            session.discarded = True
+            self._sessions.pop(session.id, None)
+        session.cancel()
+        self._remove_meta(session.id)
+        if delete and not session.complete and os.path.exists(session.path):
+            os.remove(session.path)
+        if self.on_discard:
+            self.on_discard(session.path)
+
+    def _remove_meta(self, upload_id):
+        try:
+            os.remove(self._meta_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            stale = [s for s in self._sessions.values() if not s.owned and now - s.updated > self.ttl]
+        for session in stale:
+            self.discard(session)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'active': sum(s.status == 'uploading' for s in sessions),
+            'complete': sum(s.complete for s in sessions),
+            'bytes_received': sum(s.received for s in sessions),
+        }
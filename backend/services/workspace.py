@@ -0,0 +1,33 @@
+import os
+from services.artifact_janitor import ArtifactJanitor
+from services.road_cache import RoadResultCache
+from services.upload_sessions import UploadManager
+
+# big_masks: inputs and outputs of the raster blueprints (road extraction, land indices),
+# which share its disk quota, janitor and chunked uploads but queue their jobs separately
+SAVE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "big_masks")
+# Background janitor: disk quota for big_masks and idle time before a job's files are removed
+ARTIFACT_MAX_BYTES = int(os.getenv("ROAD_ARTIFACT_MAX_BYTES", 5 * 1024 ** 3))
+ARTIFACT_TTL = int(os.getenv("ROAD_ARTIFACT_TTL", 2 * 60 * 60))
+JANITOR_INTERVAL = 60
+# Resumable chunked uploads: largest accepted file and idle time before an unfinished upload is dropped
+UPLOAD_MAX_BYTES = int(os.getenv("ROAD_UPLOAD_MAX_BYTES", 4 * 1024 ** 3))
+UPLOAD_TTL = int(os.getenv("ROAD_UPLOAD_TTL", 24 * 60 * 60))
+
+os.makedirs(SAVE_DIR, exist_ok=True)
+
+
+class InvalidUploadError(Exception):
+    """Upload or form options the pipeline can't work with (reported as HTTP 400)"""
+    pass
+
+
+# Content-addressed index of finished road extractions in SAVE_DIR
+result_cache = RoadResultCache(SAVE_DIR)
+artifact_janitor = ArtifactJanitor(SAVE_DIR, ARTIFACT_MAX_BYTES, ARTIFACT_TTL, interval=JANITOR_INTERVAL,
+                                   on_evict=result_cache.forget_prefix,
+                                   on_sweep=lambda: upload_manager.expire())
+
+# Chunked uploads written straight into SAVE_DIR, pinned until their job is done
+upload_manager = UploadManager(SAVE_DIR, os.path.join(SAVE_DIR, '.uploads'), UPLOAD_TTL,
+                               on_create=artifact_janitor.pin, on_discard=artifact_janitor.release)
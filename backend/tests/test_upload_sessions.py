@@ -0,0 +1,73 @@
+import struct
+import threading
+import time
+import pytest
+
+pytest.importorskip('numpy')
+from services.upload_sessions import InvalidUploadData, UploadManager, UploadSession
+
+
+def tiny_tiff(width=64, height=64):
+    """Little-endian, one strip of 8-bit pixels right after the IFD"""
+    entries = [(256, 3, 1, width), (257, 3, 1, height), (278, 3, 1, height),
+               (273, 4, 1, 8 + 2 + 5 * 12 + 4), (279, 4, 1, width * height)]
+    ifd = struct.pack('<H', len(entries))
+    for tag, typ, count, value in entries:
+        ifd += struct.pack('<HHI', tag, typ, count) + struct.pack('<H2x' if typ == 3 else '<I', value)
+    return b'II*\x00' + struct.pack('<I', 8) + ifd + struct.pack('<I', 0) + bytes(width * height)
+
+
+class SlowStream:
+    """A request body that hands out `chunk` bytes every `delay` seconds"""
+
+    def __init__(self, data, chunk, delay, on_read=None):
+        self.data = data
+        self.chunk = chunk
+        self.delay = delay
+        self.on_read = on_read
+        self.reads = 0
+
+    def read(self, n):
+        time.sleep(self.delay)
+        self.reads += 1
+        if self.on_read:
+            self.on_read(self.reads)
+        piece, self.data = self.data[:self.chunk], self.data[self.chunk:]
+        return piece
+
+
+def test_slow_request_is_not_a_stall(tmp_path):
+    data = tiny_tiff()
+    session = UploadSession('a' * 32, str(tmp_path / 'scene.tif'), 'scene.tif', len(data))
+    stream = SlowStream(data, chunk=len(data) // 10 + 1, delay=0.05)
+    writer = threading.Thread(target=session.write, args=(0, stream, len(data) // 10 + 1))
+    writer.start()
+    # The whole request takes ~0.55 s, far past the timeout, but bytes keep arriving
+    session.wait(lambda s: s.complete, timeout=0.2)
+    writer.join()
+    assert session.complete and session.received == len(data)
+
+
+def test_stalled_upload_times_out(tmp_path):
+    session = UploadSession('b' * 32, str(tmp_path / 'scene.tif'), 'scene.tif', 1000)
+    with pytest.raises(TimeoutError):
+        session.wait(lambda s: s.complete, timeout=0.1)
+
+
+def test_cancel_stops_a_running_request(tmp_path):
+    data = tiny_tiff()
+    session = UploadSession('c' * 32, str(tmp_path / 'scene.tif'), 'scene.tif', len(data))
+    stream = SlowStream(data, chunk=512, delay=0, on_read=lambda reads: reads == 3 and session.cancel())
+    with pytest.raises(InvalidUploadData):
+        session.write(0, stream, 512)
+    assert session.status == 'failed' and session.received == 2 * 512
+
+
+def test_discard_is_idempotent(tmp_path):
+    released = []
+    manager = UploadManager(str(tmp_path), str(tmp_path / '.uploads'), ttl=60, on_discard=released.append)
+    session = manager.create(str(tmp_path / 'scene.tif'), 'scene.tif', 100)
+    manager.discard(session)
+    manager.discard(session)
+    assert released == [session.path]
+    assert manager.get(session.id) is None
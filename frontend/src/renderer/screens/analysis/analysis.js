@@ -186,6 +186,35 @@ document.addEventListener('DOMContentLoaded', () => {
   const toggleOverlayBtn = document.getElementById("toggleOverlayBtn");
   let overlayMode = true;
 
+  // Send a file in 8 MB chunks, resuming from the server's offset after a failed request
+  const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+  const UPLOAD_MAX_RETRIES = 20;
+  async function uploadInChunks(file, uploadUrl) {
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+      try {
+        const resp = await fetch(uploadUrl, {
+          method: "PUT",
+          headers: { "Upload-Offset": String(offset) },
+          body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE),
+        });
+        const state = await resp.json();
+        // 409 carries the offset to resume from; other client errors will not go away on retry
+        if (resp.status >= 400 && resp.status < 500 && resp.status !== 409)
+          throw Object.assign(new Error(state.error || "Upload failed"), { fatal: true });
+        if (!resp.ok && resp.status !== 409) throw new Error(state.error || "Upload failed");
+        offset = state.received;
+        failures = 0;
+      } catch (err) {
+        if (err.fatal || ++failures > UPLOAD_MAX_RETRIES) throw err;
+        await new Promise((resolve) => setTimeout(resolve, Math.min(30000, 1000 * 2 ** failures)));
+        const resp = await fetch(uploadUrl).catch(() => null);
+        if (resp && resp.ok) offset = (await resp.json()).received;
+      }
+    }
+  }
+
   if (bigRoadsForm) {
     bigRoadsForm.addEventListener("submit", async (e) => {
       e.preventDefault();
@@ -197,16 +226,66 @@ document.addEventListener('DOMContentLoaded', () => {
         bigRoadsStatus.textContent = "Please select a Sentinel-2 TIFF file.";
         return;
       }
-      const formData = new FormData();
-      formData.append("file", file);
+      let upload = null;
+      let uploaded = false;
       try {
-        const resp = await fetch("http://localhost:5000/api/extract_roads", {
+        // Resumable chunked upload; extraction starts on the first rows while the rest arrives
+        const createForm = new FormData();
+        createForm.append("filename", file.name);
+        createForm.append("size", file.size);
+        const createResp = await fetch("http://localhost:5000/api/uploads", {
           method: "POST",
-          body: formData,
+          body: createForm,
         });
+        upload = await createResp.json();
+        if (!createResp.ok) {
+          const message = upload.error || "Upload failed";
+          upload = null;
+          throw new Error(message);
+        }
+        const submitResp = await fetch(
+          `${upload.upload_url}/extract_roads`,
+          { method: "POST" }
+        );
+        const job = await submitResp.json();
+        if (!submitResp.ok) throw new Error(job.error || "Processing failed");
+        let uploadError = null;
+        uploadInChunks(file, upload.upload_url)
+          .then(() => (uploaded = true))
+          .catch((err) => (uploadError = err));
+        let status = job;
+        let previewShown = false;
+        while (status.status !== "done") {
+          if (uploadError) throw uploadError;
+          await new Promise((resolve) => setTimeout(resolve, 2000));
+          const statusResp = await fetch(job.status_url);
+          status = await statusResp.json();
+          if (status.status === "error")
+            throw new Error(status.error || "Processing failed");
+          const pct = Math.round((status.progress || 0) * 100);
+          const eta = status.eta_s != null ? `, ~${Math.ceil(status.eta_s)}s left` : "";
+          const uploadNote = uploaded ? "" : " (uploading...)";
+          bigRoadsStatus.textContent =
+            (status.status === "queued"
+              ? "Queued..."
+              : `Processing (${status.phase || "starting"}): ${status.patches_done}/${status.patches_total} patches, ${pct}%${eta}`) +
+            uploadNote;
+          // The coarsest tile level is ready before the full-size images: show it as a first view
+          const tilesUrl = status.outputs && status.outputs.tiles_url;
+          if (tilesUrl && !previewShown) {
+            // tiles_url holds a {z}/{x}/{y} URL template per layer
+            const topTile = (layer) => tilesUrl[layer].replace("{z}/{x}/{y}", "0/0/0");
+            bigRoadsOrig.innerHTML = `<img src="${topTile("orig")}" style="width:100%;height:100%;object-fit:contain;"/>`;
+            bigRoadsMask.innerHTML = `<img src="${topTile("mask")}" style="width:100%;height:100%;object-fit:contain;"/>`;
+            bigRoadsOverlay.innerHTML = `<img id="overlayImg" src="${topTile("overlay")}" style="width:100%;height:100%;object-fit:contain;"/>`;
+            bigRoadsResults.style.display = "";
+            previewShown = true;
+          }
+        }
+        const resp = await fetch(job.result_url);
         if (!resp.ok) throw new Error("Processing failed");
         const data = await resp.json();
-        // data: { orig_url, mask_url, overlay_url }
+        // data: { orig_url, mask_url, overlay_url, tiles_url: {layer: template}, tiles_manifest_url }
         bigRoadsOrig.innerHTML = `<img src="${data.orig_url}" style="width:100%;height:100%;object-fit:contain;"/>`;
         bigRoadsMask.innerHTML = `<img src="${data.mask_url}" style="width:100%;height:100%;object-fit:contain;"/>`;
         bigRoadsOverlay.innerHTML = `<img id="overlayImg" src="${data.overlay_url}" style="width:100%;height:100%;object-fit:contain;"/>`;
@@ -215,6 +294,9 @@ document.addEventListener('DOMContentLoaded', () => {
         overlayMode = true;
       } catch (err) {
         bigRoadsStatus.textContent = "Error: " + err.message;
+        // Drop the half-finished upload (and cancel its job) instead of leaving it to the TTL
+        if (upload && !uploaded)
+          fetch(upload.upload_url, { method: "DELETE" }).catch(() => {});
       }
     });
     // Overlay toggle
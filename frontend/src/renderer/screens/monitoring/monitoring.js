@@ -32,6 +32,8 @@ class BuildingChangeDetection {
   constructor() {
     this.preImage = null;
     this.postImage = null;
+    this.preFile = null;
+    this.postFile = null;
     this.isProcessing = false;
     
     this.initializeEventListeners();
@@ -124,11 +126,13 @@ class BuildingChangeDetection {
       
       if (imageType === 'pre') {
         this.preImage = base64Data;
+        this.preFile = file;
         this.updateImagePreview('preImagePreview', 'preImageUpload', base64Data);
         logger.info('Pre-disaster image uploaded successfully');
         speakText('Pre-disaster image uploaded');
       } else {
         this.postImage = base64Data;
+        this.postFile = file;
         this.updateImagePreview('postImagePreview', 'postImageUpload', base64Data);
         logger.info('Post-disaster image uploaded successfully');
         speakText('Post-disaster image uploaded');
@@ -184,15 +188,13 @@ class BuildingChangeDetection {
     speakText('Starting building change detection analysis');
 
     try {
+      // Send the files as multipart (no base64); result images come back as URLs
+      const formData = new FormData();
+      formData.append('pre_image', this.preFile);
+      formData.append('post_image', this.postFile);
       const response = await fetch('http://localhost:5000/api/building-change-detection', {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          pre_image: this.preImage,
-          post_image: this.postImage
-        })
+        body: formData
       });
 
       const data = await response.json();
@@ -227,14 +229,17 @@ class BuildingChangeDetection {
     document.getElementById('totalPixels').textContent = result.total_pixels.toLocaleString();
 
     // Update result images
-    if (result.mask_image) {
-      document.getElementById('maskImage').src = result.mask_image;
+    const maskSrc = result.mask_url || result.mask_image;
+    const comparisonSrc = result.comparison_url || result.comparison_image;
+    const overlaySrc = result.overlay_url || result.overlay_image;
+    if (maskSrc) {
+      document.getElementById('maskImage').src = maskSrc;
     }
-    if (result.comparison_image) {
-      document.getElementById('comparisonImage').src = result.comparison_image;
+    if (comparisonSrc) {
+      document.getElementById('comparisonImage').src = comparisonSrc;
     }
-    if (result.overlay_image) {
-      document.getElementById('overlayImage').src = result.overlay_image;
+    if (overlaySrc) {
+      document.getElementById('overlayImage').src = overlaySrc;
     }
 
     // Show results section
@@ -245,6 +250,8 @@ class BuildingChangeDetection {
     // Clear images
     this.preImage = null;
     this.postImage = null;
+    this.preFile = null;
+    this.postFile = null;
     
     // Reset previews
     ['preImagePreview', 'postImagePreview'].forEach(id => {